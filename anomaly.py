@@ -0,0 +1,344 @@
+"""Unusual sales days from streaming statistics.
+
+Every product and the whole shop keep a ``Baseline`` of their daily
+revenue, updated as sales arrive rather than recomputed from history:
+
+- level and variance of the weekday-adjusted daily total, exact running
+  mean/variance (Welford) for the first ``WARMUP_DAYS`` and exponentially
+  weighted (``ALPHA``) after that, so the baseline follows the season;
+- one multiplicative factor per weekday, learnt the same way (``BETA``);
+- for the shop, revenue per hour of day, to tell how much of a normal
+  day should be done by now.
+
+A sale only adds to its product's and the shop's open-day totals.  The
+first sale of a new day closes the previous one for every product (days
+without any sale count as zero, up to ``MAX_GAP_DAYS``; longer gaps are
+taken as the shop being shut).  A closed day more than ``Z_THRESHOLD``
+standard deviations from its expected total is kept in ``sales_anomaly``.
+``status`` also checks today's takings so far against the share of the
+day that has passed, so an outage shows up before the day is over.  Sales
+back-dated to an already closed day are not counted.
+
+All functions take a sqlite3-compatible DB-API connection and leave
+committing to the caller.
+
+    python anomaly.py rebuild --user 1
+    python anomaly.py show --user 1 --days 30
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import timeseries
+
+SHOP = 0               # product_id of the whole-shop series
+WARMUP_DAYS = 14       # closed days before anything is flagged
+ALPHA = 0.1            # weight of the newest day in level and variance after warm-up
+BETA = 0.05            # weight of the newest week in the weekday factors after warm-up
+Z_THRESHOLD = 3.0
+MIN_SPREAD = 0.1       # standard deviation never below this share of the expected total
+MIN_EXPECTED = 200.0   # ₹; quieter products are too noisy to judge
+MIN_DAY_SHARE = 0.25   # judge today only once this share of a normal day's sales is due
+MAX_GAP_DAYS = 7
+
+
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_baseline (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            day TEXT,
+            day_total FLOAT NOT NULL,
+            days INTEGER NOT NULL,
+            level FLOAT NOT NULL,
+            variance FLOAT NOT NULL,
+            weekday TEXT NOT NULL,
+            hours TEXT,
+            PRIMARY KEY (user_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_anomaly (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            actual FLOAT NOT NULL,
+            expected FLOAT NOT NULL,
+            z FLOAT NOT NULL,
+            PRIMARY KEY (user_id, day, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+# ============= STATISTICS =============
+class Baseline:
+    """Streaming statistics of one daily revenue series, plus its open (current) day"""
+
+    def __init__(self, day=None, day_total=0.0, days=0, level=0.0, variance=0.0, weekday=None, hours=None):
+        self.day = day
+        self.day_total = day_total
+        self.days = days
+        self.level = level
+        self.variance = variance
+        self.weekday = weekday or [1.0] * 7
+        self.hours = hours
+
+    def expected(self, day):
+        """``(expected total, standard deviation)`` for ``day``."""
+        factor = self.weekday[day.weekday()]
+        expected = self.level * factor
+        return expected, max(math.sqrt(self.variance) * factor, MIN_SPREAD * expected)
+
+    def judge(self, day, actual, share=1.0):
+        """z-score of ``actual`` against the first ``share`` of ``day``, or None while unsure.
+
+        The variance of a partial day is taken to grow with the time elapsed.
+        """
+        expected, spread = self.expected(day)
+        if self.days < WARMUP_DAYS or expected < MIN_EXPECTED or spread <= 0 or share <= 0:
+            return None
+        return (actual - expected * share) / (spread * math.sqrt(share))
+
+    def close(self, day, total):
+        """Fold a finished day in; returns ``(expected, z)`` if it was unusual."""
+        expected = self.expected(day)[0]
+        z = self.judge(day, total)
+        flagged = z is not None and abs(z) >= Z_THRESHOLD
+        wd = day.weekday()
+        factor = self.weekday[wd]
+        value = total / factor if factor > 0 else total
+        if flagged:
+            # An outage or a one-off bulk order should not drag the baseline along
+            limit = Z_THRESHOLD * math.sqrt(self.variance)
+            value = min(max(value, self.level - limit), self.level + limit)
+
+        level = self.level
+        alpha = max(1.0 / (self.days + 1), ALPHA)
+        diff = value - level
+        self.level += alpha * diff
+        self.variance = (1 - alpha) * (self.variance + alpha * diff * diff)
+        if level > 0:
+            beta = max(1.0 / (self.days // 7 + 1), BETA)
+            self.weekday[wd] += beta * (min(total / level, 3 * factor) - self.weekday[wd])
+            mean = sum(self.weekday) / 7
+            if mean > 0:
+                self.weekday = [f / mean for f in self.weekday]
+        self.days += 1
+        return (expected, z) if flagged else None
+
+    def advance(self, day):
+        """Close the open day (and empty days up to ``day``); returns ``[(day, total, (expected, z))]`` flagged."""
+        if self.day is None:
+            self.day, self.day_total = day, 0.0
+        if day <= self.day:
+            return []
+        found = [(self.day, self.day_total, self.close(self.day, self.day_total))]
+        gap = (day - self.day).days - 1
+        if gap <= MAX_GAP_DAYS:
+            for i in range(1, gap + 1):
+                empty = self.day + timedelta(days=i)
+                found.append((empty, 0.0, self.close(empty, 0.0)))
+        self.day, self.day_total = day, 0.0
+        return [f for f in found if f[2] is not None]
+
+    def day_share(self, moment):
+        """Share of a normal day's revenue made before ``moment``, from the hourly profile."""
+        total = sum(self.hours or ())
+        if total <= 0:
+            return None
+        done = sum(self.hours[:moment.hour]) + self.hours[moment.hour] * moment.minute / 60
+        return done / total
+
+
+# ============= STORAGE =============
+_COLUMNS = 'product_id, day, day_total, days, level, variance, weekday, hours'
+
+
+def _from_row(row):
+    _, day, day_total, days, level, variance, weekday, hours = row
+    return Baseline(date.fromisoformat(day) if day else None, day_total, days, level, variance,
+                    json.loads(weekday), json.loads(hours) if hours else None)
+
+
+def _load(conn, user_id, product_ids=None):
+    """``{product_id: Baseline}`` of the shop, or only of ``product_ids``."""
+    sql = f'SELECT {_COLUMNS} FROM sales_baseline WHERE user_id = ?'
+    params = [user_id]
+    if product_ids is not None:
+        sql += f' AND product_id IN ({", ".join("?" * len(product_ids))})'
+        params.extend(product_ids)
+    return {row[0]: _from_row(row) for row in conn.execute(sql, params)}
+
+
+def _save(conn, user_id, baselines, found):
+    conn.executemany(f'''
+        INSERT INTO sales_baseline (user_id, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, product_id) DO UPDATE SET
+            day = excluded.day, day_total = excluded.day_total, days = excluded.days, level = excluded.level,
+            variance = excluded.variance, weekday = excluded.weekday, hours = excluded.hours
+    ''', [(user_id, product_id, b.day and str(b.day), b.day_total, b.days, b.level, b.variance,
+           json.dumps([round(f, 6) for f in b.weekday]), json.dumps(b.hours) if b.hours is not None else None)
+          for product_id, b in baselines.items()])
+    conn.executemany('''
+        INSERT OR REPLACE INTO sales_anomaly (user_id, product_id, day, actual, expected, z)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(user_id, product_id, str(day), round(actual, 2), round(expected, 2), round(z, 2))
+          for product_id, day, actual, expected, z in found])
+
+
+def _advance(product_id, baseline, day, found):
+    for closed, actual, (expected, z) in baseline.advance(day):
+        found.append((product_id, closed, actual, expected, z))
+
+
+def _advance_all(baselines, day, found):
+    for product_id, baseline in baselines.items():
+        _advance(product_id, baseline, day, found)
+
+
+# ============= UPDATES =============
+def record_sales(conn, user_id, sales):
+    """Add ``(product_id, quantity, total_amount, date)`` sales to the shop's baselines.
+
+    Two row lookups per batch, plus one pass over the shop's products on
+    the first sale of a day.
+    """
+    sales = sorted(((product_id, amount or 0.0, _to_datetime(moment)) for product_id, _, amount, moment in sales),
+                   key=lambda sale: sale[2])
+    if not sales:
+        return []
+    baselines = _load(conn, user_id, [SHOP] + sorted({sale[0] for sale in sales}))
+    shop = baselines.setdefault(SHOP, Baseline(hours=[0.0] * 24))
+    found = []
+    for product_id, amount, moment in sales:
+        day = moment.date()
+        if shop.day is not None and day > shop.day:
+            # A new day: close the old one for every product, sold today or not
+            baselines.update({pid: b for pid, b in _load(conn, user_id).items() if pid not in baselines})
+            _advance_all(baselines, day, found)
+        for pid in (SHOP, product_id):
+            baseline = baselines.setdefault(pid, Baseline())
+            _advance(pid, baseline, day, found)
+            if baseline.day == day:
+                baseline.day_total += amount
+        if shop.day == day:
+            shop.hours[moment.hour] += amount
+    _save(conn, user_id, baselines, found)
+    return found
+
+
+def rebuild(conn, user_id):
+    """Replay the shop's whole daily history (hot and archived); returns the unusual days found."""
+    ensure_schema(conn)
+    conn.execute('DELETE FROM sales_baseline WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM sales_anomaly WHERE user_id = ?', (user_id,))
+    days = {}
+    for row in timeseries.query(conn, user_id, granularity='day', by='product'):
+        days.setdefault(date.fromisoformat(row['bucket']), []).append((row['key'], row['revenue']))
+    hours = [0.0] * 24
+    for row in timeseries.query(conn, user_id, granularity='hour'):
+        hours[int(row['bucket'][11:13])] += row['revenue']
+
+    baselines = {SHOP: Baseline(hours=hours)}
+    found = []
+    for day in sorted(days):
+        _advance_all(baselines, day, found)
+        for product_id, revenue in days[day]:
+            product = baselines.setdefault(product_id, Baseline())
+            _advance(product_id, product, day, found)
+            product.day_total += revenue
+            baselines[SHOP].day_total += revenue
+    _save(conn, user_id, baselines, found)
+    return found
+
+
+def backfill(conn):
+    """Build the baselines of every shop that has none yet."""
+    ensure_schema(conn)
+    user_ids = [user_id for (user_id,) in conn.execute('''
+        SELECT id FROM user WHERE id NOT IN (SELECT user_id FROM sales_baseline)
+    ''')]
+    for user_id in user_ids:
+        rebuild(conn, user_id)
+    return user_ids
+
+
+def rebuild_all(conn):
+    """Rebuild every shop (after history was rewritten)."""
+    user_ids = [user_id for (user_id,) in conn.execute('SELECT id FROM user')]
+    for user_id in user_ids:
+        rebuild(conn, user_id)
+    return user_ids
+
+
+# ============= READING =============
+def status(conn, user_id, now=None, days=7, limit=10):
+    """What the dashboard shows: ``{'today', 'recent'}``.
+
+    ``today`` compares the shop's takings so far with the share of a normal
+    day due by ``now`` (None while it is too early to tell); ``recent`` are
+    the unusual days of the last ``days`` days, most unusual first within a
+    day.  Entries have ``product_id`` (``SHOP`` for the whole shop), ``day``,
+    ``actual``, ``expected``, ``z`` and ``kind`` ('high' or 'low').
+    """
+    now = now or datetime.now()
+    today = None
+    shop = _load(conn, user_id, [SHOP]).get(SHOP)
+    share = shop.day_share(now) if shop else None
+    if share is not None and share >= MIN_DAY_SHARE and (shop.day is None or shop.day <= now.date()):
+        actual = shop.day_total if shop.day == now.date() else 0.0
+        z = shop.judge(now.date(), actual, share)
+        if z is not None:
+            expected = shop.expected(now.date())[0] * share
+            today = _entry(SHOP, now.date(), actual, expected, z)
+            today['flagged'] = abs(z) >= Z_THRESHOLD
+    recent = [_entry(*row) for row in conn.execute('''
+        SELECT product_id, day, actual, expected, z FROM sales_anomaly
+        WHERE user_id = ? AND day >= ?
+        ORDER BY day DESC, ABS(z) DESC
+        LIMIT ?
+    ''', (user_id, str(now.date() - timedelta(days=days)), limit))]
+    return {'today': today, 'recent': recent}
+
+
+def _entry(product_id, day, actual, expected, z):
+    return {'product_id': product_id, 'day': str(day), 'actual': round(actual, 2), 'expected': round(expected, 2),
+            'z': round(z, 1), 'kind': 'high' if z > 0 else 'low'}
+
+
+def _to_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Unusual sales days')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='replay the full history')
+    show = sub.add_parser('show', help='list unusual days')
+    show.add_argument('--days', type=int, default=30)
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == 'rebuild':
+        found = rebuild(conn, args.user)
+        conn.commit()
+        print(f'✅ Baselines rebuilt, {len(found)} unusual days in the history')
+        return
+    names = dict(conn.execute('SELECT id, name FROM product WHERE user_id = ?', (args.user,)))
+    last = conn.execute('SELECT MAX(day) FROM sales_anomaly WHERE user_id = ?', (args.user,)).fetchone()[0]
+    now = datetime.combine(date.fromisoformat(last), datetime.max.time()) if last else datetime.now()
+    print(f'🚨 Unusual days in the {args.days} days to {now.date()}:')
+    for entry in status(conn, args.user, now, args.days, limit=1000)['recent']:
+        name = 'Whole shop' if entry['product_id'] == SHOP else names.get(entry['product_id'], entry['product_id'])
+        print(f"   {entry['day']}  {name}: ₹{entry['actual']:,.0f} vs ₹{entry['expected']:,.0f} expected "
+              f"({entry['kind']}, z {entry['z']:+.1f})")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
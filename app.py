@@ -1,17 +1,38 @@
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify
+from flask import Blueprint, Flask, Response, current_app, render_template, request, redirect, session, url_for, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
-from sqlalchemy import func, extract
+from sqlalchemy import bindparam, func, text, insert
+from sqlalchemy.exc import OperationalError
 import calendar
+import json
 import math
+import os
+import time
+import uuid
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-here-change-this'
+import click
+from collections import defaultdict
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///shop.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+import anomaly
+import archive
+import assets
+import auth
+import basket
+import catalog_cache
+import catalog_index
+import fragment_cache
+import live
+import pricing
+import replica
+import sketches
+import stock_ledger
+import timeseries
+import valuation
+
+# Heavy numeric modules (forecasting, replenishment, shop_calendar -> numpy) are imported
+# inside the routes that need them, so workers boot without them
+db = SQLAlchemy()
+shop = Blueprint('shop', __name__)
 
 # Database Models
 class User(db.Model):
@@ -20,6 +41,13 @@ class User(db.Model):
     password = db.Column(db.String(100), nullable=False)
     shop_name = db.Column(db.String(200))
 
+class UserSession(db.Model):
+    """Server-side session (see auth.py); the cookie only holds the signed id"""
+    id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -28,6 +56,7 @@ class Product(db.Model):
     unit = db.Column(db.String(20))
     selling_price = db.Column(db.Float)
     cost_price = db.Column(db.Float)
+    barcode = db.Column(db.String(64))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
 class StockIn(db.Model):
@@ -46,19 +75,170 @@ class Sale(db.Model):
     total_amount = db.Column(db.Float)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    client_id = db.Column(db.String(36))  # set by offline tills, makes sync idempotent
+    basket_id = db.Column(db.String(36))  # shared by the lines of one customer's purchase
+
+class CatalogVersion(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Append-only stock ledger, see stock_ledger.py
+class StockMovement(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    kind = db.Column(db.String(20))  # 'sale', 'stock_in' or 'adjustment'
+    quantity = db.Column(db.Float)   # signed: negative for sales
+    date = db.Column(db.DateTime, default=datetime.utcnow)
+    ref_id = db.Column(db.Integer)   # sale / stock_in id
+
+class StockSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    movement_id = db.Column(db.Integer)  # balance includes movements up to this id
+    date = db.Column(db.DateTime)
+    stock = db.Column(db.Float)
+
+class LedgerCheckpoint(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    movement_id = db.Column(db.Integer, nullable=False, default=0)
+
+class AnalyticsSketch(db.Model):
+    """Approximate all-time analytics for shops that opted in (see sketches.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    state = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
 
-# Create tables
-with app.app_context():
+# Co-purchase counts for basket analysis, see basket.py
+class BasketState(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    baskets = db.Column(db.Integer, nullable=False, default=0)
+    last_sale_id = db.Column(db.Integer, nullable=False, default=0)  # sales up to this id are counted
+
+class BasketItem(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    baskets = db.Column(db.Integer, nullable=False)
+
+class BasketPair(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    product_a = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)  # product_a < product_b
+    product_b = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    baskets = db.Column(db.Integer, nullable=False)
+
+# The basket counter sales are going into, per shop (see _open_basket)
+class OpenBasket(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    basket_id = db.Column(db.String(36), nullable=False)
+    last_sale_at = db.Column(db.DateTime, nullable=False)
+
+# Columns added after the first release; create_all() does not alter existing tables
+ADDED_COLUMNS = {
+    'product': {'barcode': 'VARCHAR(64)'},
+    'sale': {'client_id': 'VARCHAR(36)', 'basket_id': 'VARCHAR(36)'},
+}
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_product_user_barcode ON product (user_id, barcode)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ux_sale_client_id ON sale (client_id)',
+    'CREATE INDEX IF NOT EXISTS ix_sale_basket ON sale (basket_id)',
+    'CREATE INDEX IF NOT EXISTS ix_basket_pair_b ON basket_pair (user_id, product_b)',
+    'CREATE INDEX IF NOT EXISTS ix_stock_movement_product ON stock_movement (product_id, id)',
+    'CREATE INDEX IF NOT EXISTS ix_stock_movement_date ON stock_movement (user_id, date)',
+    'CREATE INDEX IF NOT EXISTS ix_stock_movement_user ON stock_movement (user_id, id)',
+    'CREATE INDEX IF NOT EXISTS ix_stock_movement_ref ON stock_movement (ref_id, kind)',  # integrity checks
+    'CREATE INDEX IF NOT EXISTS ix_stock_snapshot_product ON stock_snapshot (product_id, movement_id)',
+]
+
+def upgrade_schema():
+    """Add missing columns and indexes to an existing database"""
+    import shop_calendar  # pulls in numpy
+    
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in db.session.execute(text(f'PRAGMA table_info({table})'))}
+        for name, ddl in columns.items():
+            if name not in existing:
+                db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+    for statement in INDEXES:
+        db.session.execute(text(statement))
+    # Start price history at today's prices, before archived totals are costed from it
+    pricing.backfill(db.session.connection().connection)
+    archive.ensure_schema(db.session.connection().connection)
+    # Seed the stock ledger from existing history the first time
+    stock_ledger.backfill(db.session.connection().connection)
+    basket.backfill(db.session.connection().connection)
+    anomaly.backfill(db.session.connection().connection)
+    shop_calendar.ensure_schema(db.session.connection().connection)
+    # Hash passwords left in plaintext by older versions
+    auth.migrate_plaintext(db.session.connection().connection, current_app.config['PASSWORD_HASH_ITERATIONS'])
+    db.session.commit()
+
+def init_db():
+    """Create missing tables, then upgrade the schema of existing ones"""
     db.create_all()
+    upgrade_schema()
+
+@click.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema: flask --app app init-db"""
+    init_db()
+    click.echo('✅ Database schema up to date')
+
+def _raw_connection():
+    """sqlite3 DB-API connection bound to the current session's transaction"""
+    return db.session.connection().connection
+
+def _report_connection():
+    """Read-only connection for report routes listed in REPORT_STALENESS, else the session's"""
+    return report_reads.for_request() or _raw_connection()
+
+# Per-process product catalog cache and typeahead indexes; other workers'
+# catalog changes are picked up by polling the catalog_version row
+product_cache = catalog_cache.CatalogCache()
+catalog_indexes = catalog_index.CatalogIndexes()
+product_cache.on_reload(catalog_indexes.invalidate)
+valuation_reports = valuation.ReportCache()
+# Report routes read snapshots or a backup-API replica instead of the primary
+report_reads = replica.ReadRouter()
+
+def _catalog(user_id):
+    """{product_id: ProductInfo} for the shop, without loading product rows"""
+    return product_cache.products(_raw_connection(), user_id)
+
+def _catalog_index(user_id):
+    products = _catalog(user_id)  # polls the version first, dropping a stale index
+    return catalog_indexes.get(user_id, products.values)
+
+def _data_version(user_id, conn=None):
+    """Changes whenever the shop's catalog, stock or sales change"""
+    conn = conn or _raw_connection()
+    last_movement = conn.execute('SELECT MAX(id) FROM stock_movement WHERE user_id = ?', (user_id,)).fetchone()[0]
+    return (catalog_cache.current_version(conn, user_id), last_movement or 0)
+
+def _fragment_scope():
+    if 'user_id' not in session:
+        return None
+    # As seen by the report's own connection, so fragments rendered from a
+    # replica are keyed by the data they show
+    return (session['user_id'],) + _data_version(session['user_id'], _report_connection())
+
+def _commit_catalog_change(user_id, product):
+    """Commit a product add/edit, bumping the catalog version in the same transaction"""
+    db.session.flush()
+    version = catalog_cache.bump_version(_raw_connection(), user_id)
+    db.session.commit()
+    product_cache.write_through(user_id, product, version)
+    _catalog_index(user_id).add(product)
 
 # Routes
-@app.route('/')
+@shop.route('/')
 def index():
     if 'user_id' in session:
         return redirect('/dashboard')
     return redirect('/login')
 
-@app.route('/register', methods=['GET', 'POST'])
+@shop.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -69,7 +249,8 @@ def register():
         if existing_user:
             return "Username already exists! Try another."
         
-        new_user = User(username=username, password=password, shop_name=shop_name)
+        new_user = User(username=username, shop_name=shop_name,
+                        password=auth.hash_password(password, current_app.config['PASSWORD_HASH_ITERATIONS']))
         db.session.add(new_user)
         db.session.commit()
         
@@ -77,88 +258,230 @@ def register():
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@shop.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        user = User.query.filter_by(username=username, password=password).first()
+        iterations = current_app.config['PASSWORD_HASH_ITERATIONS']
+        user = User.query.filter_by(username=username).first()
         
-        if user:
+        if user is None:
+            auth.verify_dummy(password, iterations)
+        elif auth.verify_password(password, user.password):
+            if auth.needs_rehash(user.password, iterations):
+                user.password = auth.hash_password(password, iterations)
+                db.session.commit()
+            session.clear()
+            session.regenerate()
             session['user_id'] = user.id
             session['username'] = user.username
             return redirect('/dashboard')
-        else:
-            return "Invalid credentials! Try again."
+        return "Invalid credentials! Try again."
     
     return render_template('login.html')
 
-@app.route('/logout')
+@shop.route('/logout')
 def logout():
     session.clear()
     return redirect('/login')
 
 # ============= DASHBOARD =============
-@app.route('/dashboard')
+@shop.route('/dashboard')
 def dashboard():
     if 'user_id' not in session:
         return redirect('/login')
     
-    user_id = session['user_id']
+    state = _dashboard_state(session['user_id'])
+    return render_template('dashboard.html', 
+                         username=session['username'],
+                         total_today=state['today'],
+                         total_month=state['month'],
+                         total_products=state['total_products'],
+                         low_stock=len(state['low_stock']),
+                         recent_sales=state['recent_sales'],
+                         anomalies=state['anomalies'])
+
+# ============= LIVE DASHBOARD =============
+# Open dashboards subscribe to /api/dashboard/stream; sales and stock
+# changes are pushed to them by the request that made them
+LOW_STOCK_LEVEL = 10
+
+live_broker = live.Broker()
+
+def _dashboard_state(user_id):
+    """Everything the dashboard shows, plus what live streams need to keep it current"""
+    conn = _raw_connection()
     
-    # Today's sales
+    # Today's and this month's sales from one daily series
     today = datetime.now().date()
-    today_sales = Sale.query.filter(
-        func.date(Sale.date) == today,
-        Sale.user_id == user_id
-    ).all()
-    
-    total_today = sum(sale.total_amount for sale in today_sales)
-    
-    # This month's sales
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    monthly_sales = Sale.query.filter(
-        extract('month', Sale.date) == current_month,
-        extract('year', Sale.date) == current_year,
-        Sale.user_id == user_id
-    ).all()
-    
-    total_month = sum(sale.total_amount for sale in monthly_sales)
-    
-    # Total products
-    total_products = Product.query.filter_by(user_id=user_id).count()
+    month_days = timeseries.series(conn, user_id, today.replace(day=1), today + timedelta(days=1), 'day')
     
     # Low stock products (less than 10 items)
-    low_stock = Product.query.filter(
+    low_stock = {pid for (pid,) in db.session.query(Product.id).filter(
         Product.user_id == user_id,
-        Product.current_stock < 10
-    ).count()
+        Product.current_stock < LOW_STOCK_LEVEL
+    )}
     
     # Recent sales for table
     recent_sales = Sale.query.filter_by(user_id=user_id).order_by(Sale.date.desc()).limit(5).all()
+    catalog = _catalog(user_id)
     
-    recent_sales_data = []
-    for sale in recent_sales:
-        product = Product.query.get(sale.product_id)
-        recent_sales_data.append({
-            'product_name': product.name if product else 'Unknown',
-            'quantity': sale.quantity,
-            'total': sale.total_amount,
-            'time': sale.date.strftime('%H:%M')
-        })
+    last_movement = conn.execute('SELECT MAX(id) FROM stock_movement WHERE user_id = ?', (user_id,)).fetchone()[0]
+    return {
+        'day': today,
+        'today': month_days[-1]['revenue'],
+        'month': sum(day['revenue'] for day in month_days),
+        'total_products': len(catalog),
+        'low_stock': low_stock,
+        'recent_sales': [_sale_event(catalog.get(sale.product_id), sale.quantity, sale.total_amount, sale.date)
+                         for sale in recent_sales],
+        'anomalies': _anomalies(conn, user_id, catalog),
+        # Ledger position covered by this state, and movements this worker
+        # published since (see _check_live_dashboards)
+        'seen_movement': last_movement or 0,
+        'own_movements': 0,
+    }
+
+def _anomalies(conn, user_id, catalog):
+    """Unusual sales days of the last week, today's takings first if they look wrong (see anomaly.py)"""
+    status = anomaly.status(conn, user_id, datetime.now())
+    entries = [status['today']] if status['today'] and status['today']['flagged'] else []
+    entries += status['recent']
+    for entry in entries:
+        product = catalog.get(entry['product_id'])
+        entry['name'] = 'Whole shop' if entry['product_id'] == anomaly.SHOP else (product.name if product else 'Unknown')
+        entry['today'] = entry is status['today']
+    return entries
+
+def _sale_event(product, quantity, total, date):
+    return {
+        'product_name': product.name if product else 'Unknown',
+        'quantity': quantity,
+        'total': total,
+        'time': date.strftime('%H:%M')
+    }
+
+def _live_totals(state):
+    return {'today': state['today'], 'month': state['month'],
+            'low_stock': len(state['low_stock']), 'total_products': state['total_products']}
+
+def _publish_dashboard(user_id, sales=(), product_ids=(), movements=0):
+    """Push committed sales (``(product, quantity, total, date)``) and stock changes to open dashboards"""
+    if user_id not in live_broker.state:
+        return  # nobody is watching
+    stock = dict(db.session.query(Product.id, Product.current_stock).filter(Product.id.in_(list(product_ids)))) \
+        if product_ids else {}
     
-    return render_template('dashboard.html', 
-                         username=session['username'],
-                         total_today=total_today,
-                         total_month=total_month,
-                         total_products=total_products,
-                         low_stock=low_stock,
-                         recent_sales=recent_sales_data)
+    events = []
+    with live_broker.lock:
+        state = live_broker.state.get(user_id)
+        if state is None:
+            return
+        if state['day'] != datetime.now().date():
+            stale = True
+        else:
+            stale = False
+            for product, quantity, total, date in sales:
+                if date.date() == state['day']:
+                    state['today'] += total
+                if (date.year, date.month) == (state['day'].year, state['day'].month):
+                    state['month'] += total
+                sale = _sale_event(product, quantity, total, date)
+                state['recent_sales'] = [sale] + state['recent_sales'][:4]
+                events.append(('sale', sale))
+            for product_id, level in stock.items():
+                low = (level or 0) < LOW_STOCK_LEVEL
+                if low != (product_id in state['low_stock']):
+                    (state['low_stock'].add if low else state['low_stock'].discard)(product_id)
+                    product = _catalog(user_id).get(product_id)
+                    events.append(('stock', {'product_id': product_id, 'name': product.name if product else 'Unknown',
+                                             'stock': level, 'low': low}))
+            state['own_movements'] += movements
+            events.append(('totals', _live_totals(state)))
+    if stale:
+        _refresh_dashboard(user_id)  # first write of a new day
+        return
+    for event, data in events:
+        live_broker.publish(user_id, event, json.dumps(data))
+
+def _refresh_payload(state):
+    """JSON of a 'refresh' event: everything the open dashboard shows"""
+    return json.dumps(dict(_live_totals(state), recent_sales=state['recent_sales'], anomalies=state['anomalies']))
+
+def _refresh_dashboard(user_id):
+    state = _dashboard_state(user_id)
+    with live_broker.lock:
+        if user_id not in live_broker.state:
+            return
+        live_broker.state[user_id] = state
+        data = _refresh_payload(state)
+    live_broker.publish(user_id, 'refresh', data)
+
+def _check_live_dashboards(user_ids):
+    """Reload shops changed by other workers (or a new day) and push the result once"""
+    conn = _raw_connection()
+    today = datetime.now().date()
+    for user_id in user_ids:
+        with live_broker.lock:
+            state = live_broker.state.get(user_id)
+            if state is None:
+                continue
+            seen, own, day = state['seen_movement'], state['own_movements'], state['day']
+        count, last = conn.execute('SELECT COUNT(*), MAX(id) FROM stock_movement WHERE user_id = ? AND id > ?',
+                                   (user_id, seen)).fetchone()
+        if count > own or day != today:
+            _refresh_dashboard(user_id)
+        elif count:
+            # Only this worker's own, already published, movements
+            with live_broker.lock:
+                state['seen_movement'] = last
+                state['own_movements'] -= count
+    db.session.remove()
+
+live_poller = live.Poller(live_broker, _check_live_dashboards)
+
+@shop.route('/api/dashboard/stream')
+def dashboard_stream():
+    """Server-sent events keeping an open dashboard current: sale, stock, totals and refresh"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    user_id = session['user_id']
+    subscription = live_broker.subscribe(user_id, lambda: _dashboard_state(user_id))
+    if subscription is None:
+        # Every stream slot of this worker is taken; the browser retries later
+        return Response(f"retry: {current_app.config['LIVE_BUSY_RETRY_MS']}\n\n", mimetype='text/event-stream')
+    live_poller.ensure_running(current_app._get_current_object())
+    with live_broker.lock:
+        state = live_broker.state[user_id]
+        initial = _refresh_payload(state)
+    keepalive = current_app.config['LIVE_KEEPALIVE']
+    lifetime = current_app.config['LIVE_STREAM_LIFETIME']
+    
+    def events():
+        try:
+            yield 'retry: 2000\n\n'
+            yield live.format_event('refresh', initial)
+            # Streams end after a while and the browser reconnects, possibly to another worker
+            deadline = time.monotonic() + lifetime
+            while time.monotonic() < deadline:
+                item = subscription.get(keepalive)
+                if item is live.CLOSED:
+                    return
+                # Comments keep proxies from timing out and reveal closed connections
+                yield ': keep-alive\n\n' if item is None else live.format_event(*item)
+        finally:
+            live_broker.unsubscribe(subscription)
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
 
 # ============= INVENTORY (SALES ENTRY) =============
-@app.route('/inventory', methods=['GET', 'POST'])
+@shop.route('/inventory', methods=['GET', 'POST'])
 def inventory():
     if 'user_id' not in session:
         return redirect('/login')
@@ -166,33 +489,48 @@ def inventory():
     user_id = session['user_id']
     
     if request.method == 'POST':
-        product_id = request.form['product_id']
+        product_id = int(request.form['product_id'])
         quantity = float(request.form['quantity'])
         
-        product = Product.query.get(product_id)
+        product = _catalog(user_id).get(product_id)
+        if not product:
+            return "Product not found!"
+        
+        # Check and decrement stock in one statement
+        updated = Product.query.filter(
+            Product.id == product_id,
+            Product.current_stock >= quantity
+        ).update({Product.current_stock: Product.current_stock - quantity}, synchronize_session=False)
         
-        if product.current_stock >= quantity:
+        if updated:
             total = quantity * product.selling_price
+            now = datetime.utcnow()
             
             sale = Sale(
                 product_id=product_id,
                 quantity=quantity,
                 selling_price=product.selling_price,
                 total_amount=total,
-                user_id=user_id
+                date=now,
+                user_id=user_id,
+                basket_id=_open_basket(user_id, now)
             )
             
-            product.current_stock -= quantity
-            
             db.session.add(sale)
+            db.session.flush()
+            stock_ledger.record_movements(_raw_connection(), [
+                (user_id, product_id, 'sale', -quantity, sale.date, sale.id)])
+            sketches.record_sales(_raw_connection(), user_id, [(product_id, quantity, total, sale.date)])
+            anomaly.record_sales(_raw_connection(), user_id, [(product_id, quantity, total, sale.date)])
+            basket.update(_raw_connection(), user_id)
             db.session.commit()
+            _publish_dashboard(user_id, [(product, quantity, total, sale.date)], [product_id], movements=1)
             
             return redirect('/inventory')
         else:
-            return f"Not enough stock! Available: {product.current_stock}"
-    
-    # Get all products for dropdown
-    products = Product.query.filter_by(user_id=user_id).all()
+            available = db.session.query(Product.current_stock).filter_by(id=product_id).scalar()
+            db.session.rollback()
+            return f"Not enough stock! Available: {available}"
     
     # Get today's sales
     today = datetime.now().date()
@@ -201,22 +539,58 @@ def inventory():
         Sale.user_id == user_id
     ).order_by(Sale.date.desc()).all()
     
+    catalog = _catalog(user_id)
     sales_with_names = []
     for sale in today_sales:
-        product = Product.query.get(sale.product_id)
+        product = catalog.get(sale.product_id)
         sales_with_names.append({
             'product_name': product.name if product else 'Unknown',
             'quantity': sale.quantity,
             'total': sale.total_amount,
-            'time': sale.date.strftime('%H:%M')
+            'time': sale.date.strftime('%H:%M'),
+            'basket_id': sale.basket_id
         })
     
+    open_basket = _current_basket(user_id)
     return render_template('inventory.html', 
-                         products=products,
-                         sales=sales_with_names)
+                         sales=sales_with_names,
+                         basket_items=[s for s in sales_with_names if open_basket and s['basket_id'] == open_basket])
+
+@shop.route('/inventory/next-customer', methods=['POST'])
+def next_customer():
+    """Close the counter's open basket; the next sale starts a new one"""
+    if 'user_id' not in session:
+        return redirect('/login')
+    db.session.query(OpenBasket).filter_by(user_id=session['user_id']).delete()
+    db.session.commit()
+    return redirect('/inventory')
+
+def _open_basket(user_id, now):
+    """Id of the basket a counter sale made at ``now`` goes into.
+
+    A basket stays open until "Next customer" or until no sale was added for
+    BASKET_IDLE_SECONDS.  Call inside the sale's transaction: one upsert
+    picks or opens the basket and restarts its idle timer, so every worker,
+    tab and till of the shop agrees on it.
+    """
+    params = {'user_id': user_id, 'new_id': str(uuid.uuid4()), 'now': now,
+              'idle_since': now - timedelta(seconds=current_app.config['BASKET_IDLE_SECONDS'])}
+    return db.session.execute(text('''
+        INSERT INTO open_basket (user_id, basket_id, last_sale_at) VALUES (:user_id, :new_id, :now)
+        ON CONFLICT (user_id) DO UPDATE SET
+            basket_id = CASE WHEN last_sale_at >= :idle_since THEN basket_id ELSE excluded.basket_id END,
+            last_sale_at = excluded.last_sale_at
+        RETURNING basket_id
+    ''').bindparams(bindparam('now', type_=db.DateTime), bindparam('idle_since', type_=db.DateTime)), params).scalar()
+
+def _current_basket(user_id):
+    """Id of the shop's open basket, or None if there is none"""
+    idle_since = datetime.utcnow() - timedelta(seconds=current_app.config['BASKET_IDLE_SECONDS'])
+    return db.session.query(OpenBasket.basket_id).filter(
+        OpenBasket.user_id == user_id, OpenBasket.last_sale_at >= idle_since).scalar()
 
 # ============= STOCK MANAGEMENT =============
-@app.route('/stock', methods=['GET', 'POST'])
+@shop.route('/stock', methods=['GET', 'POST'])
 def stock():
     if 'user_id' not in session:
         return redirect('/login')
@@ -232,6 +606,7 @@ def stock():
             unit = request.form['unit']
             selling_price = float(request.form['selling_price'])
             cost_price = float(request.form['cost_price'])
+            barcode = request.form.get('barcode', '').strip() or None
             
             new_product = Product(
                 name=name,
@@ -239,19 +614,42 @@ def stock():
                 unit=unit,
                 selling_price=selling_price,
                 cost_price=cost_price,
+                barcode=barcode,
                 current_stock=0,
                 user_id=user_id
             )
             db.session.add(new_product)
-            db.session.commit()
+            db.session.flush()
+            pricing.set_price(_raw_connection(), user_id, new_product.id, selling_price, cost_price)
+            _commit_catalog_change(user_id, new_product)
+            if user_id in live_broker.state:
+                _refresh_dashboard(user_id)  # product count changed
+            
+        elif action == 'edit_product':
+            product = Product.query.filter_by(id=request.form['product_id'], user_id=user_id).first()
+            if not product:
+                return "Product not found!"
+            
+            product.name = request.form['name']
+            product.category = request.form['category']
+            product.unit = request.form['unit']
+            product.selling_price = float(request.form['selling_price'])
+            product.cost_price = float(request.form['cost_price'])
+            product.barcode = request.form.get('barcode', '').strip() or None
+            # Keep the old prices for the sales made at them
+            pricing.set_price(_raw_connection(), user_id, product.id, product.selling_price, product.cost_price)
+            _commit_catalog_change(user_id, product)
             
         elif action == 'stock_in':
-            product_id = request.form['product_id']
+            product_id = int(request.form['product_id'])
             quantity = float(request.form['quantity'])
             cost_price = float(request.form['cost_price'])
             
-            product = Product.query.get(product_id)
-            product.current_stock += quantity
+            if product_id not in _catalog(user_id):
+                return "Product not found!"
+            
+            Product.query.filter_by(id=product_id).update(
+                {Product.current_stock: Product.current_stock + quantity}, synchronize_session=False)
             
             stock_entry = StockIn(
                 product_id=product_id,
@@ -260,17 +658,39 @@ def stock():
                 user_id=user_id
             )
             db.session.add(stock_entry)
+            db.session.flush()
+            stock_ledger.record_movements(_raw_connection(), [
+                (user_id, product_id, 'stock_in', quantity, stock_entry.date, stock_entry.id)])
             db.session.commit()
+            _publish_dashboard(user_id, product_ids=[product_id], movements=1)
+            
+        elif action == 'adjust_stock':
+            product_id = int(request.form['product_id'])
+            counted = float(request.form['counted_stock'])
+            
+            if product_id not in _catalog(user_id):
+                return "Product not found!"
+            
+            # Record the difference between the shelf count and the books
+            current = db.session.query(Product.current_stock).filter_by(id=product_id).scalar() or 0
+            if counted != current:
+                Product.query.filter_by(id=product_id).update(
+                    {Product.current_stock: counted}, synchronize_session=False)
+                stock_ledger.record_movements(_raw_connection(), [
+                    (user_id, product_id, 'adjustment', counted - current, datetime.utcnow(), None)])
+            db.session.commit()
+            _publish_dashboard(user_id, product_ids=[product_id], movements=int(counted != current))
     
-    # Get all products
-    products = Product.query.filter_by(user_id=user_id).all()
+    # Only loaded if the cached stock table is out of date
+    products = fragment_cache.Lazy(Product.query.filter_by(user_id=user_id).all)
     
     # Get recent stock in entries
     recent_stock = StockIn.query.filter_by(user_id=user_id).order_by(StockIn.date.desc()).limit(10).all()
     
+    catalog = _catalog(user_id)
     stock_with_names = []
     for entry in recent_stock:
-        product = Product.query.get(entry.product_id)
+        product = catalog.get(entry.product_id)
         stock_with_names.append({
             'product_name': product.name if product else 'Unknown',
             'quantity': entry.quantity,
@@ -281,12 +701,37 @@ def stock():
                          products=products,
                          recent_stock=stock_with_names)
 
-@app.route('/analytics')
+# ============= STOCK VALUATION =============
+def _valuation(user_id):
+    """Today's valuation report, recomputed only when the shop's data changes"""
+    today = datetime.now().date()
+    return valuation_reports.get((user_id,) + _data_version(user_id) + (today,),
+                                 lambda: valuation.compute(_raw_connection(), user_id, today))
+
+@shop.route('/valuation')
+def valuation_report():
+    if 'user_id' not in session:
+        return redirect('/login')
+    
+    report = _valuation(session['user_id'])
+    return render_template('valuation.html', report=report, low_cover_days=7)
+
+@shop.route('/api/stock/valuation')
+def api_stock_valuation():
+    """On-hand value, days of cover and aging per product, category and shop"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    return jsonify(_valuation(session['user_id']))
+
+# ============= ANALYTICS =============
+@shop.route('/analytics')
 def analytics():
     if 'user_id' not in session:
         return redirect('/login')
     
     user_id = session['user_id']
+    catalog = _catalog(user_id)
     
     # Get current date info
     now = datetime.now()
@@ -295,254 +740,143 @@ def analytics():
     current_month_name = calendar.month_name[current_month]
     today_date_formatted = now.strftime('%d %B %Y')
     
-    # ===== TODAY'S SALES =====
+    conn = _report_connection()
     today = now.date()
-    today_sales_data = Sale.query.filter(
-        func.date(Sale.date) == today,
-        Sale.user_id == user_id
-    ).all()
-    today_sales = sum(sale.total_amount for sale in today_sales_data) or 0
+    tomorrow = today + timedelta(days=1)
+    month_start = today.replace(day=1)
+    
+    # ===== DAILY SERIES (LAST 30 DAYS) =====
+    last_30 = timeseries.series(conn, user_id, today - timedelta(days=29), tomorrow, 'day')
+    
+    # ===== MONTHLY SERIES (LAST 6 MONTHS) =====
+    six_months_start = month_start
+    for _ in range(5):
+        six_months_start = (six_months_start - timedelta(days=1)).replace(day=1)
+    last_6_months = timeseries.series(conn, user_id, six_months_start, tomorrow, 'month')
+    
+    # ===== TODAY'S SALES =====
+    today_sales = last_30[-1]['revenue']
     
     # ===== THIS MONTH'S SALES =====
-    monthly_sales_data = Sale.query.filter(
-        extract('month', Sale.date) == current_month,
-        extract('year', Sale.date) == current_year,
-        Sale.user_id == user_id
-    ).all()
-    monthly_sales = sum(sale.total_amount for sale in monthly_sales_data) or 0
+    this_month = last_6_months[-1]
+    monthly_sales = this_month['revenue']
     
     # ===== AVERAGE DAILY SALES (LAST 30 DAYS) =====
-    thirty_days_ago = now - timedelta(days=30)
-    last_30_days_sales = Sale.query.filter(
-        Sale.date >= thirty_days_ago,
-        Sale.user_id == user_id
-    ).all()
+    avg_daily = sum(day['revenue'] for day in last_30) / 30
     
-    if last_30_days_sales:
-        avg_daily = sum(s.total_amount for s in last_30_days_sales) / 30
-    else:
-        avg_daily = 0
+    # All-time figures come from the shop's sketch in approximate mode,
+    # otherwise from the full daily history
+    sketch = sketches.load(conn, user_id)
     
     # ===== BEST DAY EVER =====
-    best_day_data = db.session.query(
-        func.date(Sale.date).label('sale_date'),
-        func.sum(Sale.total_amount).label('daily_total')
-    ).filter(
-        Sale.user_id == user_id
-    ).group_by(
-        func.date(Sale.date)
-    ).order_by(
-        func.sum(Sale.total_amount).desc()
-    ).first()
+    if sketch:
+        best_day_data = sketch.best_day()
+        all_days = None
+    else:
+        # Whole history per day; archived months come from their frozen totals
+        all_days = timeseries.query(conn, user_id, granularity='day')
+        best_day_data = max(all_days, key=lambda day: day['revenue'], default=None)
+        best_day_data = best_day_data and (best_day_data['bucket'], best_day_data['revenue'], 0)
     
     if best_day_data:
-        best_day = best_day_data.daily_total
-        # The date is already a string from func.date()
-        best_day_date = best_day_data.sale_date  # Format: YYYY-MM-DD
+        best_day_date, best_day, best_day_error = best_day_data  # Format: YYYY-MM-DD
     else:
-        best_day = 0
+        best_day, best_day_error = 0, 0
         best_day_date = 'N/A'
     
     # ===== DAILY SALES FOR CHART (LAST 30 DAYS) =====
-    daily_labels = []
-    daily_data = []
-    
-    for i in range(29, -1, -1):
-        date = now - timedelta(days=i)
-        date_str = date.strftime('%Y-%m-%d')
-        day_sales = Sale.query.filter(
-            func.date(Sale.date) == date_str,
-            Sale.user_id == user_id
-        ).all()
-        daily_total = sum(s.total_amount for s in day_sales) or 0
-        
-        daily_labels.append(date.strftime('%d %b'))
-        daily_data.append(daily_total)
+    daily_labels = [day['start'].strftime('%d %b') for day in last_30]
+    daily_data = [day['revenue'] for day in last_30]
     
     # ===== MONTHLY SALES FOR CHART =====
-    monthly_labels = []
-    monthly_data = []
-    
-    for i in range(5, -1, -1):
-        month = current_month - i
-        year = current_year
-        if month <= 0:
-            month += 12
-            year -= 1
-        
-        month_sales = Sale.query.filter(
-            extract('month', Sale.date) == month,
-            extract('year', Sale.date) == year,
-            Sale.user_id == user_id
-        ).all()
-        month_total = sum(s.total_amount for s in month_sales) or 0
-        
-        monthly_labels.append(calendar.month_abbr[month])
-        monthly_data.append(month_total)
-    
-    # ===== WEEKDAY ANALYSIS =====
-    weekday_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    weekday_analysis = []
-    
-    weekday_totals = {0: [], 1: [], 2: [], 3: [], 4: [], 5: [], 6: []}
+    monthly_labels = [calendar.month_abbr[month['start'].month] for month in last_6_months]
+    monthly_data = [month['revenue'] for month in last_6_months]
     
-    all_sales = Sale.query.filter_by(user_id=user_id).all()
+    # Weekday, top product and category sections are cached fragments:
+    # their data is only loaded when the fragment has to be re-rendered
     
-    for sale in all_sales:
-        weekday_num = sale.date.weekday()
-        weekday_totals[weekday_num].append(sale.total_amount)
-    
-    max_avg_sales = 1  # Prevent division by zero in template
-    for day_num in range(7):
-        if weekday_totals[day_num]:
-            avg_sales = sum(weekday_totals[day_num]) / len(weekday_totals[day_num])
-            transactions = len(weekday_totals[day_num])
-            max_avg_sales = max(max_avg_sales, avg_sales)
-        else:
-            avg_sales = 0
-            transactions = 0
-        
-        weekday_analysis.append({
-            'day': weekday_names[day_num],
-            'avg_sales': avg_sales,
-            'transactions': transactions
-        })
+    # ===== WEEKDAY ANALYSIS =====
+    def load_weekday_analysis():
+        weekday_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        if sketch:
+            for day_num, (avg_sales, margin, transactions) in enumerate(sketch.weekday_averages()):
+                yield {
+                    'day': weekday_names[day_num],
+                    'avg_sales': avg_sales,
+                    'avg_sales_error': margin,
+                    'transactions': transactions
+                }
+            return
+        weekday_totals = timeseries.totals(conn, user_id, by='weekday')
+        for day_num in range(7):
+            totals = weekday_totals.get(day_num)
+            yield {
+                'day': weekday_names[day_num],
+                'avg_sales': totals['revenue'] / totals['transactions'] if totals else 0,
+                'transactions': totals['transactions'] if totals else 0
+            }
     
     # ===== TOP PRODUCTS =====
-    products = Product.query.filter_by(user_id=user_id).all()
-    product_sales = []
-    
-    for product in products:
-        sales = Sale.query.filter(
-            Sale.product_id == product.id,
-            Sale.user_id == user_id
-        ).all()
-        
-        if sales:
-            total_qty = sum(s.quantity for s in sales)
-            total_revenue = sum(s.total_amount for s in sales)
-            
-            product_sales.append({
-                'name': product.name,
-                'quantity': total_qty,
-                'revenue': total_revenue
-            })
+    def load_top_products():
+        if sketch:
+            return [dict(product, name=catalog[product['product_id']].name)
+                    for product in sketch.top_products(5) if product['product_id'] in catalog]
+        product_sales = []
+        for product_id, totals in timeseries.totals(conn, user_id, by='product').items():
+            product = catalog.get(product_id)
+            if product:
+                product_sales.append({
+                    'name': product.name,
+                    'quantity': totals['units'],
+                    'revenue': totals['revenue']
+                })
+        return sorted(product_sales, key=lambda x: x['revenue'], reverse=True)[:5]
     
-    top_products = sorted(product_sales, key=lambda x: x['revenue'], reverse=True)[:5]
+    # ===== CATEGORY BREAKDOWN =====
+    def load_category_data():
+        return [{
+            'category': cat,
+            'sales': totals['units'],
+            'revenue': totals['revenue']
+        } for cat, totals in timeseries.totals(conn, user_id, by='category', start=month_start, end=tomorrow).items() if cat]
     
     # ===== LAST 7 DAYS DETAILS =====
     last_7_days = []
     
-    for i in range(6, -1, -1):
-        date = now - timedelta(days=i)
-        date_str = date.strftime('%Y-%m-%d')
-        
-        day_sales = Sale.query.filter(
-            func.date(Sale.date) == date_str,
-            Sale.user_id == user_id
-        ).all()
-        
-        if day_sales:
-            transactions = len(day_sales)
-            items = sum(s.quantity for s in day_sales)
-            revenue = sum(s.total_amount for s in day_sales)
-            
-            profit = 0
-            for sale in day_sales:
-                product = Product.query.get(sale.product_id)
-                if product:
-                    profit += sale.quantity * (product.selling_price - product.cost_price)
-            
-            margin = round((profit / revenue * 100) if revenue > 0 else 0, 1)
-        else:
-            transactions = 0
-            items = 0
-            revenue = 0
-            profit = 0
-            margin = 0
-        
+    for day in last_30[-7:]:
+        revenue = day['revenue']
         last_7_days.append({
-            'date': date.strftime('%d %b'),
-            'day_name': date.strftime('%A'),
-            'transactions': transactions,
-            'items': items,
+            'date': day['start'].strftime('%d %b'),
+            'day_name': day['start'].strftime('%A'),
+            'transactions': day['transactions'],
+            'items': day['units'],
             'revenue': revenue,
-            'profit': profit,
-            'margin': margin
+            'profit': day['profit'],
+            'margin': round((day['profit'] / revenue * 100) if revenue > 0 else 0, 1)
         })
     
     # ===== CURRENT MONTH PROFIT =====
-    current_month_profit = 0
-    for sale in monthly_sales_data:
-        product = Product.query.get(sale.product_id)
-        if product:
-            current_month_profit += sale.quantity * (product.selling_price - product.cost_price)
+    current_month_profit = this_month['profit']
     
     profit_margin = round((current_month_profit / monthly_sales * 100) if monthly_sales > 0 else 0, 1)
     
-    # ===== CATEGORY BREAKDOWN =====
-    categories = {}
-    for sale in monthly_sales_data:
-        product = Product.query.get(sale.product_id)
-        if product and product.category:
-            if product.category not in categories:
-                categories[product.category] = {
-                    'sales': 0,
-                    'revenue': 0
-                }
-            categories[product.category]['sales'] += sale.quantity
-            categories[product.category]['revenue'] += sale.total_amount
-    
-    category_data = []
-    max_category_revenue = 1  # Prevent division by zero
-    for cat, data in categories.items():
-        category_data.append({
-            'category': cat,
-            'sales': data['sales'],
-            'revenue': data['revenue']
-        })
-        max_category_revenue = max(max_category_revenue, data['revenue'])
-    
     # ===== MONTHS DATA FOR TABLE =====
-    months_data = []
-    for i in range(5, -1, -1):
-        month = current_month - i
-        year = current_year
-        if month <= 0:
-            month += 12
-            year -= 1
-        
-        month_sales = Sale.query.filter(
-            extract('month', Sale.date) == month,
-            extract('year', Sale.date) == year,
-            Sale.user_id == user_id
-        ).all()
-        
-        month_total = sum(s.total_amount for s in month_sales) or 0
-        
-        month_profit = 0
-        for sale in month_sales:
-            product = Product.query.get(sale.product_id)
-            if product:
-                month_profit += sale.quantity * (product.selling_price - product.cost_price)
-        
-        months_data.append({
-            'month': calendar.month_abbr[month],
-            'sales': month_total,
-            'profit': month_profit
-        })
+    months_data = [{
+        'month': calendar.month_abbr[month['start'].month],
+        'sales': month['revenue'],
+        'profit': month['profit']
+    } for month in last_6_months]
     
     # ===== ADDITIONAL METRICS =====
-    unique_days = db.session.query(func.date(Sale.date)).distinct().filter(Sale.user_id == user_id).count()
-    
-    total_transactions = Sale.query.filter_by(user_id=user_id).count()
+    if sketch:
+        unique_days, unique_days_error = (round(value) for value in sketch.active_days())
+        total_transactions = sketch.transactions
+    else:
+        unique_days, unique_days_error = len(all_days), 0
+        total_transactions = sum(day['transactions'] for day in all_days)
     avg_transaction = (monthly_sales / total_transactions) if total_transactions > 0 else 0
     
-    ytd_sales = Sale.query.filter(
-        extract('year', Sale.date) == current_year,
-        Sale.user_id == user_id
-    ).all()
-    ytd_total = sum(s.total_amount for s in ytd_sales) or 0
+    ytd_total = timeseries.series(conn, user_id, today.replace(month=1, day=1), tomorrow, 'year')[0]['revenue']
     
     return render_template('analytics.html',
                          # Date info
@@ -554,12 +888,15 @@ def analytics():
                          monthly_sales=monthly_sales,
                          avg_daily=avg_daily,
                          best_day=best_day,
+                         best_day_error=best_day_error,
                          best_day_date=best_day_date,
                          
                          # Additional metrics
                          ytd_sales=ytd_total,
                          avg_transaction=avg_transaction,
                          unique_days=unique_days,
+                         unique_days_error=unique_days_error,
+                         approximate=sketch is not None,
                          
                          # Charts data
                          daily_labels=daily_labels,
@@ -568,26 +905,40 @@ def analytics():
                          monthly_data=monthly_data,
                          
                          # Analysis tables
-                         weekday_analysis=weekday_analysis,
-                         top_products=top_products,
+                         weekday_analysis=fragment_cache.Lazy(load_weekday_analysis),
+                         top_products=fragment_cache.Lazy(load_top_products),
                          last_7_days=last_7_days,
-                         category_data=category_data,
+                         category_data=fragment_cache.Lazy(load_category_data),
                          months_data=months_data,
                          
-                         # For template calculations
-                         max_avg_sales=max_avg_sales,
-                         max_category_revenue=max_category_revenue,
-                         
                          # Current month details
                          current_month=current_month_name,
                          monthly_profit=current_month_profit,
                          profit_margin=profit_margin)
+@shop.route('/analytics/mode', methods=['POST'])
+def analytics_mode():
+    """Switch the shop between exact and approximate (sketch-based) all-time figures"""
+    if 'user_id' not in session:
+        return redirect('/login')
+    
+    user_id = session['user_id']
+    if request.form.get('mode') == 'approximate':
+        # One pass over the history; later sales update the sketch as they happen
+        sketches.rebuild(_raw_connection(), user_id)
+    else:
+        sketches.drop(_raw_connection(), user_id)
+    db.session.commit()
+    return redirect('/analytics')
+
 # ============= FIXED PREDICTION PAGE =============
-@app.route('/prediction')
+@shop.route('/prediction')
 def prediction():
     if 'user_id' not in session:
         return redirect('/login')
     
+    import forecasting
+    import replenishment
+    
     user_id = session['user_id']
     products = Product.query.filter_by(user_id=user_id).all()
     
@@ -596,17 +947,19 @@ def prediction():
     total_recommended_stock = 0
     total_current_stock = 0
     
-    # Get last 90 days sales for trend analysis
-    ninety_days_ago = datetime.now() - timedelta(days=90)
+    # Forecast every product in one batch from a single grouped history query
+    engine = forecasting.get_engine(current_app.config['FORECAST_ENGINE'],
+                                    current_app.config['FORECAST_MODEL_DIR'], user_id)
+    as_of = datetime.now().date() + timedelta(days=1)
+    history = forecasting.load_history(_report_connection(), user_id,
+                                       since=as_of - timedelta(days=engine.history_days(as_of)),
+                                       until=as_of)
+    forecasts = engine.predict(history, as_of)
     
     for product in products:
-        # Get last 90 days sales
-        sales_90d = Sale.query.filter(
-            Sale.product_id == product.id,
-            Sale.date >= ninety_days_ago
-        ).order_by(Sale.date).all()
+        forecast = forecasts.get(product.id)
         
-        if not sales_90d:
+        if not forecast:
             # No sales data, use default prediction
             predictions.append({
                 'product_name': product.name,
@@ -618,91 +971,17 @@ def prediction():
             })
             continue
         
-        # Group sales by day for time series
-        daily_sales = {}
-        for sale in sales_90d:
-            date_str = sale.date.strftime('%Y-%m-%d')
-            if date_str not in daily_sales:
-                daily_sales[date_str] = 0
-            daily_sales[date_str] += sale.quantity
-        
-        # Calculate moving averages
-        sales_values = list(daily_sales.values())
-        if len(sales_values) > 7:
-            # Calculate 7-day moving average for trend
-            moving_avg = sum(sales_values[-7:]) / 7
-            previous_avg = sum(sales_values[-14:-7]) / 7 if len(sales_values) > 14 else moving_avg
-            
-            # Determine trend
-            if moving_avg > previous_avg * 1.1:
-                trend = '📈 Increasing'
-                trend_factor = 1.2
-            elif moving_avg < previous_avg * 0.9:
-                trend = '📉 Decreasing'
-                trend_factor = 0.8
-            else:
-                trend = '➡️ Stable'
-                trend_factor = 1.0
-        else:
-            moving_avg = sum(sales_values) / len(sales_values) if sales_values else 0
-            trend = '📊 Limited data'
-            trend_factor = 1.0
-        
-        # Calculate average daily sales
-        avg_daily = moving_avg if moving_avg > 0 else 0
-        
-        # Seasonal adjustment (check if same month last year had higher sales)
-        current_month = datetime.now().month
-        last_year_sales = Sale.query.filter(
-            Sale.product_id == product.id,
-            extract('month', Sale.date) == current_month,
-            extract('year', Sale.date) == (datetime.now().year - 1)
-        ).all()
-        
-        seasonal_factor = 1.0
-        if last_year_sales:
-            last_year_avg = sum(s.quantity for s in last_year_sales) / 30  # Approximate daily
-            if last_year_avg > avg_daily * 1.2:
-                seasonal_factor = 1.3  # Strong seasonal demand
-            elif last_year_avg > avg_daily:
-                seasonal_factor = 1.1  # Slight seasonal demand
-        
-        # Calculate predicted monthly sales
-        predicted_monthly = avg_daily * 30 * trend_factor * seasonal_factor
-        
-        # Recommended stock (with buffer based on sales variability)
-        if sales_values:
-            std_dev = np.std(sales_values) if len(sales_values) > 1 else avg_daily * 0.3
-            cv = std_dev / avg_daily if avg_daily > 0 else 0.5  # Coefficient of variation
-            
-            # Higher buffer for variable products
-            if cv > 0.5:
-                buffer = 1.4  # 40% buffer for highly variable
-            elif cv > 0.3:
-                buffer = 1.2  # 20% buffer for moderately variable
-            else:
-                buffer = 1.1  # 10% buffer for stable products
-        else:
-            buffer = 1.2
-        
-        recommended = predicted_monthly * buffer
-        
-        # Determine confidence level
-        if len(sales_values) > 60:
-            confidence = 'High'
-        elif len(sales_values) > 30:
-            confidence = 'Medium'
-        else:
-            confidence = 'Low'
+        predicted_monthly = forecast['predicted']
+        recommended = forecast['recommended']
         
         predictions.append({
             'product_name': product.name,
             'predicted_sales': round(predicted_monthly, 1),
             'recommended_stock': round(recommended, 1),
             'current_stock': product.current_stock,
-            'confidence': confidence,
-            'trend': trend,
-            'avg_daily': round(avg_daily, 1)
+            'confidence': forecast['confidence'],
+            'trend': forecast['trend'],
+            'avg_daily': round(forecast['avg_daily'], 1)
         })
         
         total_predicted_sales += predicted_monthly
@@ -712,17 +991,373 @@ def prediction():
     # Sort predictions by recommended stock (highest first)
     predictions.sort(key=lambda x: x['recommended_stock'], reverse=True)
     
-    # Get top 5 products that need restocking
-    need_restock = [p for p in predictions if p['recommended_stock'] > p['current_stock']][:5]
+    # Purchase orders from reorder points / EOQ, most urgent first
+    orders = replenishment.purchase_orders(_report_connection(), user_id, products, engine, as_of,
+                                           history=history, forecasts=forecasts)
     
     return render_template('prediction.html', 
                          predictions=predictions,
-                         need_restock=need_restock,
+                         purchase_orders=orders,
+                         total_order_value=round(sum(o['order_value'] for o in orders), 2),
                          total_predicted=round(total_predicted_sales, 1),
                          total_recommended=round(total_recommended_stock, 1),
                          total_current=round(total_current_stock, 1))
 
-# Add numpy import for prediction
-import numpy as np
+# ============= PRODUCT SEARCH API =============
+def _with_stock(matches):
+    """Attach live stock levels to index matches with one small query"""
+    ids = [m['id'] for m in matches]
+    stock = dict(db.session.query(Product.id, Product.current_stock).filter(Product.id.in_(ids)).all()) if ids else {}
+    return [dict(m, current_stock=stock.get(m['id'], 0)) for m in matches]
+
+@shop.route('/api/products/search')
+def api_product_search():
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    index = _catalog_index(session['user_id'])
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    
+    matches = index.search(query, limit)
+    # Barcode scanners type the full code: put an exact barcode hit first
+    by_barcode = index.lookup_barcode(query)
+    if by_barcode:
+        matches = [by_barcode] + [m for m in matches if m['id'] != by_barcode['id']][:limit - 1]
+    return jsonify({'results': _with_stock(matches)})
+
+@shop.route('/api/products/barcode/<barcode>')
+def api_product_barcode(barcode):
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    match = _catalog_index(session['user_id']).lookup_barcode(barcode)
+    if not match:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(_with_stock([match])[0])
+
+@shop.route('/api/products/<int:product_id>/companions')
+def api_product_companions(product_id):
+    """Products most often bought together with this one, by lift (?limit=, ?min_baskets=)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    user_id = session['user_id']
+    catalog = _catalog(user_id)
+    product = catalog.get(product_id)
+    if not product:
+        return jsonify({'error': 'not found'}), 404
+    try:
+        limit = min(int(request.args.get('limit', 5)), 50)
+        min_baskets = int(request.args.get('min_baskets', 2))
+    except ValueError:
+        return jsonify({'error': 'limit and min_baskets must be integers'}), 400
+    
+    companions = basket.companions(_raw_connection(), user_id, product_id, limit, min_baskets)
+    for companion in companions:
+        other = catalog.get(companion['product_id'])
+        companion['name'] = other.name if other else 'Unknown'
+    return jsonify({'product_id': product_id, 'name': product.name, 'companions': companions})
+
+@shop.route('/api/products/<int:product_id>/prices')
+def api_product_prices(product_id):
+    """Price history of a product, or the prices in effect at ?at=YYYY-MM-DD[THH:MM[:SS]]"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    product = _catalog(session['user_id']).get(product_id)
+    if not product:
+        return jsonify({'error': 'not found'}), 404
+    if 'at' in request.args:
+        try:
+            at = datetime.fromisoformat(request.args['at'])
+        except ValueError:
+            return jsonify({'error': 'at must be an ISO date or datetime'}), 400
+        prices = pricing.price_at(_raw_connection(), product_id, at)
+        if prices is None:
+            return jsonify({'error': 'no price history'}), 404
+        return jsonify({'product_id': product_id, 'at': str(at), 'selling_price': prices[0], 'cost_price': prices[1]})
+    return jsonify({'product_id': product_id, 'name': product.name,
+                    'history': pricing.history(_raw_connection(), product_id)})
+
+# ============= OFFLINE TILL SYNC =============
+@shop.route('/api/sync/sales', methods=['POST'])
+def api_sync_sales():
+    """Apply a batch of till-recorded sales in one transaction.
+
+    Each sale carries a client-generated ``client_id``; replayed ids are
+    acknowledged as duplicates, so a till can safely resend a batch whose
+    response it never received.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    user_id = session['user_id']
+    payload = request.get_json(silent=True)
+    batch = (payload.get('sales') if isinstance(payload, dict) else None) or []
+    if not isinstance(batch, list):
+        return jsonify({'error': 'sales must be a list'}), 400
+    if len(batch) > current_app.config['SYNC_MAX_BATCH']:
+        return jsonify({'error': f"batch too large (max {current_app.config['SYNC_MAX_BATCH']})"}), 413
+    
+    # Take the write lock before the duplicate and stock checks, so no other
+    # sale or sync can commit between reading and applying them
+    _raw_connection().execute('BEGIN IMMEDIATE')
+    catalog = _catalog(user_id)
+    items = [item for item in batch if isinstance(item, dict)]
+    client_ids = [item['client_id'] for item in items if item.get('client_id') and isinstance(item['client_id'], str)]
+    already_applied = {cid for (cid,) in db.session.query(Sale.client_id).filter(Sale.client_id.in_(client_ids))}
+    # Late retries of sales whose month has since been archived
+    months = {str(item.get('date'))[:7] for item in items}
+    already_applied |= archive.archived_client_ids(_raw_connection(), client_ids, months)
+    
+    results = []
+    valid = []
+    seen = set()
+    for item in batch:
+        client_id = item.get('client_id') if isinstance(item, dict) else None
+        if not isinstance(client_id, str):
+            results.append({'client_id': client_id, 'status': 'invalid'})
+            continue
+        if client_id in already_applied or client_id in seen:
+            results.append({'client_id': client_id, 'status': 'duplicate'})
+            continue
+        try:
+            product = catalog.get(int(item['product_id']))
+            quantity = float(item['quantity'])
+            date = datetime.fromisoformat(item['date'])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            product = None
+        # Till clocks are naive local time; an offset would not sort against them
+        if not client_id or not product or not math.isfinite(quantity) or quantity <= 0 or date.tzinfo is not None:
+            results.append({'client_id': client_id, 'status': 'invalid'})
+            continue
+        basket_id = item.get('basket_id')
+        seen.add(client_id)
+        valid.append((date, client_id, product, quantity, str(basket_id)[:36] if basket_id else None))
+    
+    # Resolve stock in the order the sales happened at the till
+    product_ids = {product.id for _, _, product, _, _ in valid}
+    stock = dict(db.session.query(Product.id, Product.current_stock).filter(Product.id.in_(product_ids))) if product_ids else {}
+    rows = []
+    sold = defaultdict(float)
+    for date, client_id, product, quantity, basket_id in sorted(valid, key=lambda v: v[0]):
+        available = stock.get(product.id) or 0
+        if available < quantity:
+            if current_app.config['SYNC_STOCK_CONFLICT'] == 'reject':
+                results.append({'client_id': client_id, 'status': 'rejected', 'available': available})
+                continue
+            status = 'conflict'  # recorded; stock goes negative until reconciled
+        else:
+            status = 'applied'
+        stock[product.id] = available - quantity
+        sold[product.id] += quantity
+        rows.append({
+            'client_id': client_id,
+            'product_id': product.id,
+            'quantity': quantity,
+            'selling_price': product.selling_price,
+            'total_amount': quantity * product.selling_price,
+            'date': date,
+            'user_id': user_id,
+            'basket_id': basket_id
+        })
+        results.append({'client_id': client_id, 'status': status})
+    
+    if rows:
+        db.session.execute(insert(Sale), rows)
+        sale_ids = dict(db.session.query(Sale.client_id, Sale.id).filter(
+            Sale.client_id.in_([row['client_id'] for row in rows])))
+        stock_ledger.record_movements(_raw_connection(), [
+            (user_id, row['product_id'], 'sale', -row['quantity'], row['date'], sale_ids[row['client_id']])
+            for row in rows
+        ])
+        sketches.record_sales(_raw_connection(), user_id, [
+            (row['product_id'], row['quantity'], row['total_amount'], row['date']) for row in rows])
+        anomaly.record_sales(_raw_connection(), user_id, [
+            (row['product_id'], row['quantity'], row['total_amount'], row['date']) for row in rows])
+        basket.update(_raw_connection(), user_id)
+        db.session.execute(
+            text('UPDATE product SET current_stock = current_stock - :quantity WHERE id = :id'),
+            [{'id': pid, 'quantity': qty} for pid, qty in sold.items()]
+        )
+        stock = dict(db.session.query(Product.id, Product.current_stock).filter(Product.id.in_(list(sold))))
+    db.session.commit()
+    _publish_dashboard(user_id, [(catalog.get(row['product_id']), row['quantity'], row['total_amount'], row['date'])
+                                 for row in rows], list(sold), movements=len(rows))
+    
+    counts = defaultdict(int)
+    for result in results:
+        counts[result['status']] += 1
+    return jsonify({
+        'counts': counts,
+        'results': results,
+        'stock': {pid: stock[pid] for pid in sold}
+    })
+
+@shop.route('/api/purchase-orders')
+def api_purchase_orders():
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    import forecasting
+    import replenishment
+    
+    user_id = session['user_id']
+    products = Product.query.filter_by(user_id=user_id).all()
+    engine = forecasting.get_engine(current_app.config['FORECAST_ENGINE'],
+                                    current_app.config['FORECAST_MODEL_DIR'], user_id)
+    orders = replenishment.purchase_orders(_report_connection(), user_id, products, engine)
+    return jsonify({
+        'orders': orders,
+        'total_value': round(sum(o['order_value'] for o in orders), 2)
+    })
+
+# ============= SALES TIME SERIES API =============
+@shop.route('/api/sales/series')
+def api_sales_series():
+    """Sales bucketed by ?granularity=hour|day|week|month|year over [?start, ?end),
+    optionally filtered by ?product_id= (repeatable) and ?category="""
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    user_id = session['user_id']
+    granularity = request.args.get('granularity', 'day')
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') if 'end' in request.args \
+            else datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if 'start' in request.args \
+            else end - timedelta(days=30)
+        product_ids = [int(pid) for pid in request.args.getlist('product_id')] or None
+        if start >= end:
+            raise ValueError('start must be before end')
+        # Refuse before gap-filling: an hourly series over centuries would exhaust the worker
+        max_buckets = current_app.config['SERIES_MAX_BUCKETS']
+        if timeseries.bucket_count(start, end, granularity) > max_buckets:
+            raise ValueError(f'too many {granularity} buckets (max {max_buckets}); shorten the range or use a coarser granularity')
+        series = timeseries.series(_report_connection(), user_id, start, end, granularity,
+                                   product_ids=product_ids, category=request.args.get('category'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'granularity': granularity,
+        'series': [dict(bucket, start=bucket['start'].isoformat(sep=' ')) for bucket in series]
+    })
+
+@shop.route('/api/stock/as-of')
+def api_stock_as_of():
+    """Stock of every product at the end of ?date=YYYY-MM-DD, replayed from the ledger"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    
+    user_id = session['user_id']
+    try:
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d')
+    except (KeyError, ValueError):
+        return jsonify({'error': 'date=YYYY-MM-DD required'}), 400
+    
+    levels = stock_ledger.stock_levels(_raw_connection(), user_id, as_of=f"{day:%Y-%m-%d} 23:59:59.999999")
+    catalog = _catalog(user_id)
+    return jsonify({
+        'date': day.strftime('%Y-%m-%d'),
+        'stock': [
+            {'product_id': pid, 'product_name': catalog[pid].name, 'stock': round(stock, 3)}
+            for pid, stock in levels.items() if pid in catalog
+        ]
+    })
+
+# ============= ERRORS =============
+@shop.app_errorhandler(OperationalError)
+def database_busy(error):
+    """Lock timeouts are load, not bugs: answer 503 so tills and load tests can retry"""
+    if 'database is locked' not in str(error.orig):
+        raise error
+    db.session.rollback()
+    return "Database is busy (database is locked), please retry.", 503, {'Retry-After': '1'}
+
+# ============= APPLICATION FACTORY =============
+def warm_up(app):
+    """Load read-only data once, before gunicorn forks workers (see gunicorn.conf.py)
+
+    Compiled templates, numpy and the forecasting modules, trained models and
+    every shop's catalog/typeahead index are then shared copy-on-write.
+    """
+    import forecasting
+    import replenishment  # pulls in numpy
+    
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    if app.config['FORECAST_ENGINE'] != 'heuristic':
+        forecasting.preload_models(app.config['FORECAST_ENGINE'], app.config['FORECAST_MODEL_DIR'])
+    with app.app_context():
+        for (user_id,) in db.session.query(User.id).all():
+            _catalog_index(user_id)
+        db.session.remove()
+        # Forked workers must not inherit open SQLite connections
+        db.engine.dispose()
+
+def create_app(config=None):
+    """Build the app; the schema is set up separately with `flask --app app init-db`"""
+    app = Flask(__name__)
+    app.secret_key = auth.load_secret_key(app.instance_path)
+    
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///shop.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    
+    # Offline till sync: 'accept' records sales even if stock goes negative
+    # (the goods already left the shop), 'reject' refuses them
+    app.config['SYNC_STOCK_CONFLICT'] = os.environ.get('SYNC_STOCK_CONFLICT', 'accept')
+    app.config['SYNC_MAX_BATCH'] = 1000
+    app.config['BASKET_IDLE_SECONDS'] = 180  # counter sales further apart start a new basket
+    app.config['SERIES_MAX_BUCKETS'] = 10_000  # per /api/sales/series response
+    
+    # Forecasting: 'heuristic' or 'gbm' (trained with `python forecasting.py`)
+    app.config['FORECAST_ENGINE'] = os.environ.get('FORECAST_ENGINE', 'heuristic')
+    app.config['FORECAST_MODEL_DIR'] = os.path.join(app.instance_path, 'models')
+    
+    # Live dashboard streams (server-sent events). Each open stream holds a
+    # server thread, so keep LIVE_MAX_STREAMS below gunicorn's threads per worker
+    app.config['LIVE_MAX_STREAMS'] = int(os.environ.get('LIVE_MAX_STREAMS', 2))
+    app.config['LIVE_KEEPALIVE'] = 15            # seconds between keep-alive comments
+    app.config['LIVE_STREAM_LIFETIME'] = 300     # seconds before the browser reconnects
+    app.config['LIVE_BUSY_RETRY_MS'] = 30_000    # retry delay when no stream slot is free
+    
+    # Rendered template fragments ({% cache %}), LRU-evicted
+    app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 500))
+    app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    
+    # PBKDF2 rounds per password; pick with `python auth.py calibrate`
+    app.config['PASSWORD_HASH_ITERATIONS'] = int(os.environ.get('PASSWORD_HASH_ITERATIONS', auth.DEFAULT_ITERATIONS))
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+    
+    # Reports read a WAL snapshot (0) or a replica copied at most this many
+    # seconds ago, leaving the primary to sale entry; unlisted routes read it
+    app.config['REPORT_STALENESS'] = {
+        'shop.analytics': 60,
+        'shop.prediction': 300,
+        'shop.api_purchase_orders': 300,
+        'shop.api_sales_series': 0,
+    }
+    app.config['REPORT_REPLICA_PATH'] = os.path.join(app.instance_path, 'shop-replica.db')
+    
+    if config:
+        app.config.update(config)
+    
+    db.init_app(app)
+    report_reads.init_app(app, db)
+    # gzip/brotli responses, fingerprinted long-cached static files
+    assets.init_app(app)
+    fragment_cache.init_app(app, _fragment_scope)
+    auth.init_app(app, db)
+    live_broker.max_streams = app.config['LIVE_MAX_STREAMS']
+    app.register_blueprint(shop)
+    app.cli.add_command(init_db_command)
+    return app
+
 if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000)
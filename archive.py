@@ -0,0 +1,264 @@
+"""Archive closed months of sales out of the hot ``sale`` table.
+
+Each archived month's rows move to their own table (``sale_2024_09``, same
+columns) and their per-day, per-product totals, costed at the prices of
+the time (see pricing.py), are frozen in ``sale_day_summary``;
+``sale_archive`` lists the archived months.  The hot table then only holds
+recent sales, so it - and every query on it - stops growing with the
+shop's age.
+
+``timeseries.query`` adds archived data only when the requested range
+reaches an archived month: day and coarser buckets read the frozen
+summary, hourly buckets (or ranges not aligned to whole days) the month
+tables.  Sales back-dated into an archived month by an offline till land in
+``sale`` as usual and are still counted; the next run folds them in.
+
+    python archive.py run --keep-months 3     # archive every closed month older than that
+    python archive.py status
+    python archive.py restore 2024-09         # move a month back into sale
+
+All functions take a sqlite3-compatible DB-API connection and leave
+committing to the caller.
+"""
+import argparse
+import os
+import re
+import sqlite3
+from datetime import date, datetime
+
+import pricing
+
+COLUMNS = 'id, product_id, quantity, selling_price, total_amount, date, user_id, client_id, basket_id'
+
+_MONTH = re.compile(r'^(\d{4})-(\d{2})$')
+
+# Per-day, per-product totals of ``source`` rows in [?, ?), costed at the prices of the time
+_COST_BY_DAY = '''
+    SELECT s.user_id, DATE(s.date) AS day, s.product_id, SUM(s.total_amount) AS revenue,
+           SUM(s.quantity) AS units, COUNT(*) AS transactions,
+           SUM(s.quantity * COALESCE(pp.cost_price, p.cost_price)) AS cost
+    FROM {source} s
+    LEFT JOIN product p ON p.id = s.product_id
+    ''' + pricing.COST_JOIN.format(date='s.date') + '''
+    WHERE s.date >= ? AND s.date < ?
+    GROUP BY 1, 2, 3
+'''
+
+
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sale_archive (
+            month TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            archived_at DATETIME NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sale_day_summary (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            units FLOAT NOT NULL,
+            transactions INTEGER NOT NULL,
+            cost FLOAT,
+            PRIMARY KEY (user_id, day, product_id)
+        ) WITHOUT ROWID
+    ''')
+    # Month tables archived before sales had a basket id
+    for month in archived_months(conn):
+        table = table_name(month)
+        if 'basket_id' not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN basket_id VARCHAR(36)')
+    # Totals frozen before they carried their cost: work it out from the month tables
+    if 'cost' not in {row[1] for row in conn.execute('PRAGMA table_info(sale_day_summary)')}:
+        conn.execute('ALTER TABLE sale_day_summary ADD COLUMN cost FLOAT')
+        pricing.ensure_schema(conn)
+        for month in archived_months(conn):
+            conn.execute(f'''
+                UPDATE sale_day_summary AS d SET cost = c.cost
+                FROM ({_COST_BY_DAY.format(source=table_name(month))}) AS c
+                WHERE d.user_id = c.user_id AND d.day = c.day AND d.product_id = c.product_id
+            ''', tuple(str(d) for d in month_range(month)))
+
+
+def table_name(month):
+    match = _MONTH.match(month)
+    if not match:
+        raise ValueError(f'month must look like YYYY-MM, got {month!r}')
+    return f'sale_{match.group(1)}_{match.group(2)}'
+
+
+def month_range(month):
+    """``(first day, first day of next month)`` as datetimes."""
+    year, mon = int(month[:4]), int(month[5:7])
+    return datetime(year, mon, 1), datetime(year + mon // 12, mon % 12 + 1, 1)
+
+
+def archived_months(conn):
+    """Sorted archived months (``'YYYY-MM'``); empty if archiving was never set up."""
+    try:
+        return [month for (month,) in conn.execute('SELECT month FROM sale_archive ORDER BY month')]
+    except sqlite3.OperationalError:
+        return []
+
+
+def overlapping(months, start=None, end=None):
+    """The ``months`` that intersect ``[start, end)``."""
+    result = []
+    for month in months:
+        first, after = month_range(month)
+        if (start is None or after > start) and (end is None or first < end):
+            result.append(month)
+    return result
+
+
+def sales_sql(conn, start=None, end=None):
+    """FROM-clause source of every sale row (hot and archived) that may fall in ``[start, end)``.
+
+    Just ``sale`` when no archived month is involved, otherwise a UNION ALL
+    subquery with the same columns.  Callers still filter on ``date``.
+    """
+    months = overlapping(archived_months(conn), _to_datetime(start), _to_datetime(end))
+    if not months:
+        return 'sale'
+    parts = [f'SELECT {COLUMNS} FROM sale'] + [f'SELECT {COLUMNS} FROM {table_name(m)}' for m in months]
+    return '(' + ' UNION ALL '.join(parts) + ')'
+
+
+def archived_client_ids(conn, client_ids, months):
+    """Which ``client_ids`` were already archived, looking only in the given ``'YYYY-MM'`` months."""
+    client_ids = list(client_ids)
+    found = set()
+    if not client_ids:
+        return found
+    for month in sorted(set(months) & set(archived_months(conn))):
+        found.update(cid for (cid,) in conn.execute(
+            f'SELECT client_id FROM {table_name(month)} WHERE client_id IN ({", ".join("?" * len(client_ids))})',
+            client_ids))
+    return found
+
+
+def archive_month(conn, month):
+    """Move one month of sales into its archive table; returns the rows moved.
+
+    Re-archiving a month moves rows that arrived late and adds them to the
+    frozen totals.
+    """
+    ensure_schema(conn)
+    pricing.ensure_schema(conn)
+    table = table_name(month)
+    start, end = (str(d) for d in month_range(month))
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            product_id INTEGER,
+            quantity FLOAT,
+            selling_price FLOAT,
+            total_amount FLOAT,
+            date DATETIME,
+            user_id INTEGER,
+            client_id VARCHAR(36),
+            basket_id VARCHAR(36)
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_user_date ON {table} (user_id, date)')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_client_id ON {table} (client_id)')
+
+    moved = conn.execute(f'INSERT INTO {table} ({COLUMNS}) SELECT {COLUMNS} FROM sale WHERE date >= ? AND date < ?',
+                         (start, end)).rowcount
+    conn.execute(f'''
+        INSERT INTO sale_day_summary (user_id, day, product_id, revenue, units, transactions, cost)
+        SELECT user_id, day, product_id, revenue, units, transactions, cost
+        FROM ({_COST_BY_DAY.format(source='sale')}) WHERE true
+        ON CONFLICT (user_id, day, product_id) DO UPDATE SET
+            revenue = revenue + excluded.revenue,
+            units = units + excluded.units,
+            transactions = transactions + excluded.transactions,
+            cost = cost + excluded.cost
+    ''', (start, end))
+    conn.execute('DELETE FROM sale WHERE date >= ? AND date < ?', (start, end))
+    conn.execute(f'''
+        INSERT INTO sale_archive (month, table_name, row_count, archived_at)
+        VALUES (?, ?, (SELECT COUNT(*) FROM {table}), DATETIME('now'))
+        ON CONFLICT (month) DO UPDATE SET row_count = excluded.row_count, archived_at = excluded.archived_at
+    ''', (month, table))
+    return moved
+
+
+def archive(conn, before):
+    """Archive every month that ends on or before ``before``'s month start.
+
+    Returns ``{month: rows moved}``, including archived months that only
+    had late rows to fold in.
+    """
+    cutoff = _to_datetime(before).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = [month for (month,) in conn.execute(
+        "SELECT DISTINCT STRFTIME('%Y-%m', date) FROM sale WHERE date < ? ORDER BY 1", (str(cutoff),))]
+    return {month: archive_month(conn, month) for month in months}
+
+
+def restore_month(conn, month):
+    """Move an archived month back into ``sale`` and drop its archive; returns the rows moved."""
+    if month not in archived_months(conn):
+        raise ValueError(f'{month} is not archived')
+    table = table_name(month)
+    start, end = (str(d)[:10] for d in month_range(month))
+    moved = conn.execute(f'INSERT INTO sale ({COLUMNS}) SELECT {COLUMNS} FROM {table}').rowcount
+    conn.execute('DELETE FROM sale_day_summary WHERE day >= ? AND day < ?', (start, end))
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute('DELETE FROM sale_archive WHERE month = ?', (month,))
+    return moved
+
+
+def clear(conn):
+    """Drop every archived month and its totals (for data generators that rewrite history)."""
+    for month in archived_months(conn):
+        conn.execute(f'DROP TABLE {table_name(month)}')
+    conn.execute('DROP TABLE IF EXISTS sale_archive')
+    conn.execute('DROP TABLE IF EXISTS sale_day_summary')
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive closed months of sales')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='archive closed months')
+    run.add_argument('--keep-months', type=int, default=3, help='recent months (including this one) left in sale')
+    sub.add_parser('status', help='list archived months')
+    restore = sub.add_parser('restore', help='move an archived month back into sale')
+    restore.add_argument('month', help='YYYY-MM')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ensure_schema(conn)
+    if args.command == 'run':
+        today = date.today()
+        index = today.year * 12 + today.month - 1 - (args.keep_months - 1)
+        cutoff = date(index // 12, index % 12 + 1, 1)
+        moved = archive(conn, cutoff)
+        for month, rows in moved.items():
+            print(f'   📦 {month}: {rows} sales archived')
+        print(f'✅ Archived {sum(moved.values())} sales before {cutoff}')
+    elif args.command == 'status':
+        hot = conn.execute('SELECT COUNT(*), MIN(date), MAX(date) FROM sale').fetchone()
+        print(f'🔥 sale: {hot[0]} rows ({hot[1]} .. {hot[2]})')
+        for month, table, rows, archived_at in conn.execute('SELECT * FROM sale_archive ORDER BY month'):
+            print(f'   📦 {month}: {rows} rows in {table} (archived {archived_at})')
+    else:
+        print(f'✅ Restored {restore_month(conn, args.month)} sales from {args.month}')
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
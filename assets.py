@@ -0,0 +1,114 @@
+"""Response compression and static asset fingerprinting.
+
+* HTML, JSON, CSS and JS responses are brotli- (if the ``brotli`` package
+  is installed) or gzip-compressed according to ``Accept-Encoding``.
+  Static files are compressed once at a high level and kept in memory.
+* ``url_for('static', ...)`` appends a short content hash (``?v=...``) and
+  requests carrying the current hash are served with a one-year immutable
+  ``Cache-Control``, so browsers only re-download a file after it changed.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('text/html', 'text/css', 'text/plain', 'application/json',
+                'application/javascript', 'text/javascript', 'image/svg+xml')
+MIN_SIZE = 500                   # bytes; smaller bodies are not worth compressing
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+_lock = threading.Lock()
+_fingerprints = {}               # path -> (mtime, hash)
+_compressed_static = {}          # (path, mtime, encoding) -> bytes
+
+
+def fingerprint(static_folder, filename):
+    """Short content hash of a static file, recomputed only when its mtime changes."""
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:10]
+    with _lock:
+        _fingerprints[path] = (mtime, digest)
+    return digest
+
+
+def choose_encoding(accept_encoding):
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6)
+
+
+def init_app(app):
+    @app.url_defaults
+    def add_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            digest = fingerprint(app.static_folder, values['filename'])
+            if digest:
+                values['v'] = digest
+
+    @app.after_request
+    def compress_response(response):
+        if request.endpoint == 'static' and response.status_code == 200:
+            filename = request.view_args.get('filename', '')
+            if request.args.get('v') and request.args['v'] == fingerprint(app.static_folder, filename):
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.no_cache = True
+
+        if (response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE
+                or 'Content-Encoding' in response.headers
+                or (response.content_length or 0) < MIN_SIZE):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if request.endpoint == 'static' and response.direct_passthrough:
+            # Static file: compress once per file version at the highest level
+            path = os.path.join(app.static_folder, request.view_args.get('filename', ''))
+            key = (path, os.path.getmtime(path), encoding)
+            response.direct_passthrough = False
+            body = _compressed_static.get(key)
+            if body is None:
+                body = compress(response.get_data(), encoding, best=True)
+                with _lock:
+                    _compressed_static[key] = body
+            elif hasattr(response.response, 'close'):
+                response.call_on_close(response.response.close)
+        else:
+            body = compress(response.get_data(), encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        etag, _ = response.get_etag()
+        if etag:
+            # Same content, different bytes: weak ETags still validate If-None-Match
+            response.set_etag(etag, weak=True)
+        return response
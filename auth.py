@@ -0,0 +1,277 @@
+"""Password hashing and server-side sessions.
+
+Passwords are stored as salted PBKDF2-SHA256 strings
+(``pbkdf2_sha256$<iterations>$<salt>$<hash>``).  The iteration count is a
+setting (``PASSWORD_HASH_ITERATIONS``); pick it with the calibration
+benchmark so that a burst of logins - every till at shift change - still
+finishes within a latency budget:
+
+    python auth.py calibrate --budget-ms 500 --burst 30 --workers 3 --threads 4
+    python auth.py migrate          # hash any remaining plaintext passwords
+
+Hashes made with another iteration count, and legacy plaintext rows, are
+re-hashed transparently on the next successful login.
+
+Sessions live in the ``user_session`` table; the cookie only carries a
+signed random id.  Every request reads its row (one primary-key lookup),
+so a logout or login on any worker takes effect on all of them at once.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import secrets
+import sqlite3
+import time
+from datetime import datetime
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+
+ALGORITHM = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = 200_000
+MIN_ITERATIONS = 50_000      # calibration never suggests less than this
+SALT_BYTES = 16
+
+# Verifying against this keeps unknown usernames as slow as wrong passwords
+_DUMMY_HASH = None
+
+
+# ============= PASSWORD HASHING =============
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}'
+
+
+def is_hashed(stored):
+    return (stored or '').startswith(ALGORITHM + '$')
+
+
+def verify_password(password, stored):
+    """True if ``password`` matches ``stored`` (a hash, or a legacy plaintext value)."""
+    if not is_hashed(stored):
+        return hmac.compare_digest((stored or '').encode(), password.encode())
+    _, iterations, salt, digest = stored.split('$')
+    salt = base64.b64decode(salt + '=' * (-len(salt) % 4))
+    computed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, int(iterations))
+    return hmac.compare_digest(_b64(computed), digest)
+
+
+def verify_dummy(password, iterations=DEFAULT_ITERATIONS):
+    """Spend the same time as a real check, for logins with an unknown username."""
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None or int(_DUMMY_HASH.split('$')[1]) != iterations:
+        _DUMMY_HASH = hash_password(secrets.token_hex(8), iterations)
+    verify_password(password, _DUMMY_HASH)
+    return False
+
+
+def needs_rehash(stored, iterations=DEFAULT_ITERATIONS):
+    return not is_hashed(stored) or int(stored.split('$')[1]) != iterations
+
+
+def migrate_plaintext(conn, iterations=DEFAULT_ITERATIONS):
+    """Hash every legacy plaintext password in the ``user`` table; returns how many."""
+    rows = conn.execute('SELECT id, password FROM user WHERE password NOT LIKE ?', (ALGORITHM + '$%',)).fetchall()
+    conn.executemany('UPDATE user SET password = ? WHERE id = ?',
+                     [(hash_password(password, iterations), user_id) for user_id, password in rows])
+    return len(rows)
+
+
+# ============= CALIBRATION =============
+def hashes_per_second(iterations=100_000, seconds=1.0):
+    """Single-core PBKDF2 throughput at ``iterations``."""
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        hash_password('calibration', iterations)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def calibrate(budget_ms=500, burst=30, cores=None, workers=1, threads=1):
+    """Largest iteration count that serves ``burst`` simultaneous logins within ``budget_ms``.
+
+    hashlib releases the GIL while hashing, so logins run in parallel on up
+    to ``min(cores, workers * threads)`` cores; the last login of the burst
+    waits for ``ceil(burst / parallel)`` hashes.
+    """
+    if cores is None:
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = os.cpu_count() or 1
+    parallel = max(1, min(cores, workers * threads))
+    rounds = math.ceil(burst / parallel)
+    per_hash = budget_ms / 1000 / rounds
+    iterations_per_second = hashes_per_second() * 100_000
+    iterations = int(iterations_per_second * per_hash) // 1000 * 1000
+    return {
+        'iterations': max(iterations, MIN_ITERATIONS),
+        'meets_budget': iterations >= MIN_ITERATIONS,
+        'hash_ms': max(iterations, MIN_ITERATIONS) / iterations_per_second * 1000,
+        'parallel': parallel,
+        'rounds': rounds,
+    }
+
+
+# ============= SERVER-SIDE SESSIONS =============
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id; call on login so a pre-login id is never promoted"""
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Sessions stored in the ``user_session`` table."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            data = self._load(sid) if sid else None
+            if data is not None:
+                return ServerSession(data, sid)
+        # Unknown ids are never reused, so a planted cookie cannot fix the session id
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def _load(self, sid):
+        with self.db.engine.connect() as conn:
+            row = conn.execute(text('SELECT data FROM user_session WHERE id = :sid AND expires_at > :now'),
+                               {'sid': sid, 'now': datetime.utcnow()}).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _delete(self, sid):
+        with self.db.engine.begin() as conn:
+            conn.execute(text('DELETE FROM user_session WHERE id = :sid'), {'sid': sid})
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain, path = self.get_cookie_domain(app), self.get_cookie_path(app)
+        if session.replaced_sid:
+            self._delete(session.replaced_sid)
+        if not session:
+            if session.modified and not session.new:
+                # Logged out: forget it everywhere
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        expires_at = datetime.utcnow() + app.permanent_session_lifetime
+        data = dict(session)
+        with self.db.engine.begin() as conn:
+            conn.execute(text('''
+                INSERT INTO user_session (id, user_id, data, expires_at)
+                VALUES (:sid, :user_id, :data, :expires_at)
+                ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, data = excluded.data,
+                                               expires_at = excluded.expires_at
+            '''), {'sid': session.sid, 'user_id': data.get('user_id'), 'data': json.dumps(data),
+                   'expires_at': expires_at})
+            if session.new:
+                # New logins are rare enough to sweep expired sessions on
+                conn.execute(text('DELETE FROM user_session WHERE expires_at <= :now'), {'now': datetime.utcnow()})
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app), domain=domain, path=path)
+
+
+def load_secret_key(instance_path):
+    """SECRET_KEY from the environment, else a random key kept in instance/secret_key.
+
+    The file makes the key survive restarts and be shared by all workers.
+    """
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    path = os.path.join(instance_path, 'secret_key')
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(instance_path, exist_ok=True)
+    key = secrets.token_hex(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it first
+        with open(path) as f:
+            return f.read().strip()
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
+
+
+def init_app(app, db):
+    """Store ``app``'s sessions server-side (table ``user_session``, see ``UserSession``)"""
+    app.session_interface = ServerSessionInterface(db)
+    return app.session_interface
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Password hashing maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    cal = sub.add_parser('calibrate', help='pick PASSWORD_HASH_ITERATIONS for a login latency budget')
+    cal.add_argument('--budget-ms', type=float, default=500, help='worst-case login latency during a burst')
+    cal.add_argument('--burst', type=int, default=30, help='logins arriving at the same moment')
+    cal.add_argument('--workers', type=int, default=1)
+    cal.add_argument('--threads', type=int, default=1)
+    cal.add_argument('--cores', type=int)
+
+    mig = sub.add_parser('migrate', help='hash legacy plaintext passwords')
+    mig.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    mig.add_argument('--iterations', type=int,
+                     default=int(os.environ.get('PASSWORD_HASH_ITERATIONS', DEFAULT_ITERATIONS)))
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        result = calibrate(args.budget_ms, args.burst, args.cores, args.workers, args.threads)
+        print(f'⏱️ {result["parallel"]} logins hash in parallel, {result["rounds"]} rounds for a burst of {args.burst}')
+        print(f'✅ PASSWORD_HASH_ITERATIONS={result["iterations"]} ({result["hash_ms"]:.1f} ms per hash)')
+        if not result['meets_budget']:
+            print(f'   ⚠️ Budget not reachable above the {MIN_ITERATIONS} iteration floor; '
+                  f'add cores/threads or raise the budget')
+    else:
+        conn = sqlite3.connect(args.db)
+        count = migrate_plaintext(conn, args.iterations)
+        conn.commit()
+        conn.close()
+        print(f'✅ Hashed {count} plaintext passwords')
+
+
+if __name__ == '__main__':
+    main()
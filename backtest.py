@@ -0,0 +1,212 @@
+"""Rolling-origin backtest of the forecasting engines.
+
+Replays sales history from a shop database, forecasts from several origins
+with every requested engine and reports accuracy (MAPE / bias) per product
+and per category along with wall-clock time and peak memory per run.
+Products are scored in parallel with a process pool.
+
+    python backtest.py --db instance/shop.db --user 1 --engines heuristic,gbm
+"""
+import argparse
+import copy
+import csv
+import os
+import sqlite3
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+
+import forecasting
+
+
+def load_dataset(db_path, user_id):
+    """Full sales history plus product metadata, read through a read-only connection."""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        last_sale = conn.execute('SELECT MAX(date) FROM sale WHERE user_id = ?', (user_id,)).fetchone()[0]
+        if last_sale is None:
+            return None, {}
+        history = forecasting.load_history(
+            conn, user_id, until=forecasting._to_date(last_sale) + timedelta(days=1))
+        products = {
+            row[0]: {'name': row[1], 'category': row[2] or 'Uncategorised'}
+            for row in conn.execute('SELECT id, name, category FROM product WHERE user_id = ?', (user_id,))
+        }
+    finally:
+        conn.close()
+    return history, products
+
+
+def rolling_origins(history, folds, step, horizon):
+    """The last ``folds`` forecast origins, ``step`` days apart, each with a full horizon of actuals."""
+    last = history.end - timedelta(days=horizon)
+    origins = [last - timedelta(days=step * i) for i in range(folds)]
+    return sorted(o for o in origins if history.day_index(o) > 28)
+
+
+def _fit_engines(name, history, origins, horizon):
+    """One fitted engine per origin; trainable engines warm-start from origin to origin."""
+    engine_cls = forecasting.ENGINES[name]
+    fitted = {}
+    start = time.perf_counter()
+    engine = None
+    for origin in origins:
+        train = history.truncate(origin)
+        if engine_cls is forecasting.HeuristicForecaster:
+            engine = engine_cls()
+        elif engine is None:
+            engine = engine_cls().fit(train, horizon)
+        else:
+            engine.update(train, horizon)
+        fitted[origin] = copy.deepcopy(engine)
+    return fitted, time.perf_counter() - start
+
+
+def _score_chunk(job):
+    """Worker: forecast one chunk of products from every origin."""
+    engines, history, origins, horizon = job
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = []
+    for origin in origins:
+        observed = history.truncate(origin)
+        forecasts = engines[origin].predict(observed, origin, horizon)
+        col = history.day_index(origin)
+        actual = history.quantities[:, col:col + horizon].sum(axis=1)
+        for row, product_id in enumerate(history.product_ids):
+            predicted = forecasts.get(product_id, {}).get('predicted', 0.0)
+            rows.append((product_id, origin, predicted, float(actual[row])))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def _chunks(items, n):
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run_backtest(history, engine_names, origins, horizon, workers):
+    """Backtest every engine; returns ``{engine: {'rows': [...], 'fit_s', 'predict_s', 'peak_mb'}}``."""
+    results = {}
+    product_chunks = _chunks(history.product_ids, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name in engine_names:
+            fitted, fit_seconds = _fit_engines(name, history, origins, horizon)
+            start = time.perf_counter()
+            jobs = [(fitted, history.subset(chunk), origins, horizon) for chunk in product_chunks]
+            rows, peak = [], 0
+            for chunk_rows, _, chunk_peak in pool.map(_score_chunk, jobs):
+                rows.extend(chunk_rows)
+                peak = max(peak, chunk_peak)
+            results[name] = {
+                'rows': rows,
+                'fit_s': fit_seconds,
+                'predict_s': time.perf_counter() - start,
+                'peak_mb': peak / 1024 / 1024,
+            }
+    return results
+
+
+def _metrics(pairs):
+    """MAPE over periods with sales and bias as a share of actual units."""
+    predicted = np.array([p for p, _ in pairs])
+    actual = np.array([a for _, a in pairs])
+    mask = actual > 0
+    mape = float(np.mean(np.abs(predicted[mask] - actual[mask]) / actual[mask]) * 100) if mask.any() else float('nan')
+    bias = float((predicted.sum() - actual.sum()) / actual.sum() * 100) if actual.sum() > 0 else float('nan')
+    return mape, bias
+
+
+def summarise(results, products):
+    """Per-product and per-category metrics for every engine."""
+    summary = {}
+    for name, result in results.items():
+        by_product = defaultdict(list)
+        by_category = defaultdict(list)
+        for product_id, _, predicted, actual in result['rows']:
+            by_product[product_id].append((predicted, actual))
+            category = products.get(product_id, {}).get('category', 'Uncategorised')
+            by_category[category].append((predicted, actual))
+        summary[name] = {
+            'overall': _metrics([(p, a) for _, _, p, a in result['rows']]),
+            'products': {pid: _metrics(pairs) for pid, pairs in by_product.items()},
+            'categories': {cat: _metrics(pairs) for cat, pairs in by_category.items()},
+        }
+    return summary
+
+
+def write_csv(path, summary, products):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['engine', 'level', 'key', 'name', 'mape', 'bias'])
+        for name, data in summary.items():
+            for pid, (mape, bias) in sorted(data['products'].items()):
+                writer.writerow([name, 'product', pid, products.get(pid, {}).get('name', ''), round(mape, 2), round(bias, 2)])
+            for cat, (mape, bias) in sorted(data['categories'].items()):
+                writer.writerow([name, 'category', cat, cat, round(mape, 2), round(bias, 2)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rolling-origin backtest of the forecasting engines')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--engines', default=','.join(forecasting.ENGINES))
+    parser.add_argument('--folds', type=int, default=6)
+    parser.add_argument('--step', type=int, default=14, help='days between origins')
+    parser.add_argument('--horizon', type=int, default=forecasting.HORIZON_DAYS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--csv', help='write per-product / per-category metrics to this file')
+    args = parser.parse_args()
+
+    engine_names = [e.strip() for e in args.engines.split(',') if e.strip()]
+    unknown = [e for e in engine_names if e not in forecasting.ENGINES]
+    if unknown:
+        parser.error(f"unknown engine(s): {', '.join(unknown)}")
+
+    history, products = load_dataset(args.db, args.user)
+    if history is None:
+        print('No sales found.')
+        return
+    origins = rolling_origins(history, args.folds, args.step, args.horizon)
+    if not origins:
+        print('Not enough history for a backtest.')
+        return
+
+    print('=' * 70)
+    print(f'🧪 FORECAST BACKTEST: {len(history.product_ids)} products, {history.num_days} days, '
+          f'{len(origins)} origins ({origins[0]} .. {origins[-1]}), {args.workers} workers')
+    print('=' * 70)
+
+    results = run_backtest(history, engine_names, origins, args.horizon, args.workers)
+    summary = summarise(results, products)
+
+    print(f"\n   {'Engine':<12}{'MAPE %':>9}{'Bias %':>9}{'Fit s':>9}{'Predict s':>11}{'Peak MB':>10}")
+    for name in engine_names:
+        mape, bias = summary[name]['overall']
+        r = results[name]
+        print(f"   {name:<12}{mape:>9.1f}{bias:>9.1f}{r['fit_s']:>9.2f}{r['predict_s']:>11.2f}{r['peak_mb']:>10.1f}")
+
+    print('\n📦 BY CATEGORY (MAPE % / Bias %):')
+    categories = sorted({c for data in summary.values() for c in data['categories']})
+    print(f"   {'Category':<16}" + ''.join(f'{name:>22}' for name in engine_names))
+    for cat in categories:
+        cells = []
+        for name in engine_names:
+            mape, bias = summary[name]['categories'].get(cat, (float('nan'), float('nan')))
+            cells.append(f'{mape:>12.1f} / {bias:>6.1f}')
+        print(f'   {cat:<16}' + ''.join(f'{c:>22}' for c in cells))
+
+    if args.csv:
+        write_csv(args.csv, summary, products)
+        print(f'\n✅ Per-product metrics written to {args.csv}')
+    print('=' * 70)
+
+
+if __name__ == '__main__':
+    main()
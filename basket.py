@@ -0,0 +1,217 @@
+"""Market-basket analysis: which products are bought together.
+
+Sales rung up for the same customer share a ``basket_id``.  For each shop
+this module keeps
+
+- ``basket_item``: in how many baskets each product appears
+- ``basket_pair``: in how many baskets each pair of products appears
+  together (stored once, ``product_a < product_b``)
+- ``basket_state``: the shop's number of baskets and the last sale id
+  already counted
+
+so "top companions of product X" is an indexed lookup of X's pairs,
+ranked by lift = P(X and Y) / (P(X) P(Y)).
+
+``rebuild`` counts the whole history (hot and archived) in one go from a
+sparse basket x product incidence matrix X: XᵀX holds every pair count
+off the diagonal and every item count on it.  ``update`` then folds in
+only sales newer than the checkpoint, including items added to baskets
+that were already counted, and runs in the same transaction as every sale.
+
+    python basket.py rebuild --user 1
+    python basket.py companions 24 --user 1
+
+All functions take a sqlite3-compatible DB-API connection and leave
+committing to the caller.
+"""
+import argparse
+import os
+import sqlite3
+from collections import Counter, defaultdict
+
+import archive
+
+
+def rebuild(conn, user_id):
+    """Recount the shop's baskets from its whole history; returns the sales read."""
+    import numpy as np
+    from scipy import sparse
+
+    last_sale_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM sale WHERE user_id = ?',
+                                (user_id,)).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT basket_id, product_id FROM {archive.sales_sql(conn)}
+        WHERE user_id = ? AND basket_id IS NOT NULL AND id <= ?
+    ''', (user_id, last_sale_id)).fetchall()
+
+    conn.execute('DELETE FROM basket_item WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM basket_pair WHERE user_id = ?', (user_id,))
+    baskets = 0
+    if rows:
+        basket_ids, basket_index = np.unique([r[0] for r in rows], return_inverse=True)
+        product_ids, product_index = np.unique([r[1] for r in rows], return_inverse=True)
+        incidence = sparse.csr_matrix((np.ones(len(rows)), (basket_index, product_index)),
+                                      shape=(len(basket_ids), len(product_ids)))
+        incidence.data[:] = 1  # a product counts once per basket, however many lines it has
+        together = sparse.triu(incidence.T @ incidence).tocoo()
+        items, pairs = [], []
+        for a, b, count in zip(together.row, together.col, together.data):
+            if a == b:
+                items.append((user_id, int(product_ids[a]), int(count)))
+            else:
+                pairs.append((user_id, int(product_ids[a]), int(product_ids[b]), int(count)))
+        conn.executemany('INSERT INTO basket_item (user_id, product_id, baskets) VALUES (?, ?, ?)', items)
+        conn.executemany('INSERT INTO basket_pair (user_id, product_a, product_b, baskets) VALUES (?, ?, ?, ?)',
+                         pairs)
+        baskets = len(basket_ids)
+    conn.execute('''
+        INSERT INTO basket_state (user_id, baskets, last_sale_id) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET baskets = excluded.baskets, last_sale_id = excluded.last_sale_id
+    ''', (user_id, baskets, last_sale_id))
+    return len(rows)
+
+
+def update(conn, user_id):
+    """Fold the shop's sales after its checkpoint into the counts; returns the sales read.
+
+    A shop without counts yet is rebuilt instead.
+    """
+    state = conn.execute('SELECT last_sale_id FROM basket_state WHERE user_id = ?', (user_id,)).fetchone()
+    if state is None:
+        return rebuild(conn, user_id)
+    last_sale_id = state[0]
+    new = conn.execute('''
+        SELECT id, basket_id, product_id FROM sale
+        WHERE id > ? AND user_id = ? ORDER BY id
+    ''', (last_sale_id, user_id)).fetchall()
+    if not new:
+        return 0
+
+    added = defaultdict(set)
+    for _, basket_id, product_id in new:
+        if basket_id is not None:
+            added[basket_id].add(product_id)
+    # Items those baskets already had when they were last counted
+    earlier = defaultdict(set)
+    basket_ids = list(added)
+    for i in range(0, len(basket_ids), 500):
+        chunk = basket_ids[i:i + 500]
+        for basket_id, product_id in conn.execute(f'''
+            SELECT basket_id, product_id FROM sale
+            WHERE basket_id IN ({", ".join("?" * len(chunk))}) AND user_id = ? AND id <= ?
+        ''', chunk + [user_id, last_sale_id]):
+            earlier[basket_id].add(product_id)
+
+    baskets = 0
+    items = Counter()
+    pairs = Counter()
+    for basket_id, products in added.items():
+        old = earlier.get(basket_id, set())
+        fresh = sorted(products - old)
+        if not old and fresh:
+            baskets += 1
+        for i, a in enumerate(fresh):
+            items[a] += 1
+            for b in list(old) + fresh[i + 1:]:
+                pairs[min(a, b), max(a, b)] += 1
+
+    # Move the checkpoint first: an updater that read the same one finds it gone and adds nothing
+    claimed = conn.execute('''
+        UPDATE basket_state SET last_sale_id = ?, baskets = baskets + ?
+        WHERE user_id = ? AND last_sale_id = ?
+    ''', (new[-1][0], baskets, user_id, last_sale_id)).rowcount
+    if not claimed:
+        return 0
+    conn.executemany('''
+        INSERT INTO basket_item (user_id, product_id, baskets) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, product_id) DO UPDATE SET baskets = baskets + excluded.baskets
+    ''', [(user_id, product_id, count) for product_id, count in items.items()])
+    conn.executemany('''
+        INSERT INTO basket_pair (user_id, product_a, product_b, baskets) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, product_a, product_b) DO UPDATE SET baskets = baskets + excluded.baskets
+    ''', [(user_id, a, b, count) for (a, b), count in pairs.items()])
+    return len(new)
+
+
+def backfill(conn):
+    """Build the counts of every shop that has none yet."""
+    user_ids = [user_id for (user_id,) in conn.execute('''
+        SELECT id FROM user WHERE id NOT IN (SELECT user_id FROM basket_state)
+    ''')]
+    for user_id in user_ids:
+        rebuild(conn, user_id)
+    return user_ids
+
+
+def rebuild_all(conn):
+    """Recount every shop (after history was rewritten)."""
+    user_ids = [user_id for (user_id,) in conn.execute('SELECT id FROM user')]
+    for user_id in user_ids:
+        rebuild(conn, user_id)
+    return user_ids
+
+
+def companions(conn, user_id, product_id, limit=5, min_baskets=2):
+    """Products bought together with ``product_id``, strongest association first.
+
+    Each entry has the number of ``baskets`` shared, ``support`` (their
+    share of all baskets), ``confidence`` (share of the product's baskets)
+    and ``lift`` (how many times more often than if the two were bought
+    independently).  Pairs seen in fewer than ``min_baskets`` baskets are
+    left out as noise.
+    """
+    total = conn.execute('SELECT baskets FROM basket_state WHERE user_id = ?', (user_id,)).fetchone()
+    own = conn.execute('SELECT baskets FROM basket_item WHERE user_id = ? AND product_id = ?',
+                       (user_id, product_id)).fetchone()
+    if not total or not own:
+        return []
+    total, own = total[0], own[0]
+    rows = conn.execute('''
+        SELECT p.other, p.baskets, i.baskets FROM (
+            SELECT product_b AS other, baskets FROM basket_pair WHERE user_id = ? AND product_a = ?
+            UNION ALL
+            SELECT product_a, baskets FROM basket_pair WHERE user_id = ? AND product_b = ?
+        ) p
+        JOIN basket_item i ON i.user_id = ? AND i.product_id = p.other
+        WHERE p.baskets >= ?
+    ''', (user_id, product_id, user_id, product_id, user_id, min_baskets))
+    result = [{
+        'product_id': other,
+        'baskets': together,
+        'support': round(together / total, 4),
+        'confidence': round(together / own, 4),
+        'lift': round(together * total / (own * other_baskets), 2)
+    } for other, together, other_baskets in rows]
+    result.sort(key=lambda c: (-c['lift'], -c['baskets']))
+    return result[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Market-basket co-purchase counts')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='recount from the full history')
+    sub.add_parser('update', help='fold in sales recorded outside the app')
+    top = sub.add_parser('companions', help='products bought together with one product')
+    top.add_argument('product_id', type=int)
+    top.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == 'companions':
+        names = dict(conn.execute('SELECT id, name FROM product WHERE user_id = ?', (args.user,)))
+        print(f'🧺 Bought with {names.get(args.product_id, args.product_id)}:')
+        for c in companions(conn, args.user, args.product_id, args.limit):
+            print(f'   {names.get(c["product_id"], c["product_id"])}: lift {c["lift"]:.2f}, '
+                  f'{c["baskets"]} baskets ({c["confidence"]:.0%} of its baskets)')
+    else:
+        read = rebuild(conn, args.user) if args.command == 'rebuild' else update(conn, args.user)
+        conn.commit()
+        baskets = conn.execute('SELECT baskets FROM basket_state WHERE user_id = ?', (args.user,)).fetchone()[0]
+        print(f'✅ {read} sales read, {baskets} baskets counted')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Benchmark sale-entry latency while reports hammer the database.
+
+One writer rings up counter sales (insert the sale, take the stock,
+commit) at a steady rate while ``--readers`` processes run the analytics
+and forecasting queries back to back.  Each mode starts from a fresh,
+upgraded copy of the database:
+
+- primary:  rollback journal, reports read the primary (the old setup)
+- wal:      WAL mode, reports still read the primary
+- snapshot: WAL mode, reports read a read-only snapshot (replica.py, staleness 0)
+- replica:  WAL mode, reports read the backup-API replica (replica.py)
+
+A sale's latency runs from when it was due, not when it started, so a
+writer stuck behind a lock is charged for the sales queued behind it too.
+The WAL column is the size of the primary's WAL file at the end.  Long
+snapshots keep it from being checkpointed.
+
+    python bench_replica.py --readers 4 --seconds 10
+    python bench_replica.py --modes primary,replica --staleness 2
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+MODES = ('primary', 'wal', 'snapshot', 'replica')
+
+
+def report(conn, user_id):
+    """What the analytics and prediction pages read."""
+    import forecasting
+    import timeseries
+
+    timeseries.query(conn, user_id, granularity='day', by='product')
+    timeseries.totals(conn, user_id, by='category')
+    timeseries.totals(conn, user_id, by='weekday')
+    forecasting.load_history(conn, user_id, since=date.today() - timedelta(days=400))
+
+
+def prepare(source, workdir):
+    """Copy ``source`` and bring its schema up to date through the app."""
+    import app as shop_app
+
+    path = os.path.join(workdir, 'base.db')
+    shutil.copy(source, path)
+    app = shop_app.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        shop_app.init_db()
+        shop_app.db.session.remove()
+        shop_app.db.engine.dispose()
+    return path
+
+
+def reader(mode, path, replica_path, staleness, user_id, deadline, results):
+    import replica
+
+    router = replica.ReadRouter(path, replica_path)
+    done = errors = 0
+    while time.time() < deadline:
+        if mode in ('primary', 'wal'):
+            conn = sqlite3.connect(path, timeout=30)
+        else:
+            conn = router.connection(staleness if mode == 'replica' else 0)
+        try:
+            report(conn, user_id)
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+        finally:
+            conn.close()
+    results.put((done, errors))
+
+
+def writer(path, user_id, rate, deadline):
+    """``(latencies in ms, errors)`` of sales due every ``1 / rate`` seconds until ``deadline``."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    products = conn.execute('SELECT id, selling_price FROM product WHERE user_id = ?', (user_id,)).fetchall()
+    latencies, errors = [], 0
+    due = time.time()
+    while due < deadline:
+        time.sleep(max(0.0, due - time.time()))
+        product_id, price = random.choice(products)
+        try:
+            conn.execute('BEGIN')
+            conn.execute('INSERT INTO sale (product_id, quantity, selling_price, total_amount, date, user_id) '
+                         'VALUES (?, 1, ?, ?, ?, ?)', (product_id, price, price, datetime.utcnow(), user_id))
+            conn.execute('UPDATE product SET current_stock = current_stock - 1 WHERE id = ?', (product_id,))
+            conn.execute('COMMIT')
+            latencies.append((time.time() - due) * 1000)
+        except sqlite3.OperationalError:
+            conn.execute('ROLLBACK')
+            errors += 1
+        due += 1 / rate
+    conn.close()
+    return latencies, errors
+
+
+def run(mode, base, workdir, args):
+    path = os.path.join(workdir, f'{mode}.db')
+    replica_path = os.path.join(workdir, f'{mode}-replica.db')
+    shutil.copy(base, path)
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode={'DELETE' if mode == 'primary' else 'WAL'}")
+    conn.close()
+    if mode == 'replica':
+        import replica
+        replica.ReadRouter(path, replica_path).refresh()
+
+    deadline = time.time() + args.seconds
+    results = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=reader,
+                                       args=(mode, path, replica_path, args.staleness, args.user, deadline, results))
+               for _ in range(args.readers)]
+    for process in readers:
+        process.start()
+    latencies, write_errors = writer(path, args.user, args.rate, deadline)
+    wal = os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+    counts = [results.get() for _ in readers]
+    for process in readers:
+        process.join()
+    return latencies, write_errors, sum(c[0] for c in counts), sum(c[1] for c in counts), wal
+
+
+def _percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sale-entry latency under heavy report load')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--readers', type=int, default=4, help='report processes')
+    parser.add_argument('--rate', type=float, default=20, help='sales per second')
+    parser.add_argument('--seconds', type=float, default=10, help='per mode')
+    parser.add_argument('--staleness', type=float, default=5, help='replica bound in seconds')
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        base = prepare(args.db, workdir)
+        print(f'🧪 {args.rate:g} sales/s against {args.readers} report processes, {args.seconds:g}s per mode\n')
+        print(f'   {"mode":<10}{"sales":>7}{"errors":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+              f'{"max ms":>9}{"reports/s":>11}{"WAL MB":>8}')
+        for mode in args.modes.split(','):
+            latencies, write_errors, reports, read_errors, wal = run(mode, base, workdir, args)
+            print(f'   {mode:<10}{len(latencies):>7}{write_errors + read_errors:>8}'
+                  f'{_percentile(latencies, 50):>9.1f}{_percentile(latencies, 95):>9.1f}'
+                  f'{_percentile(latencies, 99):>9.1f}{max(latencies, default=float("nan")):>9.1f}'
+                  f'{reports / args.seconds:>11.1f}{wal / 1024 / 1024:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark worker boot: import time, app creation, first request and RSS.
+
+Each run is a fresh ``python -X importtime`` process doing what a
+gunicorn worker does at boot (import the app module, ``create_app()``,
+serve a first request), so results include every module the app pulls in.
+
+    python bench_startup.py --runs 5
+    python bench_startup.py --path /prediction --top 25
+    python bench_startup.py --history bench_startup.csv   # append results to track over time
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+CHILD = '''
+import json, time
+t0 = time.perf_counter()
+import app as shop_app
+t1 = time.perf_counter()
+flask_app = shop_app.create_app()
+t2 = time.perf_counter()
+client = flask_app.test_client()
+if {login!r}:
+    client.post('/login', data={{'username': {username!r}, 'password': {password!r}}})
+status = client.get({path!r}).status_code
+t3 = time.perf_counter()
+rss = 0
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            rss = int(line.split()[1]) / 1024
+print(json.dumps({{'import_ms': (t1 - t0) * 1000, 'create_ms': (t2 - t1) * 1000,
+                  'first_request_ms': (t3 - t2) * 1000, 'status': status, 'rss_mb': rss}}))
+'''
+
+
+def run_once(path, username, password):
+    code = CHILD.format(path=path, login=path not in ('/', '/login'),
+                        username=username, password=password)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def parse_importtime(stderr):
+    """``{module: cumulative µs}`` from ``-X importtime`` output.
+
+    The ``app`` module is broken down into the modules it imports directly;
+    anything imported later (by ``create_app()`` or the first request) is
+    listed as is.
+    """
+    totals = {}
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2   # 1 space = imported by the script itself
+        name = name.strip()
+        if depth == 1:
+            children.append((name, int(cumulative)))
+        elif depth == 0:
+            # Children are printed before their parent
+            for child, micros in (children if name == 'app' else [(name, int(cumulative))]):
+                totals[child] = totals.get(child, 0) + micros
+            children = []
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure worker boot time and memory')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/login', help='first request to serve')
+    parser.add_argument('--username', default='demo_shop')
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--top', type=int, default=15, help='slowest top-level imports to list')
+    parser.add_argument('--history', help='append the medians to this CSV')
+    args = parser.parse_args()
+
+    runs = [run_once(args.path, args.username, args.password) for _ in range(args.runs)]
+    metrics = ('import_ms', 'create_ms', 'first_request_ms', 'rss_mb')
+    medians = {m: statistics.median(r[m] for r in runs) for m in metrics}
+
+    print(f'🚀 Worker boot, median of {args.runs} runs (first request: GET {args.path} -> {runs[0]["status"]})')
+    print(f'   Import app:     {medians["import_ms"]:8.1f} ms')
+    print(f'   create_app():   {medians["create_ms"]:8.1f} ms')
+    print(f'   First request:  {medians["first_request_ms"]:8.1f} ms')
+    print(f'   Total boot:     {medians["import_ms"] + medians["create_ms"] + medians["first_request_ms"]:8.1f} ms')
+    print(f'   RSS per worker: {medians["rss_mb"]:8.1f} MB')
+
+    packages = {}
+    for r in runs:
+        for name, micros in r['imports'].items():
+            packages.setdefault(name, []).append(micros)
+    slowest = sorted(((statistics.median(v), k) for k, v in packages.items()), reverse=True)[:args.top]
+    print('\n📦 Slowest top-level imports (cumulative):')
+    for micros, name in slowest:
+        print(f'   {name:<30} {micros / 1000:8.1f} ms')
+
+    if args.history:
+        new_file = not os.path.exists(args.history)
+        with open(args.history, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(['timestamp', 'path'] + list(metrics))
+            writer.writerow([datetime.now().isoformat(timespec='seconds'), args.path]
+                            + [round(medians[m], 1) for m in metrics])
+        print(f'\n✅ Appended to {args.history}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark gunicorn worker memory with and without preload.
+
+Starts gunicorn (using gunicorn.conf.py) once per mode, drives every page
+through it - including forecasting - and then reads each worker's memory
+from /proc: RSS, PSS (shared pages split between the processes using
+them) and USS (pages private to the worker).  The PSS total is what the
+whole server really costs.  Linux only.
+
+    python bench_workers.py --workers 4
+    FORECAST_ENGINE=gbm python bench_workers.py --requests 40
+"""
+import argparse
+import http.cookiejar
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+PAGES = ['/dashboard', '/inventory', '/stock', '/analytics', '/prediction', '/api/purchase-orders']
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def memory(pid):
+    """``{'rss', 'pss', 'uss'}`` in MB from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def children(pid):
+    pids = []
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            pids.extend(int(p) for p in f.read().split())
+    return pids
+
+
+def drive(base, username, password, requests):
+    """Log in and request every page ``requests`` times over fresh connections."""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    opener.open(f'{base}/login', data, timeout=30).read()
+    for i in range(requests):
+        opener.open(f'{base}{PAGES[i % len(PAGES)]}', timeout=120).read()
+
+
+def run(preload, workers, threads, requests, username, password):
+    port = _free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0', WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads), GUNICORN_BIND=f'127.0.0.1:{port}')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn'], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                urllib.request.urlopen(f'{base}/login', timeout=5).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.2)
+        while len(children(server.pid)) < workers and time.time() < deadline:
+            time.sleep(0.2)
+
+        drive(base, username, password, requests)
+        master = memory(server.pid)
+        per_worker = [memory(pid) for pid in children(server.pid)]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return master, per_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gunicorn worker memory with and without preload')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=60, help='page views to drive through the server')
+    parser.add_argument('--username', default='demo_shop')
+    parser.add_argument('--password', default='password123')
+    args = parser.parse_args()
+
+    print(f'🧪 {args.workers} workers x {args.threads} threads, {args.requests} page views per run\n')
+    print(f'   {"mode":<12}{"RSS/worker":>12}{"PSS/worker":>12}{"USS/worker":>12}{"PSS total":>12}')
+    for preload in (False, True):
+        master, workers = run(preload, args.workers, args.threads, args.requests, args.username, args.password)
+        n = len(workers) or 1
+        total_pss = master['pss'] + sum(w['pss'] for w in workers)
+        print(f'   {"preload" if preload else "no preload":<12}'
+              f'{sum(w["rss"] for w in workers) / n:>9.1f} MB'
+              f'{sum(w["pss"] for w in workers) / n:>9.1f} MB'
+              f'{sum(w["uss"] for w in workers) / n:>9.1f} MB'
+              f'{total_pss:>9.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Per-worker cache of each shop's product catalog.
+
+Holds the slow-changing product fields (name, category, unit, prices,
+barcode) so sale entry, name rendering and category breakdowns do not have
+to load product rows.  Stock levels are deliberately *not* cached since
+every sale changes them.
+
+Workers stay coherent through a ``catalog_version`` row per shop: writers
+bump it in the same transaction as the product change (and write the new
+row through to their own cache), other workers poll it at most once per
+``poll_interval`` seconds and reload when it moved.
+"""
+import threading
+import time
+from collections import namedtuple
+
+ProductInfo = namedtuple('ProductInfo', 'id name category unit selling_price cost_price barcode')
+
+_COLUMNS = 'id, name, category, unit, selling_price, cost_price, barcode'
+
+
+def current_version(conn, user_id):
+    row = conn.execute('SELECT version FROM catalog_version WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_version(conn, user_id):
+    """Increment the shop's catalog version; call inside the writing transaction."""
+    conn.execute('''
+        INSERT INTO catalog_version (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    ''', (user_id,))
+    return current_version(conn, user_id)
+
+
+class _Entry:
+    __slots__ = ('version', 'checked_at', 'products')
+
+    def __init__(self, version, products):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.products = products
+
+
+class CatalogCache:
+    """``{user_id: {product_id: ProductInfo}}`` with version polling."""
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._listeners = []
+
+    def on_reload(self, callback):
+        """Call ``callback(user_id)`` whenever another worker's change forces a reload."""
+        self._listeners.append(callback)
+
+    def products(self, conn, user_id):
+        entry = self._entries.get(user_id)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked_at < self.poll_interval:
+            return entry.products
+
+        version = current_version(conn, user_id)
+        if entry is not None and entry.version == version:
+            entry.checked_at = now
+            return entry.products
+
+        rows = conn.execute(f'SELECT {_COLUMNS} FROM product WHERE user_id = ?', (user_id,)).fetchall()
+        products = {row[0]: ProductInfo(*row) for row in rows}
+        with self._lock:
+            self._entries[user_id] = _Entry(version, products)
+        if entry is not None:
+            for callback in self._listeners:
+                callback(user_id)
+        return products
+
+    def get(self, conn, user_id, product_id):
+        return self.products(conn, user_id).get(product_id)
+
+    def write_through(self, user_id, product, version):
+        """Apply this worker's own committed change without a reload.
+
+        Only safe when ``version`` directly follows the cached one; if
+        another worker changed the catalog in between, drop the entry so the
+        next read reloads everything.
+        """
+        info = ProductInfo(product.id, product.name, product.category, product.unit,
+                           product.selling_price, product.cost_price, product.barcode)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if entry.version + 1 == version:
+                products = dict(entry.products)
+                products[info.id] = info
+                self._entries[user_id] = _Entry(version, products)
+                return
+            del self._entries[user_id]
+        for callback in self._listeners:
+            callback(user_id)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
@@ -0,0 +1,154 @@
+"""In-memory typeahead index over a shop's product catalog.
+
+Products are indexed by word prefixes of their name and category (fast
+"starts with" matches as the cashier types) and by name trigrams (infix
+and typo-tolerant fallback), plus an exact barcode map.  Each index is
+updated incrementally when a product is added or edited.
+"""
+import heapq
+import re
+import threading
+
+MAX_PREFIX = 12
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _normalise(text):
+    return ' '.join(_WORD.findall((text or '').lower()))
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CatalogIndex:
+    """Prefix / trigram / barcode index for one shop."""
+
+    def __init__(self, products=()):
+        self._lock = threading.Lock()
+        self._products = {}   # id -> public fields plus normalised name/words
+        self._keys = {}       # id -> (prefixes, trigrams, barcode) currently indexed
+        self._prefixes = {}   # prefix -> set(ids)
+        self._trigrams = {}   # trigram -> set(ids)
+        self._barcodes = {}   # barcode -> id
+        for product in products:
+            self.add(product)
+
+    def __len__(self):
+        return len(self._products)
+
+    def add(self, product):
+        """Index (or re-index after an edit) a product row/object."""
+        entry = {
+            'id': product.id,
+            'name': product.name,
+            'category': product.category,
+            'unit': product.unit,
+            'selling_price': product.selling_price,
+            'cost_price': product.cost_price,
+            'barcode': getattr(product, 'barcode', None) or None,
+        }
+        name = _normalise(entry['name'])
+        words = set(name.split()) | set(_normalise(entry['category']).split())
+        prefixes = {w[:i] for w in words for i in range(1, min(len(w), MAX_PREFIX) + 1)}
+        trigrams = _trigrams(name)
+
+        with self._lock:
+            self._unindex(entry['id'])
+            self._products[entry['id']] = dict(entry, _name=name, _words=words)
+            self._keys[entry['id']] = (prefixes, trigrams, entry['barcode'])
+            for p in prefixes:
+                self._prefixes.setdefault(p, set()).add(entry['id'])
+            for t in trigrams:
+                self._trigrams.setdefault(t, set()).add(entry['id'])
+            if entry['barcode']:
+                self._barcodes[entry['barcode']] = entry['id']
+
+    def remove(self, product_id):
+        with self._lock:
+            self._unindex(product_id)
+
+    def _unindex(self, product_id):
+        keys = self._keys.pop(product_id, None)
+        self._products.pop(product_id, None)
+        if keys is None:
+            return
+        prefixes, trigrams, barcode = keys
+        for index, tokens in ((self._prefixes, prefixes), (self._trigrams, trigrams)):
+            for token in tokens:
+                ids = index.get(token)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del index[token]
+        if barcode and self._barcodes.get(barcode) == product_id:
+            del self._barcodes[barcode]
+
+    def lookup_barcode(self, barcode):
+        product_id = self._barcodes.get((barcode or '').strip())
+        return self._public(product_id) if product_id is not None else None
+
+    def search(self, query, limit=10):
+        """Top ``limit`` products matching ``query``, best first."""
+        q = _normalise(query)
+        if not q:
+            return []
+        tokens = q.split()
+
+        with self._lock:
+            candidates = None
+            for token in tokens:
+                ids = self._prefixes.get(token[:MAX_PREFIX], set())
+                if len(token) > MAX_PREFIX:
+                    ids = {i for i in ids if any(w.startswith(token) for w in self._products[i]['_words'])}
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    break
+
+            query_trigrams = _trigrams(q)
+            if not candidates:
+                # No word-prefix match: fall back to names sharing most trigrams
+                hits = {}
+                for t in query_trigrams:
+                    for i in self._trigrams.get(t, ()):
+                        hits[i] = hits.get(i, 0) + 1
+                needed = max(1, len(query_trigrams) // 2)
+                candidates = {i for i, n in hits.items() if n >= needed}
+
+            def rank(product_id):
+                entry = self._products[product_id]
+                overlap = len(query_trigrams & self._keys[product_id][1]) / len(query_trigrams)
+                return (not entry['_name'].startswith(q), -overlap, entry['_name'])
+
+            best = heapq.nsmallest(limit, candidates, key=rank)
+            return [self._public(i) for i in best]
+
+    def _public(self, product_id):
+        entry = self._products[product_id]
+        return {k: v for k, v in entry.items() if not k.startswith('_')}
+
+
+class CatalogIndexes:
+    """Per-process registry of catalog indexes, one per shop, built on first use."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def get(self, user_id, load_products):
+        index = self._indexes.get(user_id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(user_id)
+                if index is None:
+                    index = CatalogIndex(load_products())
+                    self._indexes[user_id] = index
+        return index
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
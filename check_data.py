@@ -1,54 +1,104 @@
+"""Database status and integrity check.
+
+Prints table counts (archived sales included), then runs the incremental
+integrity checks (see integrity.py) and lists what they found.  Repeat
+runs only scan rows added since the previous run, so it is cheap enough
+for cron every few minutes; the exit status is 1 while issues are open.
+
+    python check_data.py
+    python check_data.py --full          # rescan every row
+    python check_data.py --watch 300     # check every 5 minutes
+"""
+import argparse
+import os
 import sqlite3
+import sys
+import time
+
+import archive
+import integrity
+
+ISSUES_SHOWN = 5  # per check
 
-# Connect to database
-conn = sqlite3.connect('instance/shop.db')
-cursor = conn.cursor()
-
-# Check all tables
-print("="*50)
-print("📊 DATABASE STATUS CHECK")
-print("="*50)
-
-# Check users
-cursor.execute("SELECT COUNT(*) FROM user")
-user_count = cursor.fetchone()[0]
-print(f"👤 Users: {user_count}")
-if user_count > 0:
-    cursor.execute("SELECT id, username, shop_name FROM user")
-    users = cursor.fetchall()
+
+def print_status(conn):
+    print("=" * 50)
+    print("📊 DATABASE STATUS CHECK")
+    print("=" * 50)
+
+    users = conn.execute("SELECT id, username, shop_name FROM user").fetchall()
+    print(f"👤 Users: {len(users)}")
     for user in users:
         print(f"   - ID: {user[0]}, Username: {user[1]}, Shop: {user[2]}")
 
-# Check products
-cursor.execute("SELECT COUNT(*) FROM product")
-product_count = cursor.fetchone()[0]
-print(f"\n📦 Products: {product_count}")
-if product_count > 0:
-    cursor.execute("SELECT id, name, current_stock FROM product LIMIT 5")
-    products = cursor.fetchall()
-    for product in products:
-        print(f"   - {product[1]}: {product[2]} units")
-
-# Check stock_in
-cursor.execute("SELECT COUNT(*) FROM stock_in")
-stock_in_count = cursor.fetchone()[0]
-print(f"\n📥 Stock In Records: {stock_in_count}")
-
-# Check sales
-cursor.execute("SELECT COUNT(*) FROM sale")
-sale_count = cursor.fetchone()[0]
-print(f"💰 Sales Records: {sale_count}")
-
-if sale_count > 0:
-    cursor.execute("SELECT SUM(total_amount) FROM sale")
-    total_revenue = cursor.fetchone()[0] or 0
-    print(f"   Total Revenue: ₹{total_revenue:,.2f}")
-    
-    cursor.execute("SELECT MIN(date), MAX(date) FROM sale")
-    dates = cursor.fetchone()
-    if dates[0]:
-        print(f"   Date Range: {dates[0][:10]} to {dates[1][:10]}")
-
-print("="*50)
-
-conn.close()
\ No newline at end of file
+    product_count = conn.execute("SELECT COUNT(*) FROM product").fetchone()[0]
+    print(f"\n📦 Products: {product_count}")
+    for name, stock in conn.execute("SELECT name, current_stock FROM product LIMIT 5"):
+        print(f"   - {name}: {stock} units")
+
+    stock_in_count = conn.execute("SELECT COUNT(*) FROM stock_in").fetchone()[0]
+    print(f"\n📥 Stock In Records: {stock_in_count}")
+
+    # Hot rows from sale, archived months from their frozen totals
+    hot = conn.execute("SELECT COUNT(*), SUM(total_amount), MIN(date), MAX(date) FROM sale").fetchone()
+    months = archive.archived_months(conn)
+    archived = conn.execute('''
+        SELECT COALESCE(SUM(transactions), 0), SUM(revenue), MIN(day), MAX(day) FROM sale_day_summary
+    ''').fetchone() if months else (0, None, None, None)
+    print(f"💰 Sales Records: {hot[0] + archived[0]}"
+          + (f" ({hot[0]} recent, {archived[0]} archived in {len(months)} months)" if months else ""))
+    if hot[0] + archived[0] > 0:
+        print(f"   Total Revenue: ₹{(hot[1] or 0) + (archived[1] or 0):,.2f}")
+        first = min(d for d in (hot[2], archived[2]) if d)
+        last = max(d for d in (hot[3], archived[3]) if d)
+        print(f"   Date Range: {first[:10]} to {last[:10]}")
+
+
+def check(conn, full=False):
+    """Run the integrity checks and print the open issues; returns how many there are."""
+    start = time.perf_counter()
+    counts = integrity.run(conn, full=full)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+
+    total = sum(counts.values())
+    print(f"\n🔍 INTEGRITY ({'full scan' if full else 'new rows'}, {elapsed * 1000:.0f} ms)")
+    for name in list(integrity.ROW_CHECKS) + ['archived_duplicate'] + list(integrity.TABLE_CHECKS):
+        count = counts.get(name, 0)
+        if name == 'archived_duplicate' and not count:
+            continue
+        print(f"   {'⚠️' if count else '✅'} {name}: {count}")
+        for _, row_id, user_id, detail, found_at in integrity.issues(conn, name, ISSUES_SHOWN):
+            print(f"      #{row_id} (shop {user_id}): {detail}  [since {found_at[:16]}]")
+        if count > ISSUES_SHOWN:
+            print(f"      ... and {count - ISSUES_SHOWN} more")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Database status and incremental integrity check')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    parser.add_argument('--full', action='store_true', help='rescan every row, not just new ones')
+    parser.add_argument('--reset', action='store_true', help='forget checkpoints and known issues first')
+    parser.add_argument('--watch', type=float, help='keep checking every N seconds')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.reset:
+        integrity.reset(conn)
+        conn.commit()
+    print_status(conn)
+    full = args.full
+    while True:
+        open_issues = check(conn, full=full)
+        print("=" * 50)
+        if not args.watch:
+            break
+        full = False
+        time.sleep(args.watch)
+    conn.close()
+    sys.exit(1 if open_issues else 0)
+
+
+if __name__ == '__main__':
+    main()
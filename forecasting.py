@@ -0,0 +1,510 @@
+"""Demand forecasting engines used by the prediction page and offline reports.
+
+Every engine works on a ``SalesHistory`` (a dense product x day matrix of
+units sold) and forecasts all products of a shop in one ``predict()`` call.
+"""
+import argparse
+import os
+import pickle
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import shop_calendar
+import timeseries
+
+HORIZON_DAYS = 30
+DEFAULT_MODEL_DIR = os.path.join('instance', 'models')
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+class SalesHistory:
+    """Units sold per product per day, days as columns starting at ``start``.
+
+    ``calendar`` is the shop's ``shop_calendar.Calendar`` (built-in
+    defaults when None).
+    """
+
+    def __init__(self, product_ids, start, quantities, calendar=None):
+        self.product_ids = list(product_ids)
+        self.start = _to_date(start)
+        self.quantities = np.asarray(quantities, dtype=float).reshape(len(self.product_ids), -1)
+        self.index = {pid: i for i, pid in enumerate(self.product_ids)}
+        self.calendar = calendar or shop_calendar.Calendar()
+
+    @property
+    def num_days(self):
+        return self.quantities.shape[1]
+
+    @property
+    def end(self):
+        """First day *not* covered by the history."""
+        return self.start + timedelta(days=self.num_days)
+
+    def day_index(self, day):
+        return (_to_date(day) - self.start).days
+
+    def truncate(self, end):
+        """History restricted to the days before ``end``."""
+        stop = max(0, min(self.num_days, self.day_index(end)))
+        return SalesHistory(self.product_ids, self.start, self.quantities[:, :stop], self.calendar)
+
+    def subset(self, product_ids):
+        """History of ``product_ids``; ids it does not know (e.g. added since a replica copy) sold nothing."""
+        product_ids = list(product_ids)
+        quantities = np.zeros((len(product_ids), self.num_days))
+        for row, pid in enumerate(product_ids):
+            if pid in self.index:
+                quantities[row] = self.quantities[self.index[pid]]
+        return SalesHistory(product_ids, self.start, quantities, self.calendar)
+
+    @classmethod
+    def from_rows(cls, rows, product_ids, start, end, calendar=None):
+        """Build from ``(product_id, 'YYYY-MM-DD', quantity)`` rows."""
+        start, end = _to_date(start), _to_date(end)
+        history = cls(product_ids, start, np.zeros((len(product_ids), max(0, (end - start).days))), calendar)
+        for product_id, day, quantity in rows:
+            row = history.index.get(product_id)
+            col = history.day_index(day)
+            if row is not None and 0 <= col < history.num_days:
+                history.quantities[row, col] += quantity or 0
+        return history
+
+
+def load_history(conn, user_id, since=None, until=None):
+    """Load daily units sold for every product of ``user_id`` in one grouped query.
+
+    ``conn`` is any sqlite3-compatible DB-API connection.  ``until`` is
+    exclusive and defaults to tomorrow so that today's sales are included.
+    The shop's calendar comes along for seasonality and special days.
+    """
+    product_ids = [row[0] for row in conn.execute(
+        'SELECT id FROM product WHERE user_id = ? ORDER BY id', (user_id,))]
+
+    rows = [(row['key'], row['bucket'], row['units'])
+            for row in timeseries.query(conn, user_id, start=since, end=until, granularity='day', by='product')]
+
+    until = _to_date(until) if until is not None else datetime.now().date() + timedelta(days=1)
+    if since is None:
+        since = min((_to_date(r[1]) for r in rows), default=until)
+    return SalesHistory.from_rows(rows, product_ids, since, until, shop_calendar.load(conn, user_id))
+
+
+# ============= ENGINES =============
+class Forecaster:
+    """Base class for forecasting engines.
+
+    ``predict()`` returns ``{product_id: forecast}`` where each forecast is a
+    dict with ``predicted`` (units over the horizon), ``recommended``,
+    ``avg_daily``, ``trend`` and ``confidence``.  Products without any recent
+    sales are omitted.
+    """
+
+    name = 'base'
+
+    def history_days(self, as_of):
+        """How many days of history ``predict()`` needs before ``as_of``."""
+        return 400
+
+    def fit(self, history):
+        return self
+
+    def predict(self, history, as_of, horizon=HORIZON_DAYS):
+        raise NotImplementedError
+
+
+def _stock_buffer(values, avg_daily):
+    """Safety buffer multiplier based on the coefficient of variation."""
+    std_dev = np.std(values) if len(values) > 1 else avg_daily * 0.3
+    cv = std_dev / avg_daily if avg_daily > 0 else 0.5
+    if cv > 0.5:
+        return 1.4  # 40% buffer for highly variable
+    elif cv > 0.3:
+        return 1.2  # 20% buffer for moderately variable
+    return 1.1  # 10% buffer for stable products
+
+
+def _confidence(days_with_sales):
+    if days_with_sales > 60:
+        return 'High'
+    elif days_with_sales > 30:
+        return 'Medium'
+    return 'Low'
+
+
+class HeuristicForecaster(Forecaster):
+    """The original hand-tuned rules: 7-day moving average, trend and seasonality factors.
+
+    Seasonality comes from the shop calendar: how busy the forecast days
+    are expected to be compared with the week the moving average covers.
+    """
+
+    name = 'heuristic'
+
+    def history_days(self, as_of):
+        return 91
+
+    def predict(self, history, as_of, horizon=HORIZON_DAYS):
+        as_of = _to_date(as_of)
+        end = history.day_index(as_of)
+        window = history.quantities[:, max(0, end - 91):max(0, end)]
+
+        factors = history.calendar.day_factors(as_of - timedelta(days=7), 7 + horizon)
+        seasonal_factor = factors[7:].mean() / factors[:7].mean()
+
+        forecasts = {}
+        for row, product_id in enumerate(history.product_ids):
+            sales_values = window[row][window[row] > 0]
+            if len(sales_values) == 0:
+                continue
+
+            if len(sales_values) > 7:
+                moving_avg = sales_values[-7:].sum() / 7
+                previous_avg = sales_values[-14:-7].sum() / 7 if len(sales_values) > 14 else moving_avg
+
+                if moving_avg > previous_avg * 1.1:
+                    trend, trend_factor = '📈 Increasing', 1.2
+                elif moving_avg < previous_avg * 0.9:
+                    trend, trend_factor = '📉 Decreasing', 0.8
+                else:
+                    trend, trend_factor = '➡️ Stable', 1.0
+            else:
+                moving_avg = sales_values.mean()
+                trend, trend_factor = '📊 Limited data', 1.0
+
+            avg_daily = moving_avg if moving_avg > 0 else 0
+
+            predicted = avg_daily * horizon * trend_factor * seasonal_factor
+            forecasts[product_id] = {
+                'predicted': float(predicted),
+                'recommended': float(predicted * _stock_buffer(sales_values, avg_daily)),
+                'avg_daily': float(avg_daily),
+                'trend': trend,
+                'confidence': _confidence(len(sales_values)),
+            }
+        return forecasts
+
+
+class GradientBoostingForecaster(Forecaster):
+    """Global gradient-boosted model trained across all products.
+
+    Each sample is "units sold on day t, forecast from origin o" with lag,
+    rolling-mean, weekday, month and special-date features.  Targets are
+    normalised by the product's 91-day mean so one model serves every scale.
+    Uses xgboost when installed and scikit-learn's histogram GBM otherwise.
+    """
+
+    name = 'gbm'
+    FEATURES = ['mean_7', 'mean_28', 'same_weekday', 'same_day_last_year',
+                'log_scale', 'weekday', 'month', 'special', 'days_ahead']
+
+    def __init__(self, n_estimators=200, learning_rate=0.05, max_depth=6,
+                 origin_stride=7, max_rows=300000, random_state=0):
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.origin_stride = origin_stride
+        self.max_rows = max_rows
+        self.random_state = random_state
+        self.model = None
+        self.trained_through = None
+
+    def history_days(self, as_of):
+        return 400
+
+    def _new_model(self):
+        try:
+            from xgboost import XGBRegressor
+        except ImportError:
+            from sklearn.ensemble import HistGradientBoostingRegressor
+            return HistGradientBoostingRegressor(
+                max_iter=self.n_estimators, learning_rate=self.learning_rate,
+                max_depth=self.max_depth, random_state=self.random_state)
+        return XGBRegressor(
+            n_estimators=self.n_estimators, learning_rate=self.learning_rate,
+            max_depth=self.max_depth, random_state=self.random_state,
+            tree_method='hist', n_jobs=1)
+
+    def _design(self, history, origins, horizon):
+        """Feature matrix for every (product, origin, days_ahead) combination.
+
+        Returns ``(X, target_days, scale)`` with X shaped
+        ``(n_products * n_origins * horizon, n_features)``.
+        """
+        q = history.quantities
+        n_products = q.shape[0]
+        origins = np.asarray(origins, dtype=int)
+        ahead = np.arange(1, horizon + 1)
+
+        csum = np.concatenate([np.zeros((n_products, 1)), np.cumsum(q, axis=1)], axis=1)
+
+        def mean_before(width):
+            lo = np.maximum(origins - width, 0)
+            return (csum[:, origins] - csum[:, lo]) / np.maximum(origins - lo, 1)
+
+        scale = np.maximum(mean_before(91), 0.1)  # (n_products, n_origins)
+        target = origins[:, None] + ahead[None, :] - 1  # (n_origins, horizon)
+
+        def lagged(days):
+            valid = (days >= 0) & (days < q.shape[1])
+            values = q[:, np.clip(days, 0, q.shape[1] - 1)]
+            return np.where(valid, values, np.nan)
+
+        same_weekday = lagged(target - 7 * np.ceil(ahead / 7).astype(int)[None, :])
+        last_year = lagged(target - 364)
+
+        span = int(target.max()) + 1 if target.size else 0
+        day_numbers = np.arange(span)
+        first = np.datetime64(history.start, 'D')
+        calendar_days = first + day_numbers
+        weekday = (history.start.weekday() + day_numbers) % 7
+        month = calendar_days.astype('datetime64[M]').astype(int) % 12 + 1
+        special = history.calendar.special_factors(history.start, span)
+
+        shape = (n_products, len(origins), horizon)
+        per_product = lambda a: np.broadcast_to(a[:, :, None], shape)
+        per_day = lambda a: np.broadcast_to(a[target][None, :, :], shape)
+        columns = [
+            per_product(mean_before(7) / scale),
+            per_product(mean_before(28) / scale),
+            same_weekday / scale[:, :, None],
+            last_year / scale[:, :, None],
+            per_product(np.log1p(scale)),
+            per_day(weekday),
+            per_day(month),
+            per_day(special),
+            np.broadcast_to(ahead[None, None, :], shape),
+        ]
+        X = np.stack([np.asarray(c, dtype=float).reshape(-1) for c in columns], axis=1)
+        return X, target, scale
+
+    def _training_set(self, history, horizon, first_target=0):
+        """Samples whose target day falls in ``[first_target, num_days)``."""
+        first_origin = max(28, first_target - horizon + 1)
+        origins = list(range(first_origin, history.num_days, self.origin_stride))
+        if not origins:
+            return None, None
+        X, target, scale = self._design(history, origins, horizon)
+        observed = np.broadcast_to(
+            (target >= first_target) & (target < history.num_days), (len(history.product_ids),) + target.shape)
+        actual = history.quantities[:, np.clip(target, 0, history.num_days - 1)]
+        y = (actual / scale[:, :, None]).reshape(-1)
+        keep = observed.reshape(-1)
+        X, y = X[keep], y[keep]
+
+        if len(y) > self.max_rows:
+            rng = np.random.default_rng(self.random_state)
+            pick = rng.choice(len(y), self.max_rows, replace=False)
+            X, y = X[pick], y[pick]
+        return X, y
+
+    def fit(self, history, horizon=HORIZON_DAYS):
+        X, y = self._training_set(history, horizon)
+        self.model = self._new_model()
+        if X is not None and len(y):
+            self.model.fit(X, y)
+        self.trained_through = history.end
+        return self
+
+    def update(self, history, horizon=HORIZON_DAYS, extra_estimators=50):
+        """Warm-start: add trees fitted only on days after ``trained_through``."""
+        if self.model is None or self.trained_through is None:
+            return self.fit(history, horizon)
+        X, y = self._training_set(history, horizon, first_target=history.day_index(self.trained_through))
+        if X is None or not len(y):
+            return self
+
+        if hasattr(self.model, 'get_booster'):
+            booster = self.model.get_booster()
+            self.model.set_params(n_estimators=extra_estimators)
+            self.model.fit(X, y, xgb_model=booster)
+        else:
+            self.model.set_params(warm_start=True, max_iter=self.model.max_iter + extra_estimators)
+            self.model.fit(X, y)
+        self.trained_through = history.end
+        return self
+
+    def predict(self, history, as_of, horizon=HORIZON_DAYS):
+        if self.model is None:
+            raise RuntimeError('GradientBoostingForecaster must be fitted or loaded before predict()')
+        origin = history.day_index(as_of)
+        observed = history.truncate(as_of)
+        if not observed.num_days:
+            return {}
+        window = observed.quantities[:, max(0, origin - 91):]
+        has_sales = (window > 0).any(axis=1)
+
+        # One batched model call for every product and every day ahead
+        X, _, scale = self._design(observed, [origin], horizon)
+        daily = np.clip(self.model.predict(X), 0, None).reshape(len(history.product_ids), horizon)
+        daily *= scale[:, 0][:, None]
+        predicted = daily.sum(axis=1)
+        recent = window[:, -28:].mean(axis=1) if window.shape[1] else np.zeros(len(history.product_ids))
+
+        forecasts = {}
+        for row, product_id in enumerate(history.product_ids):
+            if not has_sales[row]:
+                continue
+            avg_daily = predicted[row] / horizon
+            if avg_daily > recent[row] * 1.1:
+                trend = '📈 Increasing'
+            elif avg_daily < recent[row] * 0.9:
+                trend = '📉 Decreasing'
+            else:
+                trend = '➡️ Stable'
+            sales_values = window[row][window[row] > 0]
+            forecasts[product_id] = {
+                'predicted': float(predicted[row]),
+                'recommended': float(predicted[row] * _stock_buffer(sales_values, avg_daily)),
+                'avg_daily': float(avg_daily),
+                'trend': trend,
+                'confidence': _confidence(len(sales_values)),
+            }
+        return forecasts
+
+    def save(self, path):
+        # Pickle plain state rather than the instance so models trained from
+        # the CLI (where this module is __main__) load inside the app.
+        state = dict(self.__dict__)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        engine = cls.__new__(cls)
+        engine.__dict__.update(state)
+        return engine
+
+
+ENGINES = {
+    HeuristicForecaster.name: HeuristicForecaster,
+    GradientBoostingForecaster.name: GradientBoostingForecaster,
+}
+
+
+def model_path(model_dir, user_id, name=GradientBoostingForecaster.name):
+    return os.path.join(model_dir, f'{name}_user{user_id}.pkl')
+
+
+# Loaded models are read-only, so one copy per process is shared by all
+# requests (and, with gunicorn preload, by all forked workers)
+_loaded_models = {}   # path -> (mtime, engine)
+
+
+def get_engine(name, model_dir=DEFAULT_MODEL_DIR, user_id=None):
+    """Return a ready-to-predict engine, falling back to the heuristic.
+
+    Trained engines are loaded from ``model_dir`` (once per file version);
+    if no model has been trained yet for this shop the heuristic is used
+    instead.
+    """
+    engine_cls = ENGINES.get(name, HeuristicForecaster)
+    if engine_cls is HeuristicForecaster:
+        return HeuristicForecaster()
+    path = model_path(model_dir, user_id, engine_cls.name)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return HeuristicForecaster()
+    cached = _loaded_models.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, engine_cls.load(path))
+        _loaded_models[path] = cached
+    return cached[1]
+
+
+def preload_models(name, model_dir=DEFAULT_MODEL_DIR):
+    """Load every trained ``name`` model in ``model_dir``; returns how many."""
+    prefix = f'{name}_user'
+    if not os.path.isdir(model_dir):
+        return 0
+    count = 0
+    for filename in os.listdir(model_dir):
+        if filename.startswith(prefix) and filename.endswith('.pkl'):
+            get_engine(name, model_dir, int(filename[len(prefix):-len('.pkl')]))
+            count += 1
+    return count
+
+
+# ============= BACKTEST REPORT =============
+def evaluate(engine, history, as_of, horizon=HORIZON_DAYS):
+    """Forecast from ``as_of`` and score against the following ``horizon`` days."""
+    observed = history.truncate(as_of)
+    start = time.perf_counter()
+    forecasts = engine.predict(observed, as_of, horizon)
+    elapsed = time.perf_counter() - start
+
+    origin = history.day_index(as_of)
+    actual = history.quantities[:, origin:origin + horizon].sum(axis=1)
+    predicted = np.array([forecasts.get(pid, {}).get('predicted', 0.0) for pid in history.product_ids])
+    mask = actual > 0
+    return {
+        'engine': engine.name,
+        'products': int(mask.sum()),
+        'mape': float(np.mean(np.abs(predicted[mask] - actual[mask]) / actual[mask]) * 100) if mask.any() else 0.0,
+        'wape': float(np.abs(predicted - actual).sum() / max(actual.sum(), 1e-9) * 100),
+        'bias': float((predicted.sum() - actual.sum()) / max(actual.sum(), 1e-9) * 100),
+        'inference_ms': elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the GBM forecaster and compare it against the heuristic')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR)
+    parser.add_argument('--horizon', type=int, default=HORIZON_DAYS)
+    parser.add_argument('--update', action='store_true', help='warm-start the saved model instead of retraining')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    last_sale = conn.execute('SELECT MAX(date) FROM sale WHERE user_id = ?', (args.user,)).fetchone()[0]
+    if last_sale is None:
+        print('No sales found.')
+        return
+    history = load_history(conn, args.user, until=_to_date(last_sale) + timedelta(days=1))
+    conn.close()
+
+    as_of = history.end - timedelta(days=args.horizon)
+    train = history.truncate(as_of)
+
+    print('=' * 60)
+    print(f'🔮 FORECAST BACKTEST (holdout {as_of} + {args.horizon} days)')
+    print('=' * 60)
+
+    start = time.perf_counter()
+    gbm = GradientBoostingForecaster().fit(train, args.horizon)
+    print(f'   Trained GBM on {train.num_days} days x {len(train.product_ids)} products in {time.perf_counter() - start:.1f}s')
+
+    print(f"\n   {'Engine':<12}{'MAPE %':>10}{'WAPE %':>10}{'Bias %':>10}{'Infer ms':>12}")
+    for engine in (HeuristicForecaster(), gbm):
+        r = evaluate(engine, history, as_of, args.horizon)
+        print(f"   {r['engine']:<12}{r['mape']:>10.1f}{r['wape']:>10.1f}{r['bias']:>10.1f}{r['inference_ms']:>12.1f}")
+
+    # Refit on the full history (or warm-start) and persist for the app
+    path = model_path(args.model_dir, args.user)
+    if args.update and os.path.exists(path):
+        model = GradientBoostingForecaster.load(path).update(history, args.horizon)
+    else:
+        model = GradientBoostingForecaster().fit(history, args.horizon)
+    model.save(path)
+    print(f'\n✅ Model saved to {path} (trained through {model.trained_through})')
+    print('=' * 60)
+
+
+if __name__ == '__main__':
+    main()
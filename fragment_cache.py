@@ -0,0 +1,136 @@
+"""Cache rendered template fragments.
+
+    {% cache 'category_breakdown', now.strftime('%Y-%m') %}
+        ...expensive block...
+    {% endcache %}
+
+Fragments are keyed by the current shop's data version (see
+``init_app``), the fragment name and any extra key values, so a sale or a
+catalog change simply makes the old entries unreachable; they then age out
+of the LRU.  Pass the data a cached block needs as a ``Lazy`` so it is only
+loaded when the block is actually rendered.
+"""
+import threading
+from collections import OrderedDict
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML bounded by entry count and total size."""
+
+    def __init__(self, max_entries=500, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = html
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+class Lazy:
+    """A list computed on first use, so cached fragments skip the query."""
+
+    def __init__(self, load):
+        self._load = load
+        self._value = None
+
+    @property
+    def value(self):
+        if self._load is not None:
+            self._value = list(self._load())
+            self._load = None
+        return self._value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __getitem__(self, index):
+        return self.value[index]
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache name, *keys %}...{% endcache %}``"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        scope = self.environment.fragment_cache_scope()
+        if scope is None:
+            return caller()
+        key = scope + tuple(key)
+        cache = self.environment.fragment_cache
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.set(key, html)
+        return Markup(html)
+
+
+def init_app(app, scope):
+    """Enable ``{% cache %}`` in ``app``'s templates.
+
+    ``scope()`` returns the key prefix for the current request - e.g.
+    ``(user_id, data_version)`` - or None to render without caching.  It is
+    called once per request.
+    """
+    def request_scope():
+        if 'fragment_scope' not in g:
+            g.fragment_scope = scope()
+        return g.fragment_scope
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 500),
+                                                 app.config.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    app.jinja_env.fragment_cache_scope = request_scope
+    return app.jinja_env.fragment_cache
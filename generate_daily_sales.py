@@ -2,12 +2,42 @@ import sqlite3
 import random
 import numpy as np
 from datetime import datetime, timedelta
-import pandas as pd
 import calendar
 from collections import defaultdict
 
+import anomaly
+import archive
+import auth
+import basket
+import pricing
+import shop_calendar
+import sketches
+import stock_ledger
+import timeseries
+
+# Share of the day's transactions per business hour (weighted towards evening)
+BUSINESS_HOURS = [8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21]
+HOUR_PROBS = [0.03, 0.04, 0.06, 0.08, 0.10, 0.08, 0.07, 0.07, 0.08, 0.09, 0.12, 0.10, 0.06, 0.02]
+
+# Products customers tend to buy together: first pick -> [(companion id, chance)]
+BASKET_COMPANIONS = {
+    4: [(2, 0.3)],                          # Dove Shampoo -> Dove Soap
+    6: [(1, 0.2), (3, 0.2)],                # Colgate -> soap
+    10: [(8, 0.3), (19, 0.25), (23, 0.15)], # Nestle Milk -> butter, Parle-G, sugar
+    11: [(8, 0.3), (19, 0.25), (12, 0.2)],  # Amul Milk -> butter, Parle-G, curd
+    13: [(14, 0.2), (15, 0.2)],             # Dairy Milk -> other chocolates
+    16: [(28, 0.35), (29, 0.2), (17, 0.2)], # Lays -> cola, Kurkure
+    17: [(29, 0.35), (30, 0.2)],            # Kurkure -> Pepsi, Bisleri
+    18: [(9, 0.2), (16, 0.15)],             # Maggi -> cheese, chips
+    21: [(22, 0.4), (20, 0.3)],             # Atta -> oil, salt
+    22: [(21, 0.3), (20, 0.25)],            # Oil -> atta, salt
+    24: [(23, 0.5), (19, 0.35), (10, 0.2)], # Tea -> sugar, biscuits, milk
+    25: [(26, 0.35), (27, 0.2)],            # Surf Excel -> Vim, Harpic
+}
+
 class DailySalesGenerator:
-    def __init__(self):
+    def __init__(self, db_path='instance/shop.db'):
+        self.db_path = db_path
         self.conn = None
         self.cursor = None
         self.user_id = 1
@@ -49,20 +79,23 @@ class DailySalesGenerator:
         
     def setup_database(self):
         """Setup database connection and tables"""
-        self.conn = sqlite3.connect('instance/shop.db')
+        self.conn = sqlite3.connect(self.db_path)
         self.cursor = self.conn.cursor()
         
         # Clear existing data
+        archive.clear(self.conn)
         self.cursor.execute("DELETE FROM sale")
         self.cursor.execute("DELETE FROM stock_in")
         self.cursor.execute("DELETE FROM product")
+        pricing.ensure_schema(self.conn)
+        self.cursor.execute("DELETE FROM product_price")
         self.cursor.execute("DELETE FROM user")
         
         # Create demo user
         self.cursor.execute('''
             INSERT INTO user (id, username, password, shop_name)
             VALUES (?, ?, ?, ?)
-        ''', (1, 'demo_shop', 'password123', 'Daily Sales Store'))
+        ''', (1, 'demo_shop', auth.hash_password('password123'), 'Daily Sales Store'))
         
         # Insert products
         for p in self.products:
@@ -70,6 +103,7 @@ class DailySalesGenerator:
                 INSERT INTO product (id, name, category, unit, selling_price, cost_price, current_stock, user_id)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (p[0], p[1], p[2], p[3], p[4], p[5], p[6] * 30, self.user_id))
+        pricing.backfill(self.conn)
         
         self.conn.commit()
         print("✅ Database setup complete")
@@ -79,39 +113,9 @@ class DailySalesGenerator:
         start_date = datetime(2025, 8, 1)
         end_date = datetime(2026, 1, 31)
         
-        # Seasonal factors by month
-        seasonal_factors = {
-            8: 1.0,   # August - Normal
-            9: 1.1,   # September - Festival start
-            10: 1.15, # October - Navratri
-            11: 1.4,  # November - Diwali (PEAK)
-            12: 1.35, # December - Christmas
-            1: 1.2    # January - New Year
-        }
-        
-        # Weekend factors
-        weekend_factors = {
-            0: 0.9,   # Monday
-            1: 0.95,  # Tuesday
-            2: 1.0,   # Wednesday
-            3: 1.0,   # Thursday
-            4: 1.2,   # Friday
-            5: 1.5,   # Saturday (PEAK)
-            6: 1.4    # Sunday
-        }
-        
-        # Special dates (festivals, holidays)
-        special_dates = {
-            "2025-10-02": 1.3,  # Gandhi Jayanti
-            "2025-10-24": 2.0,  # Diwali (PEAK)
-            "2025-11-01": 1.4,  # Karnataka Rajyotsava
-            "2025-11-15": 1.3,  # Children's Day
-            "2025-12-25": 2.0,  # Christmas (PEAK)
-            "2025-12-31": 1.8,  # New Year Eve
-            "2026-01-01": 1.5,  # New Year Day
-            "2026-01-15": 1.3,  # Pongal/Makar Sankranti
-            "2026-01-26": 1.2,  # Republic Day
-        }
+        # Month, weekday and festival multipliers of every day in one go
+        shop_days = shop_calendar.Calendar()
+        day_multipliers = shop_days.day_factors(start_date, (end_date - start_date).days + 1)
         
         daily_sales_data = []
         sale_id = 1000
@@ -123,14 +127,11 @@ class DailySalesGenerator:
             month = current_date.month
             weekday = current_date.weekday()
             date_str = current_date.strftime("%Y-%m-%d")
+            day_multiplier = float(day_multipliers[(current_date - start_date).days])
             
-            # Base multiplier for the day
-            day_multiplier = seasonal_factors.get(month, 1.0) * weekend_factors.get(weekday, 1.0)
-            
-            # Apply special date multiplier if applicable
-            if date_str in special_dates:
-                day_multiplier *= special_dates[date_str]
-                print(f"   🎉 Special day {date_str}: {day_multiplier:.1f}x multiplier")
+            special_name = shop_days.special_name(current_date)
+            if special_name:
+                print(f"   🎉 {special_name} {date_str}: {day_multiplier:.1f}x multiplier")
             
             # Number of transactions (20-50 per day based on multiplier)
             base_transactions = random.randint(25, 40)
@@ -142,72 +143,80 @@ class DailySalesGenerator:
             daily_items = 0
             
             for _ in range(num_transactions):
-                # Pick random product
-                product = random.choice(self.products)
-                product_id = product[0]
-                price = product[4]
-                cost = product[5]
-                avg_daily = product[6]
-                
-                # Quantity based on product type and day
-                if product[2] == "Dairy":
-                    # Essential - more consistent
-                    quantity = random.randint(1, 3)
-                    if weekday >= 5:  # Weekend
-                        quantity += random.randint(1, 2)
-                
-                elif product[2] == "Grocery":
-                    # Bulk purchases on weekends
-                    quantity = random.randint(1, 2)
-                    if weekday >= 5:
-                        quantity = random.randint(2, 5)
-                
-                elif product[2] == "Snacks":
-                    # More snacks on weekends and evenings
-                    quantity = random.randint(1, 4)
-                    if weekday >= 5:
-                        quantity = random.randint(3, 8)
-                    elif current_date.hour in [17, 18, 19, 20]:  # Evening hours
-                        quantity += random.randint(1, 2)
-                
-                elif product[2] == "Beverages":
-                    quantity = random.randint(1, 3)
-                    if month in [8, 9]:  # Summer months
-                        quantity += random.randint(1, 3)
-                
-                else:
-                    quantity = random.randint(1, 2)
-                
-                # Apply day multiplier to quantity
-                quantity = max(1, int(quantity * (day_multiplier ** 0.5)))
-                
-                # Calculate totals
-                total = round(quantity * price, 2)
-                profit = round(quantity * (price - cost), 2)
+                # One customer's basket: a random first pick plus its usual companions
+                basket = [random.choice(self.products)]
+                for companion_id, chance in BASKET_COMPANIONS.get(basket[0][0], []):
+                    if random.random() < chance:
+                        basket.append(self.products[companion_id - 1])
+                extra = random.choice(self.products)
+                if random.random() < 0.25 and extra not in basket:
+                    basket.append(extra)
+                basket_id = f"gen-{sale_id}"
                 
                 # Random time during business hours (weighted towards evening)
-                hour_weights = [8,9,10,11,12,13,14,15,16,17,18,19,20,21]
-                hour_probs = [0.03,0.04,0.06,0.08,0.10,0.08,0.07,0.07,0.08,0.09,0.12,0.10,0.06,0.02]
-                hour = random.choices(hour_weights, weights=hour_probs)[0]
+                hour = random.choices(BUSINESS_HOURS, weights=HOUR_PROBS)[0]
                 minute = random.randint(0, 59)
                 second = random.randint(0, 59)
                 
                 sale_date = current_date.replace(hour=hour, minute=minute, second=second)
                 
-                daily_sales_data.append((
-                    sale_id,
-                    product_id,
-                    quantity,
-                    price,
-                    total,
-                    sale_date.strftime("%Y-%m-%d %H:%M:%S"),
-                    self.user_id
-                ))
-                
-                daily_revenue += total
-                daily_profit += profit
-                daily_items += quantity
-                sale_id += 1
+                for product in basket:
+                    product_id = product[0]
+                    price = product[4]
+                    cost = product[5]
+                    avg_daily = product[6]
+                    
+                    # Quantity based on product type and day
+                    if product[2] == "Dairy":
+                        # Essential - more consistent
+                        quantity = random.randint(1, 3)
+                        if weekday >= 5:  # Weekend
+                            quantity += random.randint(1, 2)
+                    
+                    elif product[2] == "Grocery":
+                        # Bulk purchases on weekends
+                        quantity = random.randint(1, 2)
+                        if weekday >= 5:
+                            quantity = random.randint(2, 5)
+                    
+                    elif product[2] == "Snacks":
+                        # More snacks on weekends and evenings
+                        quantity = random.randint(1, 4)
+                        if weekday >= 5:
+                            quantity = random.randint(3, 8)
+                        elif current_date.hour in [17, 18, 19, 20]:  # Evening hours
+                            quantity += random.randint(1, 2)
+                    
+                    elif product[2] == "Beverages":
+                        quantity = random.randint(1, 3)
+                        if month in [8, 9]:  # Summer months
+                            quantity += random.randint(1, 3)
+                    
+                    else:
+                        quantity = random.randint(1, 2)
+                    
+                    # Apply day multiplier to quantity
+                    quantity = max(1, int(quantity * (day_multiplier ** 0.5)))
+                    
+                    # Calculate totals
+                    total = round(quantity * price, 2)
+                    profit = round(quantity * (price - cost), 2)
+                    
+                    daily_sales_data.append((
+                        sale_id,
+                        product_id,
+                        quantity,
+                        price,
+                        total,
+                        sale_date.strftime("%Y-%m-%d %H:%M:%S"),
+                        self.user_id,
+                        basket_id
+                    ))
+                    
+                    daily_revenue += total
+                    daily_profit += profit
+                    daily_items += quantity
+                    sale_id += 1
             
             # Print daily summary every 30 days
             if current_date.day == 1 or current_date.day == 15:
@@ -220,8 +229,8 @@ class DailySalesGenerator:
         for i in range(0, len(daily_sales_data), batch_size):
             batch = daily_sales_data[i:i+batch_size]
             self.cursor.executemany('''
-                INSERT INTO sale (id, product_id, quantity, selling_price, total_amount, date, user_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO sale (id, product_id, quantity, selling_price, total_amount, date, user_id, basket_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', batch)
             self.conn.commit()
             print(f"   Inserted batch {i//batch_size + 1}/{(len(daily_sales_data)//batch_size)+1}")
@@ -278,65 +287,27 @@ class DailySalesGenerator:
         return stock_data
     
     def update_stock_levels(self):
-        """Update current stock based on sales"""
-        for product in self.products:
-            product_id = product[0]
-            
-            # Total sold
-            self.cursor.execute('''
-                SELECT SUM(quantity) FROM sale WHERE product_id = ?
-            ''', (product_id,))
-            sold = self.cursor.fetchone()[0] or 0
-            
-            # Total received
-            self.cursor.execute('''
-                SELECT SUM(quantity) FROM stock_in WHERE product_id = ?
-            ''', (product_id,))
-            received = self.cursor.fetchone()[0] or 0
-            
-            current = received - sold
-            self.cursor.execute('''
-                UPDATE product SET current_stock = ? WHERE id = ?
-            ''', (current, product_id))
-        
+        """Rebuild the stock ledger, basket counts, sales baselines and any analytics sketches from the generated history"""
+        stock_ledger.rebuild(self.conn)
+        basket.rebuild_all(self.conn)
+        sketches.rebuild_all(self.conn)
+        anomaly.rebuild_all(self.conn)
         self.conn.commit()
         print("✅ Stock levels updated")
     
     def generate_daily_summary(self):
         """Generate a CSV with daily sales summary"""
-        self.cursor.execute('''
-            SELECT DATE(date) as sale_date, 
-                   COUNT(*) as transactions,
-                   SUM(quantity) as items_sold,
-                   SUM(total_amount) as revenue,
-                   AVG(total_amount) as avg_transaction
-            FROM sale
-            WHERE user_id = ?
-            GROUP BY DATE(date)
-            ORDER BY sale_date
-        ''', (self.user_id,))
-        
-        daily_summary = self.cursor.fetchall()
+        # Daily totals in one grouped query, including archived months
+        daily_summary = [
+            (day['bucket'], day['transactions'], day['units'], day['revenue'],
+             day['revenue'] / day['transactions'], day['profit'])
+            for day in timeseries.query(self.conn, self.user_id, granularity='day')
+        ]
         
-        # Create DataFrame
+        # Create DataFrame (pandas is only needed for this report)
+        import pandas as pd
         df = pd.DataFrame(daily_summary, 
-                         columns=['Date', 'Transactions', 'Items_Sold', 'Revenue', 'Avg_Transaction'])
-        
-        # Add profit calculation
-        profits = []
-        for date in df['Date']:
-            self.cursor.execute('''
-                SELECT s.quantity, p.selling_price, p.cost_price
-                FROM sale s
-                JOIN product p ON s.product_id = p.id
-                WHERE DATE(s.date) = ? AND s.user_id = ?
-            ''', (date, self.user_id))
-            
-            day_sales = self.cursor.fetchall()
-            day_profit = sum(q * (sp - cp) for q, sp, cp in day_sales)
-            profits.append(day_profit)
-        
-        df['Profit'] = profits
+                         columns=['Date', 'Transactions', 'Items_Sold', 'Revenue', 'Avg_Transaction', 'Profit'])
         df['Profit_Margin'] = (df['Profit'] / df['Revenue'] * 100).round(1)
         
         # Save to CSV
@@ -532,7 +503,7 @@ class DailySalesGenerator:
         
         print("\n✅ Daily sales data generation complete!")
         print("\n📁 Files created:")
-        print("   - instance/shop.db (SQLite database)")
+        print(f"   - {self.db_path} (SQLite database)")
         print("   - daily_sales_summary.csv (Daily sales summary)")
         
         print("\n🔐 Login credentials:")
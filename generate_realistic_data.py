@@ -69,7 +69,23 @@ def generate_sales(self):
         base_transactions = random.randint(15, 25)
         num_transactions = int(base_transactions * season_mult * day_mult)
         
+        basket_left = 0
         for _ in range(num_transactions):
+            # Consecutive picks share a customer's basket (1-4 items, one checkout time)
+            if basket_left == 0:
+                basket_id = f"gen-{sale_id}"
+                basket_left = random.choice([1, 1, 2, 2, 3, 4])
+                # Random time during business hours (weighted towards evening)
+                hour_weights = [8,9,10,11,12,13,14,15,16,17,18,19,20,21]
+                hour_probs = [0.03,0.04,0.06,0.08,0.10,0.08,0.07,0.07,0.08,0.09,0.11,0.09,0.06,0.04]
+                hour = random.choices(hour_weights, weights=hour_probs)[0]
+                minute = random.randint(0, 59)
+                second = random.randint(0, 59)
+                
+                sale_date = current_date.replace(hour=hour, minute=minute, second=second)
+                
+            basket_left -= 1
+            
             # Pick a random product from products_with_avg
             product_info = random.choice(products_with_avg)
             product_name = product_info['name']
@@ -136,15 +152,6 @@ def generate_sales(self):
             # Calculate total
             total_amount = round(quantity * selling_price, 2)
             
-            # Random time during business hours (weighted towards evening)
-            hour_weights = [8,9,10,11,12,13,14,15,16,17,18,19,20,21]
-            hour_probs = [0.03,0.04,0.06,0.08,0.10,0.08,0.07,0.07,0.08,0.09,0.11,0.09,0.06,0.04]
-            hour = random.choices(hour_weights, weights=hour_probs)[0]
-            minute = random.randint(0, 59)
-            second = random.randint(0, 59)
-            
-            sale_date = current_date.replace(hour=hour, minute=minute, second=second)
-            
             sales_records.append((
                 sale_id,
                 product_id,
@@ -152,7 +159,8 @@ def generate_sales(self):
                 selling_price,
                 total_amount,
                 sale_date.strftime("%Y-%m-%d %H:%M:%S"),
-                self.user_id
+                self.user_id,
+                basket_id
             ))
             
             # Update current stock in our local dictionary
@@ -179,8 +187,8 @@ def generate_sales(self):
     for i in range(0, len(sales_records), batch_size):
         batch = sales_records[i:i+batch_size]
         self.cursor.executemany('''
-            INSERT INTO sale (id, product_id, quantity, selling_price, total_amount, date, user_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO sale (id, product_id, quantity, selling_price, total_amount, date, user_id, basket_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', batch)
         self.conn.commit()
         print(f"  Inserted sales batch {i//batch_size + 1}/{(len(sales_records)//batch_size)+1}")
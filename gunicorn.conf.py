@@ -0,0 +1,61 @@
+"""Production server settings, picked up automatically by ``gunicorn`` from this directory.
+
+    gunicorn                                  # auto-sized, preloaded
+    WEB_CONCURRENCY=3 GUNICORN_THREADS=8 gunicorn
+    GUNICORN_PRELOAD=0 gunicorn               # every worker imports the app itself
+
+With preload the app, templates, numpy, trained models and catalogs are
+loaded once in the master (``app.warm_up``) and shared copy-on-write by the
+forked workers; each worker then drops the inherited DB connection pool.
+"""
+import gc
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _cores():
+    try:
+        return len(os.sched_getaffinity(0))  # respects container CPU pinning
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# SQLite serialises writers, so a few processes with a handful of threads
+# each beat many single-threaded processes
+workers = _env_int('WEB_CONCURRENCY', min(_cores() * 2 + 1, _env_int('GUNICORN_MAX_WORKERS', 8)))
+# Each open live dashboard (/api/dashboard/stream) holds one thread for a few
+# minutes; LIVE_MAX_STREAMS (default 2) caps them so the rest keep serving
+threads = _env_int('GUNICORN_THREADS', 4)
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+timeout = 60                 # forecasting a large catalog can take a while
+max_requests = 2000          # recycle workers to bound memory growth;
+max_requests_jitter = 200    # new ones fork from the warm master
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import app as shop_app
+    shop_app.warm_up(server.app.wsgi())
+    # Move everything loaded so far out of the GC's reach, so collections in
+    # the workers do not write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from app import db
+    with worker.app.wsgi().app_context():
+        # Drop connections inherited from the master without closing them under it
+        db.engine.dispose(close=False)
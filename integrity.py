@@ -0,0 +1,198 @@
+"""Incremental data-integrity checks.
+
+Row checks look at individual ``sale`` / ``stock_in`` / ``stock_movement``
+rows: orphaned or cross-shop product ids, totals that are not quantity x
+price, sales and receipts without exactly one matching ledger movement,
+and sale ids that also exist in an archived month.  Each keeps a
+high-water mark in ``integrity_checkpoint``, so a run only scans rows added
+since the previous one (plus the rows it already flagged, to notice fixes).
+
+Table checks cover ``product``, which stays small, in full every run:
+``current_stock`` against the stock ledger (stock-ins minus sales plus
+adjustments, see stock_ledger.py), negative stock and barcodes shared by
+several products of one shop.
+
+Open problems are kept in ``integrity_issue`` until a later run no longer
+finds them.  Sales archived after being flagged drop out of the hot table
+and are treated as resolved.  All functions take a sqlite3-compatible
+DB-API connection and leave committing to the caller.
+"""
+from datetime import datetime
+
+import archive
+import stock_ledger
+
+TOLERANCE = 0.01  # ₹ / units; totals are stored rounded to paise
+
+# name -> (table scanned, query selecting (row id, user id, detail) of bad rows ``t`` within {scope})
+ROW_CHECKS = {
+    'orphan_sale': ('sale', '''
+        SELECT t.id, t.user_id, 'product ' || t.product_id ||
+               CASE WHEN p.id IS NULL THEN ' does not exist' ELSE ' belongs to shop ' || p.user_id END
+        FROM sale t LEFT JOIN product p ON p.id = t.product_id
+        WHERE {scope} AND (p.id IS NULL OR p.user_id IS NOT t.user_id)
+    '''),
+    'orphan_stock_in': ('stock_in', '''
+        SELECT t.id, t.user_id, 'product ' || t.product_id ||
+               CASE WHEN p.id IS NULL THEN ' does not exist' ELSE ' belongs to shop ' || p.user_id END
+        FROM stock_in t LEFT JOIN product p ON p.id = t.product_id
+        WHERE {scope} AND (p.id IS NULL OR p.user_id IS NOT t.user_id)
+    '''),
+    'orphan_movement': ('stock_movement', '''
+        SELECT t.id, t.user_id, t.kind || ' of product ' || t.product_id ||
+               CASE WHEN p.id IS NULL THEN ' which does not exist' ELSE ' which belongs to shop ' || p.user_id END
+        FROM stock_movement t LEFT JOIN product p ON p.id = t.product_id
+        WHERE {scope} AND (p.id IS NULL OR p.user_id IS NOT t.user_id)
+    '''),
+    'sale_total': ('sale', f'''
+        SELECT t.id, t.user_id, PRINTF('total %.2f but %g x %.2f = %.2f',
+               t.total_amount, t.quantity, t.selling_price, t.quantity * t.selling_price)
+        FROM sale t
+        WHERE {{scope}} AND (t.total_amount IS NULL OR t.quantity IS NULL OR t.selling_price IS NULL
+                             OR ABS(t.total_amount - t.quantity * t.selling_price) > {TOLERANCE})
+    '''),
+    'sale_ledger': ('sale', f'''
+        SELECT t.id, t.user_id, COUNT(m.id) || ' sale movements for ' || PRINTF('%g', t.quantity) || ' sold'
+        FROM sale t LEFT JOIN stock_movement m ON m.ref_id = t.id AND m.kind = 'sale'
+        WHERE {{scope}}
+        GROUP BY t.id
+        HAVING COUNT(m.id) != 1 OR ABS(SUM(m.quantity) + t.quantity) > {TOLERANCE}
+    '''),
+    'stock_in_ledger': ('stock_in', f'''
+        SELECT t.id, t.user_id, COUNT(m.id) || ' stock_in movements for ' || PRINTF('%g', t.quantity) || ' received'
+        FROM stock_in t LEFT JOIN stock_movement m ON m.ref_id = t.id AND m.kind = 'stock_in'
+        WHERE {{scope}}
+        GROUP BY t.id
+        HAVING COUNT(m.id) != 1 OR ABS(SUM(m.quantity) - t.quantity) > {TOLERANCE}
+    '''),
+}
+
+
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS integrity_checkpoint (
+            check_name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            checked_at DATETIME NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS integrity_issue (
+            check_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            user_id INTEGER,
+            detail TEXT,
+            found_at DATETIME NOT NULL,
+            PRIMARY KEY (check_name, row_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+# ============= TABLE CHECKS =============
+def stock_drift(conn):
+    """Products whose ``current_stock`` differs from their ledger balance."""
+    found = []
+    for (user_id,) in conn.execute('SELECT DISTINCT user_id FROM product').fetchall():
+        ledger = stock_ledger.stock_levels(conn, user_id)
+        for product_id, current in conn.execute('SELECT id, current_stock FROM product WHERE user_id = ?', (user_id,)):
+            balance = ledger.get(product_id, 0)
+            if abs((current or 0) - balance) > TOLERANCE:
+                found.append((product_id, user_id, f'current_stock {current:g} but ledger says {balance:g}'))
+    return found
+
+
+def negative_stock(conn):
+    return conn.execute('''
+        SELECT id, user_id, PRINTF('%s: current_stock %g', name, current_stock)
+        FROM product WHERE current_stock < 0
+    ''').fetchall()
+
+
+def duplicate_barcode(conn):
+    return conn.execute('''
+        SELECT p.id, p.user_id, 'barcode ' || p.barcode || ' is used by ' || d.n || ' products'
+        FROM product p
+        JOIN (
+            SELECT user_id, barcode, COUNT(*) AS n FROM product
+            WHERE barcode IS NOT NULL AND barcode != ''
+            GROUP BY user_id, barcode HAVING COUNT(*) > 1
+        ) d ON d.user_id = p.user_id AND d.barcode = p.barcode
+    ''').fetchall()
+
+
+TABLE_CHECKS = {
+    'stock_drift': stock_drift,
+    'negative_stock': negative_stock,
+    'duplicate_barcode': duplicate_barcode,
+}
+
+
+# ============= RUNNING =============
+def _row_checks(conn):
+    checks = dict(ROW_CHECKS)
+    months = archive.archived_months(conn)
+    if months:
+        checks['archived_duplicate'] = ('sale', ' UNION ALL '.join(f'''
+            SELECT t.id, t.user_id, 'id also archived in {archive.table_name(month)}'
+            FROM sale t JOIN {archive.table_name(month)} a ON a.id = t.id
+            WHERE {{scope}}
+        ''' for month in months))
+    return checks
+
+
+def run(conn, full=False):
+    """Run every check and return ``{check: open issues}``.
+
+    Row checks scan the rows added since their last run (every row with
+    ``full``) and re-check the rows they flagged before.
+    """
+    ensure_schema(conn)
+    now = str(datetime.now())
+    checkpoints = dict(conn.execute('SELECT check_name, last_id FROM integrity_checkpoint'))
+    for name, (table, query) in _row_checks(conn).items():
+        last_id = 0 if full else checkpoints.get(name, 0)
+        top = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+        found = conn.execute(query.format(scope=f't.id > {int(last_id)} AND t.id <= {int(top)}')).fetchall()
+        flagged = [row_id for (row_id,) in conn.execute(
+            'SELECT row_id FROM integrity_issue WHERE check_name = ? AND row_id <= ?', (name, last_id))]
+        for i in range(0, len(flagged), 500):
+            ids = ', '.join(str(int(row_id)) for row_id in flagged[i:i + 500])
+            found.extend(conn.execute(query.format(scope=f't.id IN ({ids})')).fetchall())
+        _record(conn, name, found, now, keep_above=top)
+        conn.execute('''
+            INSERT INTO integrity_checkpoint (check_name, last_id, checked_at) VALUES (?, ?, ?)
+            ON CONFLICT (check_name) DO UPDATE SET last_id = excluded.last_id, checked_at = excluded.checked_at
+        ''', (name, top, now))
+    for name, check in TABLE_CHECKS.items():
+        _record(conn, name, check(conn), now)
+    return dict(conn.execute('SELECT check_name, COUNT(*) FROM integrity_issue GROUP BY check_name'))
+
+
+def _record(conn, name, found, now, keep_above=None):
+    """Store ``found`` as the check's open issues; earlier ones not found again are resolved."""
+    conn.executemany('''
+        INSERT INTO integrity_issue (check_name, row_id, user_id, detail, found_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (check_name, row_id) DO UPDATE SET user_id = excluded.user_id, detail = excluded.detail
+    ''', [(name, row_id, user_id, detail, now) for row_id, user_id, detail in found])
+    found_ids = {row_id for row_id, _, _ in found}
+    stale = [(name, row_id) for (row_id,) in conn.execute(
+        'SELECT row_id FROM integrity_issue WHERE check_name = ?', (name,))
+        if row_id not in found_ids and (keep_above is None or row_id <= keep_above)]
+    conn.executemany('DELETE FROM integrity_issue WHERE check_name = ? AND row_id = ?', stale)
+
+
+def issues(conn, check=None, limit=None):
+    """Open issues as ``[(check, row id, user id, detail, found at)]``, oldest first."""
+    where, params = ('WHERE check_name = ?', [check]) if check else ('', [])
+    sql = f'SELECT check_name, row_id, user_id, detail, found_at FROM integrity_issue {where} ORDER BY found_at, row_id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def reset(conn):
+    """Forget every checkpoint and issue; the next run scans everything."""
+    ensure_schema(conn)
+    conn.execute('DELETE FROM integrity_checkpoint')
+    conn.execute('DELETE FROM integrity_issue')
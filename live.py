@@ -0,0 +1,135 @@
+"""In-process pub/sub behind the dashboard's server-sent event stream.
+
+Writers publish an event once per shop; every open stream of that shop in
+this worker receives it from its own queue, so no viewer re-queries the
+database.  Each shop with open streams also has a ``state`` dict (its
+current dashboard figures) that publishers update incrementally and new
+streams start from.
+
+Other gunicorn workers cannot publish into this process.  A background
+``Poller`` per worker checks, for shops with open streams only, whether
+anything was written that this worker did not publish, and calls back so
+the app can reload that shop's state and publish it once.
+"""
+import logging
+import queue
+import threading
+import time
+
+CLOSED = object()   # sentinel telling a stream to end
+
+
+def format_event(event, data):
+    """One SSE message; ``data`` must already be a string (e.g. JSON)."""
+    lines = [f'event: {event}']
+    lines.extend(f'data: {line}' for line in data.splitlines() or [''])
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.queue = queue.Queue(max_queue)
+
+    def get(self, timeout):
+        """Next ``(event, data)``, None after ``timeout`` seconds, or ``CLOSED``."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+    """Fan-out of per-shop events to the streams open in this process."""
+
+    def __init__(self, max_streams=8, max_queue=100):
+        self.max_streams = max_streams
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self._subscribers = {}   # user_id -> set of Subscription
+        self.state = {}          # user_id -> dict, only while the shop has open streams
+
+    def subscribe(self, user_id, load_state):
+        """A new ``Subscription``, or None when this process already serves ``max_streams``.
+
+        ``load_state()`` builds the shop's state if no other stream has it yet.
+        """
+        with self.lock:
+            if sum(len(subs) for subs in self._subscribers.values()) >= self.max_streams:
+                return None
+            has_state = user_id in self.state
+        state = None if has_state else load_state()
+        with self.lock:
+            subscription = Subscription(user_id, self.max_queue)
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self.state.setdefault(user_id, state)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subs = self._subscribers.get(subscription.user_id)
+            if subs is None:
+                return
+            subs.discard(subscription)
+            if not subs:
+                del self._subscribers[subscription.user_id]
+                self.state.pop(subscription.user_id, None)
+
+    def publish(self, user_id, event, data):
+        """Queue ``(event, data)`` for every stream of the shop.
+
+        A stream too slow to keep up is closed instead (the browser
+        reconnects and starts from the current state).
+        """
+        with self.lock:
+            subs = list(self._subscribers.get(user_id, ()))
+        for subscription in subs:
+            try:
+                subscription.queue.put_nowait((event, data))
+            except queue.Full:
+                self.unsubscribe(subscription)
+                _drain(subscription.queue)
+                subscription.queue.put_nowait(CLOSED)
+
+    def users(self):
+        with self.lock:
+            return list(self._subscribers)
+
+
+class Poller:
+    """Calls ``check(user_ids)`` in an app context every ``interval`` seconds while any stream is open."""
+
+    def __init__(self, broker, check, interval=2.0):
+        self.broker = broker
+        self.check = check
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self, app):
+        # Started lazily, so it runs in each forked worker rather than the master
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app,), name='live-poller', daemon=True)
+                self._thread.start()
+
+    def _run(self, app):
+        while True:
+            time.sleep(self.interval)
+            users = self.broker.users()
+            if not users:
+                continue
+            try:
+                with app.app_context():
+                    self.check(users)
+            except Exception:
+                # Keep polling; the next round retries
+                logging.getLogger(__name__).exception('live dashboard poll failed')
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
@@ -0,0 +1,331 @@
+"""Load test: many concurrent tills and dashboard viewers against a running server.
+
+Each till logs in and serves customers: one to three counter sales
+(``POST /inventory``) and then "Next customer", with an occasional
+stock-in.  Products are picked in proportion to how well they sell.  The
+run replays one business day squeezed into ``--duration`` seconds, and
+customers arrive following the hour-of-day weights of
+generate_daily_sales.py, so the evening rush comes near the end.
+``--rate`` sets customers per second per till at the busiest hour.
+Viewers keep reloading the dashboard and analytics pages.
+
+For every kind of request the run reports throughput, latency
+percentiles and errors.  Errors are split into "Not enough stock",
+``database is locked`` (the server answers 503), other 5xx/4xx responses,
+timeouts and refused connections.  Save a run and compare it with a later
+one to see what a change did:
+
+    gunicorn                                   # in another terminal
+    python loadtest.py run --tills 8 --viewers 4 --duration 60 --save before.json
+    python loadtest.py run --tills 8 --viewers 4 --duration 60 --save after.json
+    python loadtest.py compare before.json after.json
+
+Sales and stock-ins are real, so point it at a copy of the database.
+The load generator takes CPU too, so for numbers that matter run it from
+another machine.
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+from generate_daily_sales import BUSINESS_HOURS, HOUR_PROBS
+
+OUTCOMES = ['ok', 'out_of_stock', 'db_locked', 'server_error', 'client_error', 'timeout', 'connection']
+OPS = ['login', 'sale', 'next_customer', 'stock_in', 'dashboard', 'analytics']
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time the POST itself, not the page it redirects to"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def classify(status, body):
+    if status is None:
+        return 'connection'
+    if status == 503 and 'database is locked' in body:
+        return 'db_locked'
+    if status >= 500:
+        return 'server_error'
+    if status >= 400:
+        return 'client_error'
+    if body.startswith('Not enough stock'):
+        return 'out_of_stock'
+    return 'ok'
+
+
+class Stats:
+    """Latencies and outcomes per kind of request, shared by every virtual user"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: dict.fromkeys(OUTCOMES, 0))
+
+    def record(self, op, outcome, seconds):
+        with self._lock:
+            self.outcomes[op][outcome] += 1
+            if outcome not in ('timeout', 'connection'):
+                self.latencies[op].append(seconds * 1000)
+
+
+class Client:
+    """One virtual user: its own cookie jar (session), every request recorded in ``stats``"""
+
+    def __init__(self, base, stats, timeout):
+        self.base = base
+        self.stats = stats
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, op, path, form=None):
+        """``(status, body)``; status is None when no response came back"""
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        start = time.perf_counter()
+        status, body = None, ''
+        try:
+            with self.opener.open(f'{self.base}{path}', data, timeout=self.timeout) as response:
+                status, body = response.status, response.read().decode(errors='replace')
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read().decode(errors='replace')
+        except (socket.timeout, TimeoutError):
+            self.stats.record(op, 'timeout', time.perf_counter() - start)
+            return None, ''
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        # Redirects (after a sale, a login) are successes
+        outcome = 'ok' if status in (301, 302, 303) else classify(status, body)
+        self.stats.record(op, outcome, time.perf_counter() - start)
+        return status, body
+
+    def login(self, username, password):
+        status, _ = self.request('login', '/login', {'username': username, 'password': password})
+        return status == 302
+
+
+class ShopDay:
+    """Maps elapsed run time onto the business day and its customer arrival weight"""
+
+    def __init__(self, duration):
+        self.start = time.time()
+        self.duration = duration
+        peak = max(HOUR_PROBS)
+        self.weights = [p / peak for p in HOUR_PROBS]
+
+    def hour_index(self):
+        elapsed = (time.time() - self.start) / self.duration
+        return min(int(elapsed * len(BUSINESS_HOURS)), len(BUSINESS_HOURS) - 1)
+
+    def weight(self):
+        return self.weights[self.hour_index()]
+
+
+def load_products(client):
+    """``[(product_id, sales weight, cost price)]`` from the stock valuation API"""
+    status, body = client.request('dashboard', '/api/stock/valuation')
+    if status != 200:
+        raise RuntimeError(f'could not list products (HTTP {status})')
+    rows = json.loads(body)['products']
+    costs = [p['value'] / p['units'] for p in rows if p['units'] > 0]
+    fallback = sorted(costs)[len(costs) // 2] if costs else 10.0
+    return [(p['product_id'], p['avg_daily'] + 0.1, round(p['value'] / p['units'], 2) if p['units'] > 0 else fallback)
+            for p in rows]
+
+
+def till(client, products, day, stop, rng, args):
+    ids = [p[0] for p in products]
+    weights = [p[1] for p in products]
+    costs = {p[0]: p[2] for p in products}
+    while not stop.is_set():
+        if rng.random() < args.stock_in_share:
+            product_id = rng.choices(ids, weights)[0]
+            client.request('stock_in', '/stock', {'action': 'stock_in', 'product_id': product_id,
+                                                  'quantity': rng.randint(20, 60), 'cost_price': costs[product_id]})
+        else:
+            for product_id in set(rng.choices(ids, weights, k=rng.choice([1, 1, 1, 2, 2, 3]))):
+                client.request('sale', '/inventory', {'product_id': product_id, 'quantity': rng.choice([1, 1, 1, 2, 3])})
+            client.request('next_customer', '/inventory/next-customer', {})
+        stop.wait(rng.expovariate(args.rate * day.weight()))
+
+
+def viewer(client, stop, rng, args):
+    while not stop.is_set():
+        client.request('dashboard', '/dashboard')
+        if rng.random() < 0.5:
+            client.request('analytics', '/analytics')
+        stop.wait(rng.expovariate(1 / args.view_interval))
+
+
+def run(args):
+    base = args.server.rstrip('/')
+    stats = Stats()
+    rng = random.Random(args.seed)
+
+    clients = []
+    for _ in range(args.tills + args.viewers):
+        client = Client(base, stats, args.timeout)
+        if not client.login(args.username, args.password):
+            raise SystemExit(f'❌ Could not log in to {base} as {args.username}')
+        clients.append(client)
+    products = load_products(clients[0])
+    if not products:
+        raise SystemExit('❌ The shop has no products')
+    # Logins and the product listing are set-up, not load
+    stats.latencies.clear()
+    stats.outcomes.clear()
+
+    stop = threading.Event()
+    day = ShopDay(args.duration)
+    threads = []
+    for i, client in enumerate(clients):
+        user_rng = random.Random(rng.random())
+        if i < args.tills:
+            target, params = till, (client, products, day, stop, user_rng, args)
+        else:
+            target, params = viewer, (client, stop, user_rng, args)
+        threads.append(threading.Thread(target=target, args=params, daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(args.timeout + 1)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'label': args.label or datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'server': base,
+        'tills': args.tills,
+        'viewers': args.viewers,
+        'duration': args.duration,
+        'rate': args.rate,
+        'elapsed': round(elapsed, 1),
+        'ops': {op: summarise(stats.outcomes[op], stats.latencies[op], elapsed)
+                for op in OPS if op in stats.outcomes},
+        'total': summarise(
+            {o: sum(c[o] for c in stats.outcomes.values()) for o in OUTCOMES},
+            [ms for values in stats.latencies.values() for ms in values], elapsed),
+    }
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+
+
+def summarise(outcomes, latencies, elapsed):
+    ordered = sorted(latencies)
+    requests = sum(outcomes.values())
+    return {
+        'requests': requests,
+        'per_second': round(requests / elapsed, 2) if elapsed else 0,
+        'p50': _percentile(ordered, 50),
+        'p90': _percentile(ordered, 90),
+        'p99': _percentile(ordered, 99),
+        'max': round(ordered[-1], 1) if ordered else None,
+        'outcomes': dict(outcomes),
+        'error_rate': round(1 - outcomes.get('ok', 0) / requests, 4) if requests else 0,
+    }
+
+
+def _ms(value):
+    return f'{value:>8.1f}' if value is not None else f'{"-":>8}'
+
+
+def print_report(result):
+    print(f"🧪 {result['label']}: {result['tills']} tills, {result['viewers']} viewers, "
+          f"{result['elapsed']} s against {result['server']}\n")
+    print(f'   {"request":<14}{"count":>8}{"req/s":>9}{"p50 ms":>8}{"p90 ms":>8}{"p99 ms":>8}{"max ms":>8}{"errors":>9}')
+    for op, s in list(result['ops'].items()) + [('total', result['total'])]:
+        print(f'   {op:<14}{s["requests"]:>8}{s["per_second"]:>9.1f}{_ms(s["p50"])}{_ms(s["p90"])}'
+              f'{_ms(s["p99"])}{_ms(s["max"])}{s["error_rate"]:>9.1%}')
+    outcomes = result['total']['outcomes']
+    errors = [f'{o} {outcomes[o]}' for o in OUTCOMES[1:] if outcomes.get(o)]
+    print(f"\n   {'⚠️  ' + ', '.join(errors) if errors else '✅ no errors'}")
+    sales = result['ops'].get('sale')
+    if sales:
+        print(f"   💰 {sales['outcomes']['ok'] / result['elapsed']:.1f} sales/s recorded")
+
+
+def _change(before, after):
+    if before is None or after is None:
+        return f'{"-":>8}'
+    if not before:
+        return f'{"new":>8}'
+    return f'{(after - before) / before:>+8.0%}'
+
+
+def compare(before, after):
+    print(f"🔬 {before['label']}  →  {after['label']}")
+    for key in ('tills', 'viewers', 'duration', 'rate'):
+        if before[key] != after[key]:
+            print(f'   ⚠️  {key} differs: {before[key]} vs {after[key]}')
+    print(f'\n   {"request":<14}{"req/s":>16}{"change":>8}{"p50 ms":>18}{"change":>8}'
+          f'{"p99 ms":>18}{"change":>8}{"errors":>16}')
+    ops = [op for op in OPS if op in before['ops'] or op in after['ops']] + ['total']
+    for op in ops:
+        a = before['total'] if op == 'total' else before['ops'].get(op)
+        b = after['total'] if op == 'total' else after['ops'].get(op)
+        if not a or not b:
+            print(f'   {op:<14} only in {"after" if b else "before"}')
+            continue
+        print(f'   {op:<14}{a["per_second"]:>7.1f} → {b["per_second"]:>6.1f}{_change(a["per_second"], b["per_second"])}'
+              f'{_ms(a["p50"])} → {_ms(b["p50"])[1:]}{_change(a["p50"], b["p50"])}'
+              f'{_ms(a["p99"])} → {_ms(b["p99"])[1:]}{_change(a["p99"], b["p99"])}'
+              f'{a["error_rate"]:>7.1%} → {b["error_rate"]:>6.1%}')
+    print()
+    for outcome in OUTCOMES[1:]:
+        a, b = before['total']['outcomes'].get(outcome, 0), after['total']['outcomes'].get(outcome, 0)
+        if a or b:
+            print(f'   {outcome:<14}{a:>7} → {b:>6}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent tills and dashboard viewers against a running server')
+    sub = parser.add_subparsers(dest='command', required=True)
+    go = sub.add_parser('run', help='drive load and report throughput, latency and errors')
+    go.add_argument('--server', default='http://127.0.0.1:5000')
+    go.add_argument('--tills', type=int, default=4)
+    go.add_argument('--viewers', type=int, default=2)
+    go.add_argument('--duration', type=float, default=60, help='seconds; one business day is replayed over them')
+    go.add_argument('--rate', type=float, default=1.0, help='customers per second per till at the busiest hour')
+    go.add_argument('--stock-in-share', type=float, default=0.03, help='share of till actions that are stock-ins')
+    go.add_argument('--view-interval', type=float, default=2.0, help='mean seconds between a viewer\'s page loads')
+    go.add_argument('--timeout', type=float, default=30)
+    go.add_argument('--username', default='demo_shop')
+    go.add_argument('--password', default='password123')
+    go.add_argument('--seed', type=int)
+    go.add_argument('--label', help='name of the run in reports (default: start time)')
+    go.add_argument('--save', help='write the results to this JSON file')
+    diff = sub.add_parser('compare', help='compare two saved runs')
+    diff.add_argument('before')
+    diff.add_argument('after')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.before) as f, open(args.after) as g:
+            compare(json.load(f), json.load(g))
+        return
+    result = run(args)
+    print_report(result)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'   💾 Saved to {args.save}')
+
+
+if __name__ == '__main__':
+    main()
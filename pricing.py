@@ -0,0 +1,152 @@
+"""Product price history.
+
+``Product.selling_price`` / ``cost_price`` only hold today's prices.  Every
+change is also kept in ``product_price`` as a version valid over
+``[effective_from, effective_to)``.  A product's versions cover all time
+without gaps or overlaps: the first starts at ``BEGINNING`` and the
+current one runs to ``OPEN_END``.  The table is clustered on
+``(product_id, effective_from)``, so finding the version in effect at a
+moment, for one sale or for every sale in a query, is a short index
+range scan (see ``COST_JOIN``).
+
+Sales already store the selling price they were rung up at.  Profit needs
+the cost price of the time, which timeseries.py and the archive's frozen
+totals take from here.  Times use the same clock as sale dates.  All
+functions take a sqlite3-compatible DB-API connection and leave
+committing to the caller.
+
+    python pricing.py history 5
+    python pricing.py at 5 "2025-10-24 18:00"
+"""
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+
+BEGINNING = '0001-01-01 00:00:00'
+OPEN_END = '9999-12-31 23:59:59'
+
+# Version in effect at each sale ``s``; use ``COALESCE(pp.cost_price, p.cost_price)``
+# for products that have no history yet
+COST_JOIN = '''
+    LEFT JOIN product_price pp ON pp.product_id = s.product_id
+        AND pp.effective_from <= {date} AND pp.effective_to > {date}
+'''
+
+
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_price (
+            product_id INTEGER NOT NULL,
+            effective_from DATETIME NOT NULL,
+            effective_to DATETIME NOT NULL,
+            user_id INTEGER NOT NULL,
+            selling_price FLOAT,
+            cost_price FLOAT,
+            PRIMARY KEY (product_id, effective_from)
+        ) WITHOUT ROWID
+    ''')
+
+
+def backfill(conn):
+    """Give every product without history one version at its current prices; returns how many."""
+    ensure_schema(conn)
+    return conn.execute('''
+        INSERT INTO product_price (product_id, effective_from, effective_to, user_id, selling_price, cost_price)
+        SELECT id, ?, ?, user_id, selling_price, cost_price FROM product p
+        WHERE NOT EXISTS (SELECT 1 FROM product_price pp WHERE pp.product_id = p.id)
+    ''', (BEGINNING, OPEN_END)).rowcount
+
+
+def set_price(conn, user_id, product_id, selling_price, cost_price, effective_from=None):
+    """Record new prices from ``effective_from`` (default now); returns False if nothing changed.
+
+    The version in effect at that moment is split in two.  A back-dated
+    change therefore only lasts until the next change already recorded.
+    """
+    at = str(effective_from or datetime.utcnow())
+    current = conn.execute('''
+        SELECT effective_from, effective_to, selling_price, cost_price FROM product_price
+        WHERE product_id = ? AND effective_from <= ? AND effective_to > ?
+    ''', (product_id, at, at)).fetchone()
+    if current is None:
+        conn.execute('''
+            INSERT INTO product_price (product_id, effective_from, effective_to, user_id, selling_price, cost_price)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (product_id, BEGINNING, OPEN_END, user_id, selling_price, cost_price))
+        return True
+    start, end, old_selling, old_cost = current
+    if (old_selling, old_cost) == (selling_price, cost_price):
+        return False
+    if start == at:
+        conn.execute('UPDATE product_price SET selling_price = ?, cost_price = ? WHERE product_id = ? AND effective_from = ?',
+                     (selling_price, cost_price, product_id, start))
+        return True
+    conn.execute('UPDATE product_price SET effective_to = ? WHERE product_id = ? AND effective_from = ?',
+                 (at, product_id, start))
+    conn.execute('''
+        INSERT INTO product_price (product_id, effective_from, effective_to, user_id, selling_price, cost_price)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (product_id, at, end, user_id, selling_price, cost_price))
+    return True
+
+
+def price_at(conn, product_id, at):
+    """``(selling_price, cost_price)`` in effect at ``at``, or None without history."""
+    at = str(at)
+    return conn.execute('''
+        SELECT selling_price, cost_price FROM product_price
+        WHERE product_id = ? AND effective_from <= ? AND effective_to > ?
+    ''', (product_id, at, at)).fetchone()
+
+
+def history(conn, product_id):
+    """``[{'effective_from', 'effective_to', 'selling_price', 'cost_price'}]``, oldest first.
+
+    The open ends are None rather than the sentinels.
+    """
+    rows = conn.execute('''
+        SELECT effective_from, effective_to, selling_price, cost_price FROM product_price
+        WHERE product_id = ? ORDER BY effective_from
+    ''', (product_id,)).fetchall()
+    return [{
+        'effective_from': None if start == BEGINNING else start,
+        'effective_to': None if end == OPEN_END else end,
+        'selling_price': selling,
+        'cost_price': cost,
+    } for start, end, selling, cost in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Product price history')
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('history', help='every price a product has had')
+    show.add_argument('product_id', type=int)
+    at = sub.add_parser('at', help='prices in effect at a moment')
+    at.add_argument('product_id', type=int)
+    at.add_argument('moment', help='YYYY-MM-DD[ HH:MM[:SS]]')
+    sub.add_parser('backfill', help='start history for products that have none')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ensure_schema(conn)
+    if args.command == 'backfill':
+        print(f'✅ History started for {backfill(conn)} products')
+        conn.commit()
+    elif args.command == 'at':
+        prices = price_at(conn, args.product_id, datetime.fromisoformat(args.moment))
+        if prices is None:
+            print(f'❌ No price history for product {args.product_id}')
+        else:
+            print(f'💲 Product {args.product_id} at {args.moment}: sold at ₹{prices[0]}, cost ₹{prices[1]}')
+    else:
+        print(f'💲 Price history of product {args.product_id}:')
+        for version in history(conn, args.product_id):
+            print(f"   {version['effective_from'] or 'beginning':<26} → {version['effective_to'] or 'now':<26}"
+                  f"  sold at ₹{version['selling_price']}, cost ₹{version['cost_price']}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
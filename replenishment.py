@@ -0,0 +1,158 @@
+"""Replenishment planning: reorder points and order quantities for every product.
+
+Demand comes from a forecasting engine, supplier timing from ``stock_in``
+history.  All per-product maths is done as numpy array operations so a
+whole catalog is planned in one pass.
+
+``stock_in`` only records when goods arrived, not when they were ordered,
+so timing is inferred from the gaps between receipts: the typical (median)
+gap is the order cadence, and a low percentile of the gaps - the quickest
+the supplier has ever turned a top-up around - is used as the lead time.
+"""
+import os
+from datetime import datetime, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+import forecasting
+
+DEFAULT_LEAD_TIME_DAYS = float(os.environ.get('REORDER_LEAD_TIME_DAYS', 3))
+DEFAULT_CADENCE_DAYS = float(os.environ.get('REORDER_CADENCE_DAYS', 14))
+ORDER_COST = float(os.environ.get('REORDER_ORDER_COST', 50))        # ₹ per purchase order line
+HOLDING_RATE = float(os.environ.get('REORDER_HOLDING_RATE', 0.25))  # share of unit cost per year
+SERVICE_LEVEL = float(os.environ.get('REORDER_SERVICE_LEVEL', 0.95))
+
+
+def _group_percentile(groups, values, q, n_groups, default):
+    """``q``-th percentile of ``values`` per group id (nearest rank), ``default`` for empty groups."""
+    result = np.full(n_groups, default, dtype=float)
+    if len(values) == 0:
+        return result
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    has = counts > 0
+    pick = starts[has] + np.floor(q * (counts[has] - 1)).astype(int)
+    result[has] = values[pick]
+    return result
+
+
+def supplier_timing(conn, user_id, product_ids):
+    """Order cadence, lead time and latest unit cost per product from ``stock_in``.
+
+    Returns three arrays aligned with ``product_ids``.
+    """
+    index = {pid: i for i, pid in enumerate(product_ids)}
+    n = len(product_ids)
+
+    rows = conn.execute('''
+        SELECT product_id, JULIANDAY(DATE(date)) AS day
+        FROM stock_in
+        WHERE user_id = ?
+        GROUP BY product_id, day
+        ORDER BY product_id, day
+    ''', (user_id,)).fetchall()
+    rows = [(index[pid], day) for pid, day in rows if pid in index]
+    if rows:
+        group = np.array([r[0] for r in rows])
+        day = np.array([r[1] for r in rows], dtype=float)
+        same = group[1:] == group[:-1]
+        gap_group, gaps = group[1:][same], np.diff(day)[same]
+    else:
+        gap_group, gaps = np.array([], dtype=int), np.array([], dtype=float)
+
+    cadence = _group_percentile(gap_group, gaps, 0.5, n, DEFAULT_CADENCE_DAYS)
+    lead_time = _group_percentile(gap_group, gaps, 0.1, n, DEFAULT_LEAD_TIME_DAYS)
+    lead_time = np.clip(np.minimum(lead_time, cadence), 1, None)
+
+    unit_cost = np.full(n, np.nan)
+    for pid, cost in conn.execute('''
+        SELECT product_id, cost_price FROM stock_in
+        WHERE id IN (SELECT MAX(id) FROM stock_in WHERE user_id = ? GROUP BY product_id)
+    ''', (user_id,)):
+        if pid in index and cost is not None:
+            unit_cost[index[pid]] = cost
+    return cadence, lead_time, unit_cost
+
+
+def plan(stock, demand, demand_std, lead_time, cadence, unit_cost,
+         order_cost=ORDER_COST, holding_rate=HOLDING_RATE, service_level=SERVICE_LEVEL):
+    """Vectorised (s, Q) policy for all products.
+
+    ``demand`` / ``demand_std`` are per-day units; ``lead_time`` and
+    ``cadence`` are in days.  Returns a dict of arrays.
+    """
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = z * demand_std * np.sqrt(lead_time)
+    reorder_point = demand * lead_time + safety_stock
+
+    holding_cost = np.maximum(unit_cost * holding_rate, 1e-6)
+    eoq = np.sqrt(2 * demand * 365 * order_cost / holding_cost)
+    # Never order less than one cadence worth of demand, so the next
+    # scheduled delivery is not needed before it is due
+    eoq = np.maximum(eoq, demand * cadence)
+
+    needs_order = (stock <= reorder_point) & (demand > 0)
+    order_qty = np.where(needs_order, np.ceil(np.maximum(eoq, reorder_point - stock + demand * lead_time)), 0)
+    days_of_cover = np.where(demand > 0, stock / np.maximum(demand, 1e-9), np.inf)
+    return {
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'eoq': eoq,
+        'order_qty': order_qty,
+        'order_value': order_qty * unit_cost,
+        'days_of_cover': days_of_cover,
+        'needs_order': needs_order,
+    }
+
+
+def purchase_orders(conn, user_id, products, engine=None, as_of=None, history=None, forecasts=None):
+    """Purchase-order lines for ``products`` (objects with id, name, current_stock, cost_price).
+
+    Pass ``history`` / ``forecasts`` when the caller already has them to
+    avoid forecasting twice.  Lines are sorted by days of cover, most
+    urgent first.
+    """
+    if not products:
+        return []
+    engine = engine or forecasting.HeuristicForecaster()
+    as_of = as_of or datetime.now().date() + timedelta(days=1)
+    product_ids = [p.id for p in products]
+
+    if history is None:
+        history = forecasting.load_history(conn, user_id,
+                                           since=as_of - timedelta(days=engine.history_days(as_of)),
+                                           until=as_of)
+    if forecasts is None:
+        forecasts = engine.predict(history, as_of)
+    demand = np.array([forecasts.get(pid, {}).get('predicted', 0.0) / forecasting.HORIZON_DAYS
+                       for pid in product_ids])
+    recent = history.subset(product_ids).quantities[:, -91:]
+    demand_std = recent.std(axis=1) if recent.shape[1] else np.zeros(len(product_ids))
+
+    cadence, lead_time, unit_cost = supplier_timing(conn, user_id, product_ids)
+    fallback_cost = np.array([p.cost_price or 0.0 for p in products], dtype=float)
+    unit_cost = np.where(np.isnan(unit_cost), fallback_cost, unit_cost)
+    stock = np.array([p.current_stock or 0.0 for p in products], dtype=float)
+
+    result = plan(stock, demand, demand_std, lead_time, cadence, unit_cost)
+
+    lines = []
+    for i in np.flatnonzero(result['needs_order']):
+        lines.append({
+            'product_id': product_ids[i],
+            'product_name': products[i].name,
+            'current_stock': round(float(stock[i]), 1),
+            'avg_daily': round(float(demand[i]), 1),
+            'lead_time': round(float(lead_time[i]), 1),
+            'cadence': round(float(cadence[i]), 1),
+            'safety_stock': round(float(result['safety_stock'][i]), 1),
+            'reorder_point': round(float(result['reorder_point'][i]), 1),
+            'order_qty': float(result['order_qty'][i]),
+            'order_value': round(float(result['order_value'][i]), 2),
+            'days_of_cover': round(float(result['days_of_cover'][i]), 1),
+        })
+    lines.sort(key=lambda line: line['days_of_cover'])
+    return lines
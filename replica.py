@@ -0,0 +1,139 @@
+"""Read-only connections for reports, so long reads do not hold up sale entry.
+
+The database runs in WAL mode (``init_app`` sets it on every connection):
+readers no longer block the writer, nor the writer readers.  Report
+routes also stop reading through the request's session connection and
+get a read-only connection of their own from a ``ReadRouter``:
+
+- ``max_staleness == 0``: a snapshot of the primary.  A read transaction
+  on a separate ``mode=ro`` connection, so every query of the report sees
+  the same committed state.
+- ``max_staleness > 0``: a replica file copied from the primary with the
+  SQLite backup API and opened immutable (no locks at all).  Unlike a long
+  snapshot it does not pin the primary's WAL, which can then checkpoint
+  instead of growing.  Once the copy is older than a route allows, it is
+  refreshed in the background and requests read a snapshot until the new
+  copy lands, so the bound always holds.
+
+Routes and their bounds in seconds come from ``REPORT_STALENESS``
+(endpoint -> seconds).  Endpoints not listed, and any writes, use the
+primary through the session as before.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from flask import g, request
+from sqlalchemy import event
+
+
+def enable_wal(dbapi_conn, connection_record=None):
+    """SQLAlchemy ``connect`` listener; a no-op once the file is in WAL mode."""
+    dbapi_conn.execute('PRAGMA journal_mode=WAL')
+
+
+def _uri(path, **params):
+    return f"file:{quote(os.path.abspath(path))}?{'&'.join(f'{k}={v}' for k, v in params.items())}"
+
+
+class ReadRouter:
+    """Hands report routes a snapshot or replica connection per their staleness bound"""
+
+    def __init__(self, primary_path=None, replica_path=None, routes=None):
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.routes = dict(routes or {})   # endpoint -> max staleness (seconds)
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def init_app(self, app, db):
+        """Put ``app``'s database in WAL mode and route its report endpoints."""
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'connect', enable_wal)
+        database = engine.url.database
+        self.primary_path = database if database and database != ':memory:' else None
+        self.replica_path = app.config.get('REPORT_REPLICA_PATH') or os.path.join(app.instance_path, 'shop-replica.db')
+        self.routes = dict(app.config.get('REPORT_STALENESS', {}))
+        app.teardown_appcontext(self._close_request_connection)
+
+    # ----- connections -----
+    def snapshot(self):
+        """Read-only connection to the primary holding one read transaction."""
+        conn = sqlite3.connect(_uri(self.primary_path, mode='ro'), uri=True, isolation_level=None)
+        conn.execute('BEGIN')
+        return conn
+
+    def replica_age(self):
+        """Seconds since the replica's copy was taken, or None without one."""
+        try:
+            return time.time() - os.path.getmtime(self.replica_path)
+        except OSError:
+            return None
+
+    def connection(self, max_staleness):
+        """Read-only connection at most ``max_staleness`` seconds behind the primary."""
+        if max_staleness > 0:
+            age = self.replica_age()
+            if age is not None and age <= max_staleness:
+                return sqlite3.connect(_uri(self.replica_path, immutable=1), uri=True)
+            self.refresh_in_background(max_staleness)
+        return self.snapshot()
+
+    def for_request(self):
+        """The current request's report connection, or None if its endpoint reads the primary."""
+        if 'report_connection' not in g:
+            max_staleness = self.routes.get(request.endpoint)
+            g.report_connection = (None if max_staleness is None or self.primary_path is None
+                                   else self.connection(max_staleness))
+        return g.report_connection
+
+    def _close_request_connection(self, exc=None):
+        conn = g.pop('report_connection', None)
+        if conn is not None:
+            conn.close()
+
+    # ----- replica -----
+    def refresh(self):
+        """Copy the primary to the replica file; readers of the old copy are unaffected."""
+        started = time.time()
+        tmp = f'{self.replica_path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        source = sqlite3.connect(_uri(self.primary_path, mode='ro'), uri=True)
+        target = sqlite3.connect(tmp)
+        try:
+            # One step, so the copy is a single consistent snapshot; in WAL
+            # mode that read does not block writers
+            source.backup(target)
+            target.execute('PRAGMA journal_mode=DELETE')  # readable without -wal/-shm files
+            target.close()
+            # The copy is as old as the moment it started
+            os.utime(tmp, (started, started))
+            os.replace(tmp, self.replica_path)
+        finally:
+            source.close()
+            target.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def refresh_in_background(self, max_staleness=0):
+        """Start a refresh unless one is running here or another worker just finished one."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                age = self.replica_age()
+                if age is None or age > max_staleness:
+                    self.refresh()
+            except Exception:
+                # Reports keep reading snapshots; the next stale request retries
+                logging.getLogger(__name__).exception('replica refresh failed')
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='replica-refresh', daemon=True).start()
@@ -0,0 +1,241 @@
+"""Analysis, prediction and daily-summary reports for every shop, built in parallel.
+
+Each shop is one task in a process pool.  Every worker opens a single
+read-only SQLite connection when it starts and reuses it for all the shops
+it builds, so workers never contend for a write lock with the running app.
+Per shop, ``<out>/<user_id>-<shop name>/`` gets
+
+    daily_summary.csv    one row per day with sales (hot and archived)
+    analysis.json        totals, months, top products, weekday vs weekend
+    predictions.json     next-month forecasts and purchase orders
+    report.html          all of the above on one page
+
+    python reports.py --out reports --workers 4
+    python reports.py --users 1 3 --formats csv,json --as-of 2026-02-01
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import forecasting
+import replenishment
+import timeseries
+
+FORMATS = ('html', 'csv', 'json')
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# Per-worker state, set up once by _init_worker
+_conn = None
+_templates = None
+_engine_name = None
+_model_dir = None
+
+
+# ============= REPORT DATA =============
+def daily_summary(conn, user_id):
+    """One row per day with sales, the columns of the generator's ``daily_sales_summary.csv``."""
+    rows = []
+    for day in timeseries.query(conn, user_id, granularity='day'):
+        rows.append({
+            'Date': day['bucket'],
+            'Transactions': day['transactions'],
+            'Items_Sold': day['units'],
+            'Revenue': round(day['revenue'], 2),
+            'Avg_Transaction': round(day['revenue'] / day['transactions'], 2) if day['transactions'] else 0,
+            'Profit': round(day['profit'], 2),
+            'Profit_Margin': round(day['profit'] / day['revenue'] * 100, 1) if day['revenue'] else 0,
+        })
+    return rows
+
+
+def analysis(conn, user_id, days, products):
+    """Overall totals, monthly breakdown, top 10 products and weekday vs weekend."""
+    revenue = sum(d['Revenue'] for d in days)
+    transactions = sum(d['Transactions'] for d in days)
+    by_product = timeseries.totals(conn, user_id, by='product')
+    top = sorted(by_product.items(), key=lambda item: item[1]['revenue'], reverse=True)[:10]
+    by_weekday = timeseries.totals(conn, user_id, by='weekday')
+    day_types = {}
+    for weekday, metrics in by_weekday.items():
+        day_type = day_types.setdefault('Weekend' if weekday >= 5 else 'Weekday',
+                                        {'revenue': 0, 'transactions': 0})
+        day_type['revenue'] += metrics['revenue']
+        day_type['transactions'] += metrics['transactions']
+    return {
+        'overall': {
+            'transactions': transactions,
+            'revenue': round(revenue, 2),
+            'items_sold': sum(d['Items_Sold'] for d in days),
+            'avg_transaction': round(revenue / transactions, 2) if transactions else 0,
+            'days_with_sales': len(days),
+            'first_day': days[0]['Date'] if days else None,
+            'last_day': days[-1]['Date'] if days else None,
+        },
+        'months': [{
+            'month': month['bucket'][:7],
+            'revenue': round(month['revenue'], 2),
+            'units': month['units'],
+            'transactions': month['transactions'],
+        } for month in timeseries.query(conn, user_id, granularity='month')],
+        'top_products': [{
+            'product_id': product_id,
+            'name': products[product_id].name if product_id in products else 'Unknown',
+            'revenue': round(metrics['revenue'], 2),
+            'units': metrics['units'],
+            'times_sold': metrics['transactions'],
+        } for product_id, metrics in top],
+        'weekdays': [{
+            'weekday': WEEKDAYS[weekday],
+            'revenue': round(metrics['revenue'], 2),
+            'avg_sale': round(metrics['revenue'] / metrics['transactions'], 2) if metrics['transactions'] else 0,
+        } for weekday, metrics in sorted(by_weekday.items())],
+        'day_types': {name: {
+            'revenue': round(d['revenue'], 2),
+            'transactions': d['transactions'],
+            'avg_sale': round(d['revenue'] / d['transactions'], 2) if d['transactions'] else 0,
+        } for name, d in sorted(day_types.items())},
+    }
+
+
+def predictions(conn, user_id, products, engine, as_of):
+    """Next-month forecast per product and purchase orders, as the prediction page computes them."""
+    history = forecasting.load_history(conn, user_id,
+                                       since=as_of - timedelta(days=engine.history_days(as_of)),
+                                       until=as_of)
+    forecasts = engine.predict(history, as_of)
+    result = []
+    for product in products.values():
+        forecast = forecasts.get(product.id)
+        result.append({
+            'product_id': product.id,
+            'name': product.name,
+            'predicted_units': round(forecast['predicted'], 1) if forecast else 0,
+            'predicted_revenue': round(forecast['predicted'] * (product.selling_price or 0), 2) if forecast else 0,
+            'recommended_stock': round(forecast['recommended'], 1) if forecast else 0,
+            'current_stock': product.current_stock,
+            'trend': forecast['trend'] if forecast else 'No data',
+            'confidence': forecast['confidence'] if forecast else 'Low',
+        })
+    result.sort(key=lambda p: p['predicted_revenue'], reverse=True)
+    orders = replenishment.purchase_orders(conn, user_id, list(products.values()), engine, as_of,
+                                           history=history, forecasts=forecasts)
+    return {
+        'as_of': str(as_of),
+        'engine': engine.name,
+        'products': result,
+        'total_predicted_revenue': round(sum(p['predicted_revenue'] for p in result), 2),
+        'purchase_orders': orders,
+        'total_order_value': round(sum(o['order_value'] for o in orders), 2),
+    }
+
+
+# ============= WORKERS =============
+def _init_worker(db_path, engine_name, model_dir):
+    global _conn, _templates, _engine_name, _model_dir
+    import jinja2
+
+    _conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    _templates = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+        autoescape=True)
+    _engine_name, _model_dir = engine_name, model_dir
+
+
+def build_shop(user_id, shop_name, out_dir, formats, as_of):
+    """Write one shop's report files; returns ``(user_id, directory, days with sales, seconds)``."""
+    start = time.perf_counter()
+    products = {row[0]: SimpleNamespace(id=row[0], name=row[1], category=row[2], current_stock=row[3] or 0,
+                                        selling_price=row[4], cost_price=row[5])
+                for row in _conn.execute('''
+                    SELECT id, name, category, current_stock, selling_price, cost_price
+                    FROM product WHERE user_id = ? ORDER BY id
+                ''', (user_id,))}
+    days = daily_summary(_conn, user_id)
+    report = analysis(_conn, user_id, days, products)
+    engine = forecasting.get_engine(_engine_name, _model_dir, user_id)
+    forecast = predictions(_conn, user_id, products, engine, as_of)
+
+    directory = os.path.join(out_dir, f'{user_id}-{_slug(shop_name)}')
+    os.makedirs(directory, exist_ok=True)
+    if 'csv' in formats:
+        with open(os.path.join(directory, 'daily_summary.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['Date', 'Transactions', 'Items_Sold', 'Revenue',
+                                                   'Avg_Transaction', 'Profit', 'Profit_Margin'])
+            writer.writeheader()
+            writer.writerows(days)
+    if 'json' in formats:
+        for name, data in (('analysis.json', report), ('predictions.json', forecast)):
+            with open(os.path.join(directory, name), 'w') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+    if 'html' in formats:
+        html = _templates.get_template('shop_report.html').render(
+            shop_name=shop_name, user_id=user_id, analysis=report, predictions=forecast,
+            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M'))
+        with open(os.path.join(directory, 'report.html'), 'w') as f:
+            f.write(html)
+    return user_id, directory, len(days), time.perf_counter() - start
+
+
+def _slug(name):
+    return re.sub(r'[^a-z0-9]+', '-', (name or 'shop').lower()).strip('-') or 'shop'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build per-shop analysis, prediction and daily-summary reports')
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    parser.add_argument('--out', default='reports')
+    parser.add_argument('--users', type=int, nargs='*', help='only these shops (default: all)')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='comma-separated: html,csv,json')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--engine', default=os.environ.get('FORECAST_ENGINE', 'heuristic'))
+    parser.add_argument('--model-dir', default=forecasting.DEFAULT_MODEL_DIR)
+    parser.add_argument('--as-of', help='forecast from this date (YYYY-MM-DD, default tomorrow)')
+    args = parser.parse_args()
+
+    formats = {f.strip() for f in args.formats.split(',') if f.strip()}
+    if formats - set(FORMATS):
+        parser.error(f"unknown format(s): {', '.join(sorted(formats - set(FORMATS)))}")
+    as_of = datetime.strptime(args.as_of, '%Y-%m-%d').date() if args.as_of \
+        else datetime.now().date() + timedelta(days=1)
+
+    conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    shops = conn.execute('SELECT id, COALESCE(shop_name, username) FROM user ORDER BY id').fetchall()
+    conn.close()
+    if args.users:
+        shops = [shop for shop in shops if shop[0] in set(args.users)]
+    if not shops:
+        print('No shops found.')
+        return
+    workers = max(1, min(args.workers, len(shops)))
+
+    print(f'📊 Building reports for {len(shops)} shops with {workers} workers -> {args.out}/')
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(args.db, args.engine, args.model_dir)) as pool:
+        futures = {pool.submit(build_shop, user_id, name, args.out, formats, as_of): (user_id, name)
+                   for user_id, name in shops}
+        for future in as_completed(futures):
+            user_id, name = futures[future]
+            try:
+                _, directory, num_days, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'   ❌ #{user_id} {name}: {e}')
+                continue
+            print(f'   ✅ #{user_id} {name}: {num_days} days in {seconds:.2f}s -> {directory}')
+    elapsed = time.perf_counter() - start
+    built = len(shops) - failed
+    print(f'\n⏱️ {built} shops in {elapsed:.1f}s ({built / elapsed * 60:.1f} shops/minute)'
+          + (f', {failed} failed' if failed else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""Shop calendar: special days and seasonal multipliers.
+
+A ``Calendar`` multiplies a normal day's sales by three factors:
+
+- the month (festival season, summer),
+- the weekday,
+- named special days (festivals, holidays).
+
+``day_factors`` and the per-kind ``*_factors`` methods turn these into
+per-day numpy arrays over a date range.  The data generator uses them to
+shape demand, and the forecasting engines use them for seasonality and
+special-day features.
+
+Each shop's overrides live in ``shop_calendar`` (``kind`` 'month',
+'weekday' or 'day').  Whatever a shop has not set comes from the built-in
+defaults.  ``learn`` estimates weekday, month and special-day factors from
+the shop's daily revenue in one vectorised pass (ratio to a centred
+moving average).  Learnt values never replace ones set by hand.  All
+functions take a sqlite3-compatible DB-API connection and leave committing
+to the caller.
+
+    python shop_calendar.py --user 1 show
+    python shop_calendar.py --user 1 learn
+    python shop_calendar.py --user 1 set-day 2026-11-08 2.0 --name Diwali
+"""
+import argparse
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import archive
+import timeseries
+
+# Seasonal factors by month
+DEFAULT_MONTHS = {
+    8: 1.0,   # August - Normal
+    9: 1.1,   # September - Festival start
+    10: 1.15, # October - Navratri
+    11: 1.4,  # November - Diwali (PEAK)
+    12: 1.35, # December - Christmas
+    1: 1.2    # January - New Year
+}
+
+# Weekend factors
+DEFAULT_WEEKDAYS = {
+    0: 0.9,   # Monday
+    1: 0.95,  # Tuesday
+    2: 1.0,   # Wednesday
+    3: 1.0,   # Thursday
+    4: 1.2,   # Friday
+    5: 1.5,   # Saturday (PEAK)
+    6: 1.4    # Sunday
+}
+
+# Special dates (festivals, holidays): day -> (name, factor)
+DEFAULT_DAYS = {
+    "2025-10-02": ("Gandhi Jayanti", 1.3),
+    "2025-10-24": ("Diwali", 2.0),
+    "2025-11-01": ("Karnataka Rajyotsava", 1.4),
+    "2025-11-15": ("Children's Day", 1.3),
+    "2025-12-25": ("Christmas", 2.0),
+    "2025-12-31": ("New Year Eve", 1.8),
+    "2026-01-01": ("New Year Day", 1.5),
+    "2026-01-15": ("Pongal/Makar Sankranti", 1.3),
+    "2026-01-26": ("Republic Day", 1.2),
+}
+
+TREND_DAYS = 28          # centred moving average the learnt factors are relative to
+MIN_LEARN_DAYS = 8 * 7   # history needed before anything is learnt
+
+
+class Calendar:
+    """Month, weekday and special-day multipliers of one shop"""
+
+    def __init__(self, months=None, weekdays=None, days=None):
+        self.months = dict(DEFAULT_MONTHS if months is None else months)        # 1..12 -> factor
+        self.weekdays = dict(DEFAULT_WEEKDAYS if weekdays is None else weekdays)  # Monday = 0
+        self.days = dict(DEFAULT_DAYS if days is None else days)                # 'YYYY-MM-DD' -> (name, factor)
+
+    def month_factors(self, start, num_days):
+        months = (np.datetime64(_to_date(start), 'D') + np.arange(num_days)).astype('datetime64[M]').astype(int) % 12
+        table = np.array([self.months.get(m, 1.0) for m in range(1, 13)])
+        return table[months]
+
+    def weekday_factors(self, start, num_days):
+        table = np.array([self.weekdays.get(d, 1.0) for d in range(7)])
+        return table[(_to_date(start).weekday() + np.arange(num_days)) % 7]
+
+    def special_factors(self, start, num_days):
+        start = _to_date(start)
+        factors = np.ones(num_days)
+        for day, (_, factor) in self.days.items():
+            idx = (date.fromisoformat(day) - start).days
+            if 0 <= idx < num_days:
+                factors[idx] = factor
+        return factors
+
+    def day_factors(self, start, num_days):
+        """Combined multiplier of each of ``num_days`` days from ``start``."""
+        return (self.month_factors(start, num_days) * self.weekday_factors(start, num_days)
+                * self.special_factors(start, num_days))
+
+    def special_name(self, day):
+        entry = self.days.get(str(_to_date(day)))
+        return entry[0] if entry else None
+
+
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shop_calendar (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,           -- 'month' (key 1-12), 'weekday' (0 = Monday) or 'day' (YYYY-MM-DD)
+            key TEXT NOT NULL,
+            name TEXT,
+            factor FLOAT NOT NULL,
+            source TEXT NOT NULL,         -- 'manual' or 'learned'
+            PRIMARY KEY (user_id, kind, key)
+        ) WITHOUT ROWID
+    ''')
+
+
+def load(conn, user_id):
+    """The shop's calendar: its own entries over the defaults."""
+    calendar = Calendar()
+    try:
+        rows = conn.execute('SELECT kind, key, name, factor FROM shop_calendar WHERE user_id = ?', (user_id,)).fetchall()
+    except sqlite3.OperationalError:
+        return calendar  # never set up: defaults only
+    for kind, key, name, factor in rows:
+        if kind == 'month':
+            calendar.months[int(key)] = factor
+        elif kind == 'weekday':
+            calendar.weekdays[int(key)] = factor
+        else:
+            calendar.days[key] = (name or calendar.special_name(key) or 'Special day', factor)
+    return calendar
+
+
+def set_factor(conn, user_id, kind, key, factor, name=None, source='manual'):
+    """Store one multiplier; learnt values do not replace ones set by hand."""
+    if kind not in ('month', 'weekday', 'day'):
+        raise ValueError("kind must be 'month', 'weekday' or 'day'")
+    key = str(_to_date(key)) if kind == 'day' else str(int(key))
+    ensure_schema(conn)
+    conn.execute('''
+        INSERT INTO shop_calendar (user_id, kind, key, name, factor, source) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, kind, key) DO UPDATE SET
+            name = COALESCE(excluded.name, name), factor = excluded.factor, source = excluded.source
+        WHERE excluded.source = 'manual' OR source != 'manual'
+    ''', (user_id, kind, key, name, factor, source))
+
+
+def learn(conn, user_id, since=None, until=None, save=True):
+    """Estimate weekday, month and special-day factors from daily revenue.
+
+    Each day's revenue is compared with a centred ``TREND_DAYS`` moving
+    average, so growth does not read as seasonality.  Weekday factors are
+    the mean ratio per weekday, normalised to average 1.  Month factors
+    compare each calendar month's weekday-adjusted revenue with the
+    overall mean.  Special days known to the calendar get their own ratio.
+    Days without sales (shop shut) are left out.  Returns ``{'months',
+    'weekdays', 'days'}`` like the ``Calendar`` attributes, or None with
+    too little history.
+    """
+    calendar = load(conn, user_id)
+    if since is None or until is None:
+        first, last = conn.execute(
+            f'SELECT MIN(date), MAX(date) FROM {archive.sales_sql(conn)} WHERE user_id = ?',
+            (user_id,)).fetchone()
+        if first is None:
+            return None
+        since = since or _to_date(first)
+        until = until or _to_date(last) + timedelta(days=1)
+    since, until = _to_date(since), _to_date(until)
+    revenue = np.array([day['revenue'] for day in timeseries.series(conn, user_id, since, until, 'day')])
+    num_days = len(revenue)
+    if (revenue > 0).sum() < MIN_LEARN_DAYS:
+        return None
+
+    special = calendar.special_factors(since, num_days)
+    is_special = special != 1.0
+    open_days = revenue > 0
+    usual = open_days & ~is_special
+
+    # Centred moving average over usual open days only
+    window = np.ones(TREND_DAYS + 1)
+    totals = np.convolve(np.where(usual, revenue, 0.0), window, mode='same')
+    counts = np.convolve(usual.astype(float), window, mode='same')
+    trend = np.divide(totals, counts, out=np.zeros(num_days), where=counts > 0)
+    ok = usual & (trend > 0)
+    ratio = np.divide(revenue, trend, out=np.zeros(num_days), where=trend > 0)
+
+    weekday = (since.weekday() + np.arange(num_days)) % 7
+    seen = np.bincount(weekday[ok], minlength=7)
+    weekday_factor = np.divide(np.bincount(weekday[ok], ratio[ok], minlength=7), seen,
+                               out=np.ones(7), where=seen > 0)
+    weekday_factor /= weekday_factor[seen > 0].mean()
+
+    adjusted = revenue / weekday_factor[weekday]
+    month = (np.datetime64(since, 'D') + np.arange(num_days)).astype('datetime64[M]').astype(int) % 12
+    seen_months = np.bincount(month[ok], minlength=12)
+    month_factor = np.divide(np.bincount(month[ok], adjusted[ok], minlength=12), seen_months,
+                             out=np.zeros(12), where=seen_months > 0) / adjusted[ok].mean()
+
+    specials = np.flatnonzero(is_special & open_days & (trend > 0))
+    day_factor = revenue[specials] / (trend[specials] * weekday_factor[weekday[specials]])
+
+    learned = {
+        'weekdays': {d: round(float(weekday_factor[d]), 3) for d in range(7) if seen[d]},
+        'months': {m + 1: round(float(month_factor[m]), 3) for m in range(12) if seen_months[m]},
+        'days': {str(since + timedelta(days=int(i))): (calendar.special_name(since + timedelta(days=int(i))),
+                                                         round(float(f), 3))
+                 for i, f in zip(specials, day_factor)},
+    }
+    if save:
+        for kind, values in (('weekday', learned['weekdays']), ('month', learned['months'])):
+            for key, factor in values.items():
+                set_factor(conn, user_id, kind, key, factor, source='learned')
+        for day, (name, factor) in learned['days'].items():
+            set_factor(conn, user_id, 'day', day, factor, name=name, source='learned')
+    return learned
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shop calendar: special days and seasonal multipliers')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('show', help='the calendar in effect')
+    sub.add_parser('learn', help='estimate the multipliers from sales history')
+    day = sub.add_parser('set-day', help='add or change a special day')
+    day.add_argument('day', help='YYYY-MM-DD')
+    day.add_argument('factor', type=float)
+    day.add_argument('--name')
+    factor = sub.add_parser('set-factor', help='set a month (1-12) or weekday (0 = Monday) multiplier')
+    factor.add_argument('kind', choices=['month', 'weekday'])
+    factor.add_argument('key', type=int)
+    factor.add_argument('factor', type=float)
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == 'learn':
+        learned = learn(conn, args.user)
+        conn.commit()
+        if learned is None:
+            print('❌ Not enough sales history to learn from')
+            return
+        print(f"✅ Learnt {len(learned['weekdays'])} weekday, {len(learned['months'])} month "
+              f"and {len(learned['days'])} special-day factors")
+    elif args.command == 'set-day':
+        set_factor(conn, args.user, 'day', args.day, args.factor, name=args.name)
+        conn.commit()
+    elif args.command == 'set-factor':
+        set_factor(conn, args.user, args.kind, args.key, args.factor)
+        conn.commit()
+
+    calendar = load(conn, args.user)
+    weekday_names = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    print(f'📅 Calendar of shop {args.user}')
+    print('   Weekdays: ' + ', '.join(f'{weekday_names[d]} {calendar.weekdays.get(d, 1.0):.2f}' for d in range(7)))
+    print('   Months:   ' + ', '.join(f'{m} {calendar.months.get(m, 1.0):.2f}' for m in range(1, 13)))
+    print('   Special days:')
+    for day, (name, factor) in sorted(calendar.days.items()):
+        print(f'      {day}  {name}: {factor:.2f}x')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
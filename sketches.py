@@ -0,0 +1,385 @@
+"""Approximate all-time analytics from small incrementally maintained sketches.
+
+For very large shops the analytics page can read its all-time figures from
+a per-shop ``ShopSketch`` instead of scanning every sale:
+
+- top products by revenue: Space-Saving heavy hitters (units from a Count-Min sketch)
+- best day: running maximum over closed days, exact totals for recent ones
+- active days: HyperLogLog
+- average sale per weekday: reservoir samples
+
+Each sketch reports an error bound next to its estimate.  A shop's sketch
+is stored as JSON in ``analytics_sketch`` and updated in the same
+transaction as every sale (``record_sales``); shops without a row (exact
+mode) cost one primary-key lookup per sale batch.
+
+    python sketches.py rebuild --user 1     # (re)build from the full history
+    python sketches.py show --user 1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+from datetime import datetime
+
+import archive
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+# ============= SKETCHES =============
+class SpaceSaving:
+    """Weighted Space-Saving: the ``capacity`` heaviest items with an overestimate bound each.
+
+    Every item heavier than ``total / capacity`` is guaranteed to be tracked;
+    a tracked item's true weight is within ``[count - error, count]``.
+    """
+
+    def __init__(self, capacity=64, counters=None, total=0.0):
+        self.capacity = capacity
+        self.counters = counters or {}   # item -> [count, error]
+        self.total = total
+
+    def add(self, item, weight=1.0):
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0.0]
+        else:
+            smallest = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(smallest)[0]
+            self.counters[item] = [floor + weight, floor]
+
+    def top(self, n):
+        """``[(item, estimate, error)]``, heaviest first."""
+        ranked = sorted(self.counters.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+        return [(item, count, error) for item, (count, error) in ranked]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'total': self.total, 'counters': list(self.counters.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['capacity'], {item: list(counter) for item, counter in data['counters']}, data['total'])
+
+
+class CountMin:
+    """Count-Min sketch: estimates never undercount, and overcount by at most
+    ``epsilon * total`` with probability ``1 - delta``."""
+
+    def __init__(self, width=1024, depth=4, rows=None, total=0.0):
+        self.width = width
+        self.depth = depth
+        self.rows = rows or [[0.0] * width for _ in range(depth)]
+        self.total = total
+
+    @property
+    def epsilon(self):
+        return math.e / self.width
+
+    @property
+    def delta(self):
+        return math.exp(-self.depth)
+
+    def _cells(self, item):
+        # Double hashing: depth independent-enough positions from one 128-bit digest
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, count=1.0):
+        self.total += count
+        for row, cell in zip(self.rows, self._cells(item)):
+            row[cell] += count
+
+    def estimate(self, item):
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(item)))
+
+    def error_bound(self):
+        return self.epsilon * self.total
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth, 'total': self.total, 'rows': self.rows}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['width'], data['depth'], data['rows'], data['total'])
+
+
+class HyperLogLog:
+    """Distinct count with relative standard error ``1.04 / sqrt(2 ** precision)``."""
+
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)  # linear counting for small sets
+        return estimate
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': base64.b64encode(bytes(self.registers)).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['precision'], bytearray(base64.b64decode(data['registers'])))
+
+
+class BestDay:
+    """Highest-revenue day, keeping exact totals only for the last ``window`` days.
+
+    Older days are folded into a running maximum when they close.  Sales
+    that arrive for an already closed day (offline tills) cannot be placed
+    any more; their sum bounds how far the result can be off.
+    """
+
+    def __init__(self, window=14, open_days=None, best=None, late=0.0):
+        self.window = window
+        self.open_days = open_days or {}   # 'YYYY-MM-DD' -> revenue
+        self.best = best                   # [day, revenue] of the best closed day
+        self.late = late
+
+    def add(self, day, amount):
+        if day in self.open_days:
+            self.open_days[day] += amount
+            return
+        if self.open_days and day < min(self.open_days) and len(self.open_days) >= self.window:
+            self.late += amount
+            return
+        self.open_days[day] = amount
+        while len(self.open_days) > self.window:
+            closed = min(self.open_days)
+            revenue = self.open_days.pop(closed)
+            if self.best is None or revenue > self.best[1]:
+                self.best = [closed, revenue]
+
+    def result(self):
+        """``(day, revenue, error)`` or None; the true best is at most ``error`` higher."""
+        candidates = list(self.open_days.items()) + ([tuple(self.best)] if self.best else [])
+        if not candidates:
+            return None
+        day, revenue = max(candidates, key=lambda item: item[1])
+        return day, revenue, self.late
+
+    def to_dict(self):
+        return {'window': self.window, 'open_days': self.open_days, 'best': self.best, 'late': self.late}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['window'], data['open_days'], data['best'], data['late'])
+
+
+class Reservoir:
+    """Uniform sample of up to ``size`` values from a stream (algorithm R)."""
+
+    def __init__(self, size=256, sample=None, seen=0):
+        self.size = size
+        self.sample = sample or []
+        self.seen = seen
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+        else:
+            slot = random.randrange(self.seen)
+            if slot < self.size:
+                self.sample[slot] = value
+
+    def mean(self):
+        return sum(self.sample) / len(self.sample) if self.sample else 0.0
+
+    def margin(self, z=1.96):
+        """Half-width of the ~95% confidence interval of ``mean()``."""
+        n = len(self.sample)
+        if n < 2:
+            return 0.0
+        mean = self.mean()
+        variance = sum((x - mean) ** 2 for x in self.sample) / (n - 1)
+        # Finite population correction: a full sample of a short stream is exact
+        correction = math.sqrt((self.seen - n) / (self.seen - 1)) if self.seen > 1 else 0.0
+        return z * math.sqrt(variance / n) * correction
+
+    def to_dict(self):
+        return {'size': self.size, 'seen': self.seen, 'sample': self.sample}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['sample'], data['seen'])
+
+
+# ============= PER-SHOP SKETCH =============
+class ShopSketch:
+    """All-time sketches for one shop; exact transaction and revenue totals alongside."""
+
+    def __init__(self, products=None, units=None, days=None, best_days=None, weekdays=None,
+                 transactions=0, revenue=0.0):
+        self.products = products or SpaceSaving(64)
+        self.units = units or CountMin()
+        self.days = days or HyperLogLog()
+        self.best_days = best_days or BestDay()
+        self.weekdays = weekdays or [Reservoir() for _ in range(7)]
+        self.transactions = transactions
+        self.revenue = revenue
+
+    def add(self, product_id, quantity, amount, date):
+        date = _to_datetime(date)
+        day = date.strftime('%Y-%m-%d')
+        self.transactions += 1
+        self.revenue += amount
+        self.products.add(str(product_id), amount)
+        self.units.add(product_id, quantity)
+        self.days.add(day)
+        self.best_days.add(day, amount)
+        self.weekdays[date.weekday()].add(amount)
+
+    def top_products(self, n=5):
+        """``[{'product_id', 'revenue', 'revenue_error', 'quantity', 'quantity_error'}]``"""
+        return [{
+            'product_id': int(item),
+            'revenue': revenue,
+            'revenue_error': error,
+            'quantity': self.units.estimate(int(item)),
+            'quantity_error': self.units.error_bound(),
+        } for item, revenue, error in self.products.top(n)]
+
+    def best_day(self):
+        """``(date string, revenue, error)`` or None."""
+        return self.best_days.result()
+
+    def active_days(self):
+        """``(estimate, ~95% error)``; small counts are nearly exact."""
+        estimate = self.days.count()
+        return estimate, 2 * self.days.relative_error * estimate
+
+    def weekday_averages(self):
+        """``[(mean sale, ~95% margin, transactions)]`` for Monday..Sunday."""
+        return [(r.mean(), r.margin(), r.seen) for r in self.weekdays]
+
+    def to_json(self):
+        return json.dumps({
+            'products': self.products.to_dict(),
+            'units': self.units.to_dict(),
+            'days': self.days.to_dict(),
+            'best_days': self.best_days.to_dict(),
+            'weekdays': [r.to_dict() for r in self.weekdays],
+            'transactions': self.transactions,
+            'revenue': self.revenue,
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(SpaceSaving.from_dict(data['products']), CountMin.from_dict(data['units']),
+                   HyperLogLog.from_dict(data['days']), BestDay.from_dict(data['best_days']),
+                   [Reservoir.from_dict(r) for r in data['weekdays']], data['transactions'], data['revenue'])
+
+
+# ============= STORAGE =============
+def load(conn, user_id):
+    """The shop's sketch, or None if it uses exact analytics."""
+    row = conn.execute('SELECT state FROM analytics_sketch WHERE user_id = ?', (user_id,)).fetchone()
+    return ShopSketch.from_json(row[0]) if row else None
+
+
+def save(conn, user_id, sketch):
+    conn.execute('''
+        INSERT INTO analytics_sketch (user_id, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    ''', (user_id, sketch.to_json(), datetime.utcnow()))
+
+
+def record_sales(conn, user_id, sales):
+    """Fold ``(product_id, quantity, total_amount, date)`` sales into the shop's sketch, if it has one."""
+    sketch = load(conn, user_id)
+    if sketch is None:
+        return
+    for product_id, quantity, amount, date in sales:
+        sketch.add(product_id, quantity, amount, date)
+    save(conn, user_id, sketch)
+
+
+def rebuild(conn, user_id):
+    """Build the shop's sketch from its whole history (hot and archived) and store it."""
+    sketch = ShopSketch()
+    rows = conn.execute(f'''
+        SELECT product_id, quantity, total_amount, date FROM {archive.sales_sql(conn)}
+        WHERE user_id = ? ORDER BY date
+    ''', (user_id,))
+    for product_id, quantity, amount, date in rows:
+        sketch.add(product_id, quantity or 0, amount or 0, date)
+    save(conn, user_id, sketch)
+    return sketch
+
+
+def rebuild_all(conn):
+    """Rebuild every stored sketch (after history was rewritten)."""
+    try:
+        user_ids = [user_id for (user_id,) in conn.execute('SELECT user_id FROM analytics_sketch')]
+    except sqlite3.OperationalError:
+        return []
+    for user_id in user_ids:
+        rebuild(conn, user_id)
+    return user_ids
+
+
+def drop(conn, user_id):
+    conn.execute('DELETE FROM analytics_sketch WHERE user_id = ?', (user_id,))
+
+
+def _to_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Approximate analytics sketches')
+    parser.add_argument('command', choices=['rebuild', 'show'])
+    parser.add_argument('--user', type=int, default=1)
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == 'rebuild':
+        sketch = rebuild(conn, args.user)
+        conn.commit()
+        print(f'✅ Sketch rebuilt from {sketch.transactions} sales ({len(sketch.to_json()) / 1024:.1f} KB)')
+    else:
+        sketch = load(conn, args.user)
+        if sketch is None:
+            print('❌ No sketch for this shop (exact analytics)')
+            return
+        days, days_error = sketch.active_days()
+        print(f'📊 {sketch.transactions} sales, ~{days:.0f} ± {days_error:.0f} active days')
+        for product in sketch.top_products():
+            print(f'   #{product["product_id"]}: ₹{product["revenue"]:,.0f} (up to {product["revenue_error"]:,.0f} over), '
+                  f'{product["quantity"]:.0f} units (up to {product["quantity_error"]:.0f} over)')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
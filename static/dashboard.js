@@ -0,0 +1,68 @@
+// Keeps the dashboard current from /api/dashboard/stream (server-sent events)
+// instead of reloading the page. EventSource reconnects by itself; every
+// (re)connection starts with a 'refresh' carrying the full state.
+(function () {
+    if (!window.EventSource) return;
+
+    const status = document.getElementById('live-status');
+    const recent = document.getElementById('recent-sales');
+    const alerts = document.getElementById('stock-alerts');
+    const money = (value) => Math.round(value).toLocaleString('en-IN');
+
+    function setTotals(data) {
+        document.getElementById('total-today').textContent = money(data.today);
+        document.getElementById('total-month').textContent = money(data.month);
+        document.getElementById('total-products').textContent = data.total_products;
+        document.getElementById('low-stock').textContent = data.low_stock;
+    }
+
+    function saleRow(sale) {
+        const row = document.createElement('tr');
+        [sale.product_name, sale.quantity, '₹' + sale.total, sale.time].forEach((text) => {
+            const cell = document.createElement('td');
+            cell.textContent = text;
+            row.appendChild(cell);
+        });
+        return row;
+    }
+
+    function setAnomalies(items) {
+        const list = document.getElementById('anomalies');
+        list.replaceChildren(...items.map((item) => {
+            const li = document.createElement('li');
+            li.className = item.kind;
+            li.textContent = (item.today
+                ? `${item.name} today so far: ₹${money(item.actual)} against ₹${money(item.expected)} usual by now`
+                : `${item.day} · ${item.name}: ₹${money(item.actual)}, expected ₹${money(item.expected)}`)
+                + ` (unusually ${item.kind})`;
+            return li;
+        }));
+        document.getElementById('anomalies-box').hidden = items.length === 0;
+    }
+
+    const source = new EventSource('/api/dashboard/stream');
+    source.onopen = () => status.classList.add('connected');
+    source.onerror = () => status.classList.remove('connected');
+
+    source.addEventListener('refresh', (e) => {
+        const data = JSON.parse(e.data);
+        setTotals(data);
+        recent.replaceChildren(...data.recent_sales.map(saleRow));
+        setAnomalies(data.anomalies);
+    });
+    source.addEventListener('totals', (e) => setTotals(JSON.parse(e.data)));
+    source.addEventListener('sale', (e) => {
+        recent.prepend(saleRow(JSON.parse(e.data)));
+        while (recent.children.length > 5) recent.lastElementChild.remove();
+    });
+    source.addEventListener('stock', (e) => {
+        const item = JSON.parse(e.data);
+        const li = document.createElement('li');
+        li.textContent = item.low
+            ? `⚠️ ${item.name} is low: ${item.stock} left`
+            : `✅ ${item.name} restocked: ${item.stock}`;
+        if (!item.low) li.className = 'restocked';
+        alerts.prepend(li);
+        while (alerts.children.length > 5) alerts.lastElementChild.remove();
+    });
+})();
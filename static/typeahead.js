@@ -0,0 +1,87 @@
+// Product picker backed by /api/products/search.
+// Markup: <div class="typeahead"> with an input.typeahead-input, a hidden
+// input[name="product_id"] and an empty ul.typeahead-results.
+function productTypeahead(root) {
+    const input = root.querySelector('.typeahead-input');
+    const hidden = root.querySelector('input[name="product_id"]');
+    const list = root.querySelector('.typeahead-results');
+    let results = [];
+    let active = -1;
+    let timer = null;
+    let latest = 0;
+
+    function render() {
+        list.innerHTML = '';
+        results.forEach((p, i) => {
+            const li = document.createElement('li');
+            li.textContent = `${p.name} (Stock: ${p.current_stock} ${p.unit || ''})`;
+            if (p.category) {
+                const cat = document.createElement('span');
+                cat.className = 'typeahead-category';
+                cat.textContent = p.category;
+                li.appendChild(cat);
+            }
+            if (i === active) li.classList.add('active');
+            li.addEventListener('mousedown', (e) => { e.preventDefault(); choose(i); });
+            list.appendChild(li);
+        });
+        list.style.display = results.length ? 'block' : 'none';
+    }
+
+    function choose(i) {
+        const p = results[i];
+        if (!p) return;
+        hidden.value = p.id;
+        input.value = p.name;
+        results = [];
+        active = -1;
+        render();
+        root.dispatchEvent(new CustomEvent('product-selected', { detail: p }));
+    }
+
+    async function search(q) {
+        const seq = ++latest;
+        const resp = await fetch(`/api/products/search?q=${encodeURIComponent(q)}&limit=10`);
+        if (!resp.ok || seq !== latest) return;
+        results = (await resp.json()).results;
+        active = results.length ? 0 : -1;
+        render();
+    }
+
+    input.addEventListener('input', () => {
+        hidden.value = '';
+        clearTimeout(timer);
+        const q = input.value.trim();
+        if (!q) { results = []; render(); return; }
+        timer = setTimeout(() => search(q), 120);
+    });
+
+    input.addEventListener('keydown', async (e) => {
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            if (!results.length) return;
+            active = (active + (e.key === 'ArrowDown' ? 1 : -1) + results.length) % results.length;
+            render();
+        } else if (e.key === 'Enter' && !hidden.value) {
+            // Barcode scanners send the code followed by Enter
+            e.preventDefault();
+            clearTimeout(timer);
+            await search(input.value.trim());
+            choose(active);
+        } else if (e.key === 'Escape') {
+            results = [];
+            render();
+        }
+    });
+
+    input.addEventListener('blur', () => { list.style.display = 'none'; });
+
+    root.closest('form').addEventListener('submit', (e) => {
+        if (!hidden.value) {
+            e.preventDefault();
+            input.focus();
+        }
+    });
+}
+
+document.querySelectorAll('.typeahead').forEach(productTypeahead);
@@ -0,0 +1,228 @@
+"""Append-only ledger of stock movements with periodic per-product snapshots.
+
+Every change to a product's stock (sale, stock-in, adjustment) is written
+to ``stock_movement`` as a signed quantity.  ``stock_snapshot`` rows
+checkpoint the running balance of a product up to a movement id, so the
+stock of any product, now or as of any date, is its latest applicable
+snapshot plus a short tail of later movements - never a full-table sum.
+
+A snapshot's ``date`` is the latest movement date it includes, which keeps
+as-of queries correct even for back-dated movements (offline tills).
+
+All functions take a sqlite3-compatible DB-API connection and leave
+committing to the caller.
+
+    python stock_ledger.py backfill|snapshot|reconcile [--db instance/shop.db]
+"""
+import argparse
+import os
+import sqlite3
+
+import archive
+
+SNAPSHOT_EVERY = 500      # run snapshot maintenance every N movements
+SNAPSHOT_MIN_TAIL = 50    # ...for products with at least this many unsnapshotted movements
+
+_LATEST_SNAPSHOT = '''
+    SELECT s.product_id, s.movement_id, s.date, s.stock
+    FROM stock_snapshot s
+    JOIN (
+        SELECT product_id, MAX(movement_id) AS movement_id
+        FROM stock_snapshot
+        WHERE {where}
+        GROUP BY product_id
+    ) latest ON latest.product_id = s.product_id AND latest.movement_id = s.movement_id
+'''
+
+
+def record_movements(conn, movements):
+    """Append ``(user_id, product_id, kind, quantity, date, ref_id)`` tuples.
+
+    ``quantity`` is signed: negative for sales, positive for receipts.
+    """
+    if not movements:
+        return
+    conn.executemany('''
+        INSERT INTO stock_movement (user_id, product_id, kind, quantity, date, ref_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(u, p, k, q, str(d), r) for u, p, k, q, d, r in movements])
+    last_id = conn.execute('SELECT MAX(id) FROM stock_movement').fetchone()[0]
+    if last_id // SNAPSHOT_EVERY != (last_id - len(movements)) // SNAPSHOT_EVERY:
+        take_snapshots(conn, min_tail=SNAPSHOT_MIN_TAIL)
+
+
+def take_snapshots(conn, user_id=None, min_tail=1):
+    """Checkpoint every product with at least ``min_tail`` movements since its last snapshot."""
+    where = 'm.user_id = ?' if user_id is not None else '1 = 1'
+    params = [user_id] if user_id is not None else []
+    conn.execute(f'''
+        INSERT INTO stock_snapshot (user_id, product_id, movement_id, date, stock)
+        SELECT m.user_id, m.product_id, MAX(m.id),
+               MAX(COALESCE(s.date, ''), MAX(m.date)),
+               COALESCE(s.stock, 0) + SUM(m.quantity)
+        FROM stock_movement m
+        LEFT JOIN ({_LATEST_SNAPSHOT.format(where='1 = 1')}) s ON s.product_id = m.product_id
+        WHERE m.id > COALESCE(s.movement_id, 0) AND {where}
+        GROUP BY m.product_id
+        HAVING COUNT(*) >= ?
+    ''', params + [min_tail])
+
+
+def stock_levels(conn, user_id, as_of=None):
+    """``{product_id: stock}`` for every product of the shop, now or at ``as_of``.
+
+    ``as_of`` is an inclusive timestamp string/datetime ('YYYY-MM-DD HH:MM:SS').
+    """
+    if as_of is None:
+        snap_where, tail_filter, params = 'user_id = ?', '', [user_id]
+    else:
+        snap_where, tail_filter, params = 'user_id = ? AND date <= ?', 'AND m.date <= ?', [user_id, str(as_of)]
+    tail_params = [str(as_of)] if as_of is not None else []
+    rows = conn.execute(f'''
+        SELECT p.id,
+               COALESCE(s.stock, 0) + COALESCE((
+                   SELECT SUM(m.quantity) FROM stock_movement m
+                   WHERE m.product_id = p.id AND m.id > COALESCE(s.movement_id, 0) {tail_filter}
+               ), 0)
+        FROM product p
+        LEFT JOIN ({_LATEST_SNAPSHOT.format(where=snap_where)}) s ON s.product_id = p.id
+        WHERE p.user_id = ?
+    ''', tail_params + params + [user_id]).fetchall()
+    return dict(rows)
+
+
+def reconcile(conn):
+    """Products whose ``current_stock`` disagrees with the ledger.
+
+    Incremental: only products with movements after the last reconciled
+    movement id are checked, then the checkpoint advances.
+    Returns ``[(product_id, current_stock, ledger_stock)]``.
+    """
+    row = conn.execute("SELECT movement_id FROM ledger_checkpoint WHERE name = 'reconcile'").fetchone()
+    since = row[0] if row else 0
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM stock_movement').fetchone()[0]
+
+    touched = {}
+    for user_id, product_id in conn.execute(
+            'SELECT DISTINCT user_id, product_id FROM stock_movement WHERE id > ?', (since,)):
+        touched.setdefault(user_id, set()).add(product_id)
+
+    mismatches = []
+    for user_id, product_ids in touched.items():
+        ledger = stock_levels(conn, user_id)
+        for product_id, current in conn.execute('SELECT id, current_stock FROM product WHERE user_id = ?', (user_id,)):
+            if product_id in product_ids and abs((current or 0) - ledger.get(product_id, 0)) > 1e-6:
+                mismatches.append((product_id, current, ledger.get(product_id, 0)))
+
+    conn.execute('''
+        INSERT INTO ledger_checkpoint (name, movement_id) VALUES ('reconcile', ?)
+        ON CONFLICT (name) DO UPDATE SET movement_id = excluded.movement_id
+    ''', (last_id,))
+    return mismatches
+
+
+def _seed_from_history(conn):
+    conn.execute(f'''
+        INSERT INTO stock_movement (user_id, product_id, kind, quantity, date, ref_id)
+        SELECT user_id, product_id, kind, quantity, date, ref_id FROM (
+            SELECT user_id, product_id, 'stock_in' AS kind, quantity, date, id AS ref_id FROM stock_in
+            UNION ALL
+            SELECT user_id, product_id, 'sale', -quantity, date, id FROM {archive.sales_sql(conn)}
+        )
+        WHERE product_id IN (SELECT id FROM product)
+        ORDER BY date
+    ''')
+
+
+def _snapshot_history(conn):
+    """Snapshot every product each ``SNAPSHOT_MIN_TAIL`` movements through the whole ledger."""
+    conn.execute('''
+        INSERT INTO stock_snapshot (user_id, product_id, movement_id, date, stock)
+        SELECT user_id, product_id, id, run_date, run_stock FROM (
+            SELECT user_id, product_id, id,
+                   MAX(date) OVER w AS run_date,
+                   SUM(quantity) OVER w AS run_stock,
+                   ROW_NUMBER() OVER w AS n,
+                   COUNT(*) OVER (PARTITION BY product_id) AS total
+            FROM stock_movement
+            WINDOW w AS (PARTITION BY product_id ORDER BY id ROWS UNBOUNDED PRECEDING)
+        )
+        WHERE n % ? = 0 OR n = total
+    ''', (SNAPSHOT_MIN_TAIL,))
+
+
+def backfill(conn):
+    """Seed an empty ledger from ``stock_in`` / ``sale`` history.
+
+    Each product also gets an opening 'adjustment' (dated at its first
+    movement) so that the ledger balance matches ``current_stock``.
+    Returns the number of movements written (0 if the ledger was not empty).
+    """
+    if conn.execute('SELECT 1 FROM stock_movement LIMIT 1').fetchone():
+        return 0
+    _seed_from_history(conn)
+    conn.execute('''
+        INSERT INTO stock_movement (user_id, product_id, kind, quantity, date, ref_id)
+        SELECT p.user_id, p.id, 'adjustment', COALESCE(p.current_stock, 0) - COALESCE(t.total, 0),
+               COALESCE(t.first_date, DATETIME('now')), NULL
+        FROM product p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS total, MIN(date) AS first_date
+            FROM stock_movement GROUP BY product_id
+        ) t ON t.product_id = p.id
+        WHERE ABS(COALESCE(p.current_stock, 0) - COALESCE(t.total, 0)) > 1e-9
+    ''')
+    _snapshot_history(conn)
+    return conn.execute('SELECT COUNT(*) FROM stock_movement').fetchone()[0]
+
+
+def rebuild(conn):
+    """Recreate the ledger from ``stock_in`` / ``sale`` and reset ``current_stock`` from it.
+
+    Used by the data generators, where history is the source of truth.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stock_movement'").fetchone():
+        # Ledger tables are created by the app; until then just recompute the totals
+        conn.execute(f'''
+            UPDATE product SET current_stock =
+                COALESCE((SELECT SUM(quantity) FROM stock_in WHERE product_id = product.id), 0)
+                - COALESCE((SELECT SUM(quantity) FROM {archive.sales_sql(conn)} WHERE product_id = product.id), 0)
+        ''')
+        return
+    conn.execute('DELETE FROM stock_snapshot')
+    conn.execute('DELETE FROM stock_movement')
+    conn.execute('DELETE FROM ledger_checkpoint')
+    _seed_from_history(conn)
+    _snapshot_history(conn)
+    conn.execute(f'''
+        UPDATE product SET current_stock = COALESCE((
+            SELECT s.stock FROM ({_LATEST_SNAPSHOT.format(where='1 = 1')}) s WHERE s.product_id = product.id
+        ), 0)
+    ''')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stock movement ledger maintenance')
+    parser.add_argument('command', choices=['backfill', 'snapshot', 'reconcile'])
+    parser.add_argument('--db', default=os.path.join('instance', 'shop.db'))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == 'backfill':
+        print(f'✅ Ledger backfilled with {backfill(conn)} movements')
+    elif args.command == 'snapshot':
+        before = conn.execute('SELECT COUNT(*) FROM stock_snapshot').fetchone()[0]
+        take_snapshots(conn)
+        after = conn.execute('SELECT COUNT(*) FROM stock_snapshot').fetchone()[0]
+        print(f'✅ {after - before} snapshots taken')
+    else:
+        mismatches = reconcile(conn)
+        for pid, current, ledger in mismatches:
+            print(f'   ⚠️ Product {pid}: current_stock {current} but ledger says {ledger}')
+        print(f'✅ Reconciled ({len(mismatches)} mismatches)')
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Offline-capable till: record sales locally, upload them in batches.
+
+Sales are appended to a local SQLite journal with a client-generated id
+the moment they happen, so the till keeps working when the shop server is
+slow or unreachable.  ``sync`` uploads pending sales to
+``/api/sync/sales`` in batches; the server applies each batch in one
+transaction and ignores ids it has already seen, so an interrupted sync is
+simply retried.
+
+    python till.py sell 12 2
+    python till.py sell 18 1 --basket 7f3c...   # lines of one customer share a basket
+    python till.py sync --server http://shop:5000 --username demo_shop --password ...
+    python till.py sync --watch 30 ...
+    python till.py status
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import sqlite3
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+DEFAULT_QUEUE = os.path.join('instance', 'till_queue.db')
+
+# Statuses after which a queued sale is never sent again
+FINAL_STATUSES = ('applied', 'duplicate', 'conflict', 'rejected', 'invalid')
+
+
+class TillQueue:
+    """Append-only local journal of sales awaiting upload."""
+
+    def __init__(self, path=DEFAULT_QUEUE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS queued_sale (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_id TEXT NOT NULL UNIQUE,
+                product_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                date TEXT NOT NULL,
+                basket_id TEXT,
+                status TEXT,
+                detail TEXT,
+                synced_at TEXT
+            )
+        ''')
+        # Queues created before sales carried a basket id
+        if 'basket_id' not in {row[1] for row in self.conn.execute('PRAGMA table_info(queued_sale)')}:
+            self.conn.execute('ALTER TABLE queued_sale ADD COLUMN basket_id TEXT')
+        self.conn.commit()
+
+    def record_sale(self, product_id, quantity, date=None, basket_id=None):
+        """Queue one sale line; lines of the same customer should share a ``basket_id``."""
+        client_id = str(uuid.uuid4())
+        date = (date or datetime.now()).isoformat(sep=' ')
+        self.conn.execute(
+            'INSERT INTO queued_sale (client_id, product_id, quantity, date, basket_id) VALUES (?, ?, ?, ?, ?)',
+            (client_id, product_id, quantity, date, basket_id))
+        self.conn.commit()
+        return client_id
+
+    def pending(self, limit):
+        rows = self.conn.execute('''
+            SELECT client_id, product_id, quantity, date, basket_id FROM queued_sale
+            WHERE status IS NULL ORDER BY seq LIMIT ?
+        ''', (limit,)).fetchall()
+        return [{'client_id': r[0], 'product_id': r[1], 'quantity': r[2], 'date': r[3], 'basket_id': r[4]}
+                for r in rows]
+
+    def mark(self, results):
+        now = datetime.now().isoformat(sep=' ')
+        rows = []
+        for r in results:
+            if r.get('status') not in FINAL_STATUSES or not r.get('client_id'):
+                continue
+            extra = {k: v for k, v in r.items() if k not in ('client_id', 'status')}
+            rows.append((r['status'], json.dumps(extra) if extra else None, now, r['client_id']))
+        self.conn.executemany(
+            'UPDATE queued_sale SET status = ?, detail = ?, synced_at = ? WHERE client_id = ?', rows)
+        self.conn.commit()
+
+    def counts(self):
+        return dict(self.conn.execute(
+            "SELECT COALESCE(status, 'pending'), COUNT(*) FROM queued_sale GROUP BY 1").fetchall())
+
+
+class TillClient:
+    """Minimal HTTP client for the shop server using the normal login session."""
+
+    def __init__(self, server, username, password, timeout=10):
+        self.server = server.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.logged_in = False
+
+    def login(self):
+        data = urllib.parse.urlencode({'username': self.username, 'password': self.password}).encode()
+        with self.opener.open(f'{self.server}/login', data, timeout=self.timeout) as resp:
+            if not resp.geturl().endswith('/dashboard'):
+                raise RuntimeError('Login failed: check till credentials')
+        self.logged_in = True
+
+    def post_json(self, path, payload):
+        if not self.logged_in:
+            self.login()
+        req = urllib.request.Request(f'{self.server}{path}', json.dumps(payload).encode(),
+                                     {'Content-Type': 'application/json'})
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 401:
+                raise
+        # Session expired: log in again and retry once
+        self.login()
+        with self.opener.open(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+
+def sync(queue, client, batch_size=500):
+    """Upload every pending sale; returns the summed status counts.
+
+    Stops (leaving the rest queued) if the server cannot be reached.
+    """
+    totals = {}
+    while True:
+        batch = queue.pending(batch_size)
+        if not batch:
+            return totals
+        response = client.post_json('/api/sync/sales', {'sales': batch})
+        queue.mark(response['results'])
+        for status, count in response['counts'].items():
+            totals[status] = totals.get(status, 0) + count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline till: local sale journal with batched sync')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sell = sub.add_parser('sell', help='record a sale locally')
+    sell.add_argument('product_id', type=int)
+    sell.add_argument('quantity', type=float)
+    sell.add_argument('--basket', help='basket id shared by the lines of one customer')
+
+    up = sub.add_parser('sync', help='upload pending sales')
+    up.add_argument('--server', default=os.environ.get('TILL_SERVER', 'http://127.0.0.1:5000'))
+    up.add_argument('--username', default=os.environ.get('TILL_USERNAME'))
+    up.add_argument('--password', default=os.environ.get('TILL_PASSWORD'))
+    up.add_argument('--batch-size', type=int, default=500)
+    up.add_argument('--watch', type=float, help='keep syncing every N seconds')
+
+    sub.add_parser('status', help='show queue counts')
+    args = parser.parse_args()
+
+    queue = TillQueue(args.queue)
+    if args.command == 'sell':
+        client_id = queue.record_sale(args.product_id, args.quantity, basket_id=args.basket)
+        print(f'✅ Sale queued ({client_id})')
+    elif args.command == 'status':
+        for status, count in sorted(queue.counts().items()):
+            print(f'   {status}: {count}')
+    else:
+        client = TillClient(args.server, args.username, args.password)
+        while True:
+            try:
+                totals = sync(queue, client, args.batch_size)
+                if totals:
+                    print('🔄 Synced: ' + ', '.join(f'{k} {v}' for k, v in sorted(totals.items())))
+            except (urllib.error.URLError, OSError) as e:
+                print(f'⚠️ Server unreachable, sales stay queued: {e}')
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
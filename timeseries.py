@@ -0,0 +1,211 @@
+"""Time-bucketed sales aggregation.
+
+One grouped query per call returns revenue, units, transactions and profit
+for any date range, bucketed by hour, day, week (Monday start), month or
+year and/or broken down by product, category or weekday.  ``series()``
+fills empty buckets with zeros so charts and tables get a row per period.
+
+Profit is revenue less the cost price in effect when each sale was made,
+looked up in the price history with one range join (see pricing.py);
+archived days use the cost frozen with their totals.  Ranges that reach archived months also read the
+archive (see archive.py).  All functions take a sqlite3-compatible DB-API
+connection.
+"""
+from datetime import date, datetime, timedelta
+
+import archive
+import pricing
+
+GRANULARITIES = ('hour', 'day', 'week', 'month', 'year')
+
+_BUCKETS = {
+    'hour': "STRFTIME('%Y-%m-%d %H:00:00', {date})",
+    'day': "DATE({date})",
+    'week': "DATE({date}, 'weekday 0', '-6 days')",
+    'month': "STRFTIME('%Y-%m-01', {date})",
+    'year': "STRFTIME('%Y-01-01', {date})",
+}
+
+_DIMENSIONS = {
+    'product': 's.product_id',
+    'category': 'p.category',
+    'weekday': "(CAST(STRFTIME('%w', {date}) AS INTEGER) + 6) % 7",  # Monday = 0
+}
+
+# Where a query reads from: raw sale rows, or the frozen per-day totals of archived months
+_RAW = {'date': 's.date', 'revenue': 's.total_amount', 'units': 's.quantity', 'transactions': '1',
+        'cost': 's.quantity * COALESCE(pp.cost_price, p.cost_price)', 'join': pricing.COST_JOIN.format(date='s.date')}
+_SUMMARY = {'date': 's.day', 'revenue': 's.revenue', 'units': 's.units', 'transactions': 's.transactions',
+            'cost': 'COALESCE(s.cost, s.units * p.cost_price)', 'join': ''}
+
+METRICS = ('revenue', 'units', 'transactions', 'profit')
+
+_EMPTY = dict.fromkeys(METRICS, 0)
+
+
+def floor(moment, granularity):
+    """Start of the bucket containing ``moment``."""
+    moment = _to_datetime(moment)
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'week':
+        return moment - timedelta(days=moment.weekday())
+    if granularity == 'month':
+        return moment.replace(day=1)
+    if granularity == 'year':
+        return moment.replace(month=1, day=1)
+    return moment
+
+
+def next_bucket(start, granularity):
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+
+def bucket_count(start, end, granularity):
+    """How many buckets ``buckets(start, end, granularity)`` returns, without building them."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+    first, end = floor(start, granularity), _to_datetime(end)
+    if end <= first:
+        return 0
+    if granularity in ('month', 'year'):
+        last = floor(end, granularity)
+        months = (last.year - first.year) * 12 + last.month - first.month
+        count = months if granularity == 'month' else last.year - first.year
+        return count + (last < end)
+    step = {'hour': timedelta(hours=1), 'day': timedelta(days=1), 'week': timedelta(days=7)}[granularity]
+    return -((first - end) // step)
+
+
+def buckets(start, end, granularity):
+    """Bucket starts covering ``[start, end)``."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+    current, end = floor(start, granularity), _to_datetime(end)
+    result = []
+    while current < end:
+        result.append(current)
+        current = next_bucket(current, granularity)
+    return result
+
+
+def query(conn, user_id, start=None, end=None, granularity=None, by=None,
+          product_ids=None, category=None):
+    """Raw grouped rows: ``[{'bucket', 'key', 'revenue', 'units', 'transactions', 'profit'}]``.
+
+    ``start`` is inclusive, ``end`` exclusive; either may be None for an
+    open range.  ``bucket`` is the bucket start string (None without a
+    granularity), ``key`` the ``by`` value (None without one).
+    """
+    if granularity is not None and granularity not in _BUCKETS:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+    if by is not None and by not in _DIMENSIONS:
+        raise ValueError(f'by must be one of {", ".join(_DIMENSIONS)}')
+
+    start, end = _to_datetime(start), _to_datetime(end)
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return []
+
+    sources = [('sale', _RAW)]
+    months = archive.overlapping(archive.archived_months(conn), start, end)
+    if months:
+        if granularity == 'hour' or not _whole_days(start, end):
+            sources = [(archive.sales_sql(conn, start, end), _RAW)]
+        else:
+            sources.append(('sale_day_summary', _SUMMARY))
+
+    rows = []
+    for table, columns in sources:
+        rows.extend(_grouped(conn, table, columns, user_id, start, end, granularity, by, product_ids, category))
+    if len(sources) == 1:
+        return [dict(zip(('bucket', 'key') + METRICS, row)) for row in rows]
+
+    # Hot and archived rows can share a bucket (late sales, the boundary month)
+    merged = {}
+    for bucket, key, *metrics in rows:
+        total = merged.setdefault((bucket, key), [0] * len(METRICS))
+        for i, value in enumerate(metrics):
+            total[i] += value
+    return [dict(zip(('bucket', 'key') + METRICS, group + tuple(metrics)))
+            for group, metrics in sorted(merged.items(), key=lambda item: [(v is not None, v) for v in item[0]])]
+
+
+def _grouped(conn, table, columns, user_id, start, end, granularity, by, product_ids, category):
+    date_column = columns['date']
+    if columns is _SUMMARY:
+        # Summary rows are whole days
+        start, end = start and start.date(), end and end.date()
+    where, params = ['s.user_id = ?'], [user_id]
+    if start is not None:
+        where.append(f'{date_column} >= ?')
+        params.append(str(start))
+    if end is not None:
+        where.append(f'{date_column} < ?')
+        params.append(str(end))
+    if product_ids is not None:
+        where.append(f's.product_id IN ({", ".join("?" * len(product_ids))})')
+        params.extend(product_ids)
+    if category is not None:
+        where.append('p.category = ?')
+        params.append(category)
+
+    bucket = _BUCKETS[granularity].format(date=date_column) if granularity else 'NULL'
+    key = _DIMENSIONS[by].format(date=date_column) if by else 'NULL'
+    return conn.execute(f'''
+        SELECT {bucket} AS bucket, {key} AS key,
+               COALESCE(SUM({columns['revenue']}), 0),
+               COALESCE(SUM({columns['units']}), 0),
+               COALESCE(SUM({columns['transactions']}), 0),
+               COALESCE(SUM({columns['revenue']} - {columns['cost']}), 0)
+        FROM {table} s
+        LEFT JOIN product p ON p.id = s.product_id
+        {columns['join']}
+        WHERE {' AND '.join(where)}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    ''', params).fetchall()
+
+
+def series(conn, user_id, start, end, granularity='day', **filters):
+    """Gap-filled ``[{'start': datetime, 'revenue', 'units', 'transactions', 'profit'}]`` over ``[start, end)``."""
+    found = {row['bucket']: row for row in query(conn, user_id, start, end, granularity, **filters)}
+    result = []
+    for bucket_start in buckets(start, end, granularity):
+        row = found.get(_bucket_key(bucket_start, granularity), _EMPTY)
+        result.append(dict({m: row[m] for m in METRICS}, start=bucket_start))
+    return result
+
+
+def totals(conn, user_id, by, start=None, end=None, **filters):
+    """``{key: {'revenue', 'units', 'transactions', 'profit'}}`` broken down ``by`` a dimension."""
+    return {row['key']: {m: row[m] for m in METRICS}
+            for row in query(conn, user_id, start, end, by=by, **filters)}
+
+
+def _bucket_key(bucket_start, granularity):
+    if granularity == 'hour':
+        return bucket_start.strftime('%Y-%m-%d %H:00:00')
+    return bucket_start.strftime('%Y-%m-%d')
+
+
+def _whole_days(start, end):
+    return all(moment is None or moment == floor(moment, 'day') for moment in (start, end))
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
@@ -0,0 +1,158 @@
+"""Stock valuation and inventory aging.
+
+How much capital sits in stock, how long it will last and how old it is,
+per product and per category.  On-hand units are assumed to be the most
+recent receipts (first in, first out), so each ``stock_in`` lot still
+holds ``min(lot, on hand - newer lots)`` units, valued at that lot's cost
+and aged from its date.  Stock the lots cannot explain (opening balances,
+positive adjustments) is valued at the product's cost price and reported
+as untracked.  Days of cover divide on-hand units by the average daily
+sales of the last ``VELOCITY_DAYS``.
+
+``compute`` reads products, lots and sales velocity with three grouped
+queries and does the per-lot FIFO and bucketing as numpy array operations.
+Reports are cached per shop data version (see ``ReportCache``).
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import timeseries
+
+VELOCITY_DAYS = 30
+AGE_LIMITS = (30, 60, 90)   # upper bounds (days) of every bucket but the last
+BUCKETS = ('0-30 days', '31-60 days', '61-90 days', '90+ days', 'Untracked')
+
+
+def compute(conn, user_id, as_of=None):
+    """Valuation report of the shop's current stock, aged as of ``as_of`` (default today).
+
+    Returns ``{'as_of', 'buckets', 'totals', 'categories', 'products'}``;
+    each product / category / total has ``units``, ``value`` (at cost),
+    ``retail_value``, ``avg_daily``, ``days_of_cover`` (None without recent
+    sales), ``avg_age`` (days, over tracked units) and ``aging`` (value per
+    bucket).
+    """
+    import numpy as np
+
+    as_of = _to_date(as_of) or date.today()
+    products = conn.execute('''
+        SELECT id, name, category, current_stock, cost_price, selling_price
+        FROM product WHERE user_id = ? ORDER BY id
+    ''', (user_id,)).fetchall()
+    if not products:
+        return {'as_of': str(as_of), 'buckets': list(BUCKETS), 'totals': _empty_totals(), 'categories': [], 'products': []}
+    index = {row[0]: i for i, row in enumerate(products)}
+    on_hand = np.array([max(row[3] or 0.0, 0.0) for row in products])
+    unit_cost = np.array([row[4] or 0.0 for row in products])
+    unit_price = np.array([row[5] or 0.0 for row in products])
+
+    # Lots newest first within each product
+    lots = [row for row in conn.execute('''
+        SELECT product_id, quantity, cost_price, DATE(date) FROM stock_in
+        WHERE user_id = ? AND quantity > 0 AND date < ?
+        ORDER BY product_id, date DESC, id DESC
+    ''', (user_id, str(as_of + timedelta(days=1)))) if row[0] in index]
+    lot_product = np.array([index[row[0]] for row in lots], dtype=int)
+    lot_qty = np.array([row[1] for row in lots], dtype=float)
+    lot_cost = np.array([row[2] if row[2] is not None else unit_cost[index[row[0]]] for row in lots], dtype=float)
+    lot_age = np.array([(as_of - date.fromisoformat(row[3])).days for row in lots], dtype=float)
+
+    # FIFO: units received after a lot (within its product) are sold last, so they are on hand first
+    newer = np.cumsum(lot_qty) - lot_qty
+    if len(lots):
+        starts = np.r_[0, np.flatnonzero(np.diff(lot_product)) + 1]
+        newer -= np.repeat(newer[starts], np.diff(np.r_[starts, len(lots)]))
+    remaining = np.clip(on_hand[lot_product] - newer, 0, lot_qty) if len(lots) else lot_qty
+    bucket = np.digitize(lot_age, np.array(AGE_LIMITS) + 0.5)
+
+    n = len(products)
+    aging_value = np.zeros((n, len(BUCKETS)))
+    aging_units = np.zeros((n, len(BUCKETS)))
+    np.add.at(aging_value, (lot_product, bucket), remaining * lot_cost)
+    np.add.at(aging_units, (lot_product, bucket), remaining)
+    tracked = aging_units[:, :-1].sum(axis=1)
+    untracked = np.maximum(on_hand - tracked, 0)
+    aging_units[:, -1] = untracked
+    aging_value[:, -1] = untracked * unit_cost
+    age_days = np.bincount(lot_product, weights=remaining * lot_age, minlength=n)
+
+    sold = timeseries.totals(conn, user_id, by='product',
+                             start=as_of - timedelta(days=VELOCITY_DAYS - 1), end=as_of + timedelta(days=1))
+    velocity = np.array([sold.get(row[0], {}).get('units', 0.0) for row in products]) / VELOCITY_DAYS
+
+    product_rows = []
+    for i, row in enumerate(products):
+        product_rows.append(dict(
+            _summary(on_hand[i], aging_value[i], aging_units[i], on_hand[i] * unit_price[i], velocity[i], age_days[i], tracked[i]),
+            product_id=row[0], name=row[1], category=row[2] or 'Uncategorised'))
+    product_rows.sort(key=lambda p: p['value'], reverse=True)
+
+    # Category and shop totals are plain sums of the product arrays
+    categories, category_index = np.unique([row[2] or 'Uncategorised' for row in products], return_inverse=True)
+    category_rows = []
+    for c, name in enumerate(categories):
+        mask = category_index == c
+        category_rows.append(dict(
+            _summary(on_hand[mask].sum(), aging_value[mask].sum(axis=0), aging_units[mask].sum(axis=0),
+                     (on_hand[mask] * unit_price[mask]).sum(), velocity[mask].sum(), age_days[mask].sum(),
+                     tracked[mask].sum()),
+            category=str(name), products=int(mask.sum())))
+    category_rows.sort(key=lambda c: c['value'], reverse=True)
+
+    totals = _summary(on_hand.sum(), aging_value.sum(axis=0), aging_units.sum(axis=0), (on_hand * unit_price).sum(),
+                      velocity.sum(), age_days.sum(), tracked.sum())
+    return {'as_of': str(as_of), 'buckets': list(BUCKETS), 'totals': totals,
+            'categories': category_rows, 'products': product_rows}
+
+
+def _summary(units, aging_value, aging_units, retail_value, velocity, age_days, tracked):
+    return {
+        'units': round(float(units), 2),
+        'value': round(float(aging_value.sum()), 2),
+        'retail_value': round(float(retail_value), 2),
+        'avg_daily': round(float(velocity), 2),
+        'days_of_cover': round(float(units / velocity), 1) if velocity > 0 else None,
+        'avg_age': round(float(age_days / tracked), 1) if tracked > 0 else None,
+        'aging': {label: round(float(v), 2) for label, v in zip(BUCKETS, aging_value)},
+        'aging_units': {label: round(float(u), 2) for label, u in zip(BUCKETS, aging_units)},
+    }
+
+
+def _empty_totals():
+    return {'units': 0, 'value': 0, 'retail_value': 0, 'avg_daily': 0, 'days_of_cover': None, 'avg_age': None,
+            'aging': dict.fromkeys(BUCKETS, 0), 'aging_units': dict.fromkeys(BUCKETS, 0)}
+
+
+def _to_date(value):
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+class ReportCache:
+    """Thread-safe LRU of computed reports keyed by ``(user_id, data version..., day)``.
+
+    A sale, stock-in or catalog change moves the shop to a new data version,
+    so stale reports are never hit again and simply age out.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, compute_report):
+        with self._lock:
+            report = self._entries.get(key)
+            if report is not None:
+                self._entries.move_to_end(key)
+                return report
+        report = compute_report()
+        with self._lock:
+            self._entries[key] = report
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return report